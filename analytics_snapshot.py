@@ -0,0 +1,391 @@
+# analytics_snapshot.py
+"""
+Snapshot local (SQLite) des agrégats quotidiens de sales.box_sales.
+
+La plupart des questions portent sur les mêmes métriques : acquisitions par jour, pays, coupon,
+acquis_status_lvl2, part de cannot_suspend, cumul par jour de cycle. Au lieu de rescanner
+BigQuery à chaque fois :
+- un job de fond matérialise COUNT(*) par (jour de paiement × dimensions) dans un fichier SQLite :
+  historique complet au premier passage, puis seuls les ANALYTICS_SNAPSHOT_LOOKBACK_DAYS derniers
+  jours sont recalculés (paiements / statuts mis à jour en retard)
+- `answer()` traduit une requête BigQuery en requête sur le snapshot quand elle n'utilise que ces
+  dimensions et des agrégats additifs (COUNT(*), COUNTIF, SUM, AVG, MIN, MAX, COUNT(DISTINCT dim)),
+  avec un filtre sur DATE(payment_date) couvert par le snapshot ; sinon None → BigQuery.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from dateutil import tz
+from dateutil.relativedelta import relativedelta
+from google.cloud import bigquery
+from sqlglot import exp
+import sql_ast
+from bq_config import (
+    ANALYTICS_SNAPSHOT_ENABLED,
+    ANALYTICS_SNAPSHOT_PATH,
+    ANALYTICS_SNAPSHOT_HISTORY_DAYS,
+    ANALYTICS_SNAPSHOT_LOOKBACK_DAYS,
+    ANALYTICS_SNAPSHOT_REFRESH_MIN,
+    ANALYTICS_SNAPSHOT_MAX_AGE_MIN
+)
+
+PARIS = tz.gettz("Europe/Paris")
+SOURCE_DATASET, SOURCE_TABLE = "sales", "box_sales"
+DATE_COLUMN = "payment_date"  # stocké au jour : utilisable uniquement via DATE(payment_date)
+DIMENSIONS = (
+    "dw_country_code", "box_id", "day_in_cycle", "coupon",
+    "acquis_status_lvl1", "acquis_status_lvl2", "payment_status", "cannot_suspend",
+)
+# Nombre de lignes BigQuery agrégées dans la ligne du snapshot (nom qu'un alias du modèle ne prend pas)
+WEIGHT = "__n"
+_COLUMNS = {DATE_COLUMN, WEIGHT, *DIMENSIONS}
+
+# Borne sur la colonne brute (élagable) : DATE(payment_date) >= @start lirait toute la table
+_LOAD_SQL = f"""
+SELECT DATE({DATE_COLUMN}) AS {DATE_COLUMN}, {", ".join(DIMENSIONS)}, COUNT(*) AS {WEIGHT}
+FROM `{{table}}`
+WHERE {DATE_COLUMN} >= TIMESTAMP(@start)
+GROUP BY ALL
+"""
+
+# Nœuds sqlglot qu'on sait rejouer à l'identique sur les agrégats
+_ALLOWED = (
+    exp.Select, exp.From, exp.Table, exp.TableAlias, exp.Identifier, exp.Column, exp.Star, exp.Alias,
+    exp.Where, exp.Group, exp.Having, exp.Order, exp.Ordered, exp.Limit, exp.Window,
+    exp.Literal, exp.Null, exp.Boolean, exp.Paren, exp.Not, exp.Neg, exp.And, exp.Or,
+    exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Is, exp.In, exp.Between,
+    exp.Add, exp.Sub, exp.Mul, exp.Div, exp.Case, exp.If, exp.Coalesce, exp.Nullif, exp.SafeDivide,
+    exp.Round, exp.Distinct, exp.Count, exp.CountIf, exp.Sum, exp.Avg, exp.Min, exp.Max,
+    exp.Date, exp.CurrentDate, exp.DateSub, exp.DateAdd, exp.Var, exp.Cast, exp.DataType,
+)
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DATE_UNITS = {"DAY": "days", "WEEK": "weeks", "MONTH": "months", "QUARTER": "months", "YEAR": "years"}
+
+
+# ---------------------------------------
+# Traduction BigQuery → snapshot
+# ---------------------------------------
+def _literal_date(node) -> Optional[str]:
+    """'YYYY-MM-DD' d'un littéral de date ('…', DATE '…', DATE('…'))."""
+    if isinstance(node, (exp.Cast, exp.Date)) and isinstance(node.this, exp.Literal):
+        node = node.this
+    if isinstance(node, exp.Literal) and node.is_string and _DATE_RE.match(node.this):
+        return node.this
+    return None
+
+
+def _constant_date(node) -> Optional[str]:
+    """Valeur d'une expression de date constante (CURRENT_DATE, DATE_SUB(…), littéral), ou None."""
+    if isinstance(node, exp.CurrentDate):
+        zone = node.this.this if isinstance(node.this, exp.Literal) else "UTC"
+        return datetime.now(tz.gettz(zone) or tz.UTC).date().isoformat()
+    if isinstance(node, (exp.DateSub, exp.DateAdd)):
+        base, amount = _literal_date(node.this), node.expression
+        unit = (node.text("unit") or "DAY").upper()
+        if not base or unit not in _DATE_UNITS or not isinstance(amount, exp.Literal):
+            return None
+        try:
+            count = int(amount.this) * (3 if unit == "QUARTER" else 1)
+        except ValueError:
+            return None
+        delta = relativedelta(**{_DATE_UNITS[unit]: count})
+        day = datetime.strptime(base, "%Y-%m-%d").date()
+        return (day - delta if isinstance(node, exp.DateSub) else day + delta).isoformat()
+    return _literal_date(node)
+
+
+def _fold_dates(node: exp.Expression):
+    """Remplace (de bas en haut) les expressions de date constantes par des littéraux."""
+    for child in list(node.iter_expressions()):
+        _fold_dates(child)
+    if not isinstance(node, exp.Literal):
+        value = _constant_date(node)
+        if value:
+            node.replace(exp.Literal.string(value))
+
+
+def _lower_bound(where: Optional[exp.Where]) -> Optional[str]:
+    """Borne basse de payment_date imposée par le WHERE (conjonctions de premier niveau)."""
+    if where is None:
+        return None
+    bounds = []
+    preds = list(where.this.flatten()) if isinstance(where.this, exp.And) else [where.this]
+    for pred in preds:
+        if not isinstance(pred.this, exp.Column) or pred.this.name.lower() != DATE_COLUMN:
+            continue
+        if isinstance(pred, exp.Between):
+            bounds.append(_literal_date(pred.args.get("low")))
+        elif isinstance(pred, (exp.EQ, exp.GTE, exp.GT)):
+            bounds.append(_literal_date(pred.expression))
+    bounds = [b for b in bounds if b]
+    return max(bounds) if bounds else None
+
+
+def _same_column(expression: exp.Expression, name: str) -> bool:
+    """`dim AS dim` ou `DATE(payment_date) AS payment_date` : l'alias désigne la colonne elle-même."""
+    if name == DATE_COLUMN and isinstance(expression, exp.Date) \
+            and expression.args.get("zone") is None and not expression.expressions:
+        expression = expression.this
+    return isinstance(expression, exp.Column) and expression.name.lower() == name
+
+
+def _weighted(agg: exp.Expression) -> Optional[exp.Expression]:
+    """Agrégat BigQuery → même agrégat sur les lignes pondérées par WEIGHT (None si non additif)."""
+    weight = exp.column(WEIGHT)
+    arg = agg.this
+    if isinstance(agg, exp.Count):
+        if isinstance(arg, exp.Distinct):
+            return agg  # COUNT(DISTINCT dim) : les dimensions sont conservées telles quelles
+        if arg is None or isinstance(arg, (exp.Star, exp.Literal)):
+            return exp.Sum(this=weight)
+        return exp.Sum(this=exp.Case().when(exp.Not(this=exp.Is(this=arg, expression=exp.Null())), weight)
+                       .else_(exp.Literal.number(0)))
+    if isinstance(agg, exp.CountIf):
+        return exp.Sum(this=exp.Case().when(arg, weight).else_(exp.Literal.number(0)))
+    if isinstance(agg, exp.Sum):
+        return exp.Sum(this=exp.Mul(this=exp.Paren(this=arg), expression=weight))
+    if isinstance(agg, exp.Avg):
+        total = exp.Sum(this=exp.Mul(this=exp.Paren(this=arg), expression=weight))
+        count = exp.Sum(this=exp.Case().when(exp.Not(this=exp.Is(this=arg, expression=exp.Null())), weight))
+        return exp.Div(this=total, expression=count)
+    if isinstance(agg, (exp.Min, exp.Max)):
+        return agg
+    return None
+
+
+def translate(sql: str, project: str) -> Optional[Tuple[str, str]]:
+    """
+    (requête SQLite sur le snapshot, borne basse de payment_date) si la requête peut être servie
+    par le snapshot, sinon None.
+    """
+    tree = sql_ast.parse(sql)
+    if not isinstance(tree, exp.Select) or tree.args.get("with_") or tree.args.get("joins"):
+        return None
+    tables = list(tree.find_all(exp.Table))
+    if len(tables) != 1 or len(list(tree.find_all(exp.Select))) != 1:
+        return None
+    table = tables[0]
+    if table.name.lower() != SOURCE_TABLE or table.db.lower() != SOURCE_DATASET \
+            or table.catalog not in ("", project):
+        return None
+
+    tree = tree.copy()
+    table = tree.find(exp.Table)
+    _fold_dates(tree)
+    if any(not isinstance(node, _ALLOWED) for node in tree.walk()):
+        return None
+
+    # Colonnes anonymes nommées comme BigQuery (f0_, f1_, …) plutôt que d'après le SQL réécrit
+    anonymous = 0
+    for expression in list(tree.expressions):
+        if not expression.alias and not isinstance(expression, exp.Column):
+            expression.replace(exp.alias_(expression.copy(), f"f{anonymous}_"))
+            anonymous += 1
+    aliases = {e.alias.lower() for e in tree.expressions if e.alias}
+    for expression in tree.expressions:
+        alias = expression.alias.lower()
+        if alias in _COLUMNS and not _same_column(expression.this, alias):
+            return None  # SQLite résoudrait l'alias (HAVING, ORDER BY) vers la colonne du snapshot
+    for column in list(tree.find_all(exp.Column)):
+        name = column.name.lower()
+        if name == DATE_COLUMN:
+            day = column.parent
+            if not isinstance(day, exp.Date):
+                return None  # granularité infra-journalière : pas dans le snapshot
+            if day.args.get("zone") is not None or day.expressions:
+                return None  # jour dans un autre fuseau : le snapshot est découpé en jours UTC
+            day.replace(exp.column(DATE_COLUMN))
+        elif name in DIMENSIONS:
+            column.replace(exp.column(name))
+        elif name not in aliases:
+            return None
+    if any(isinstance(node, (exp.Date, exp.CurrentDate, exp.DateSub, exp.DateAdd)) for node in tree.walk()):
+        return None  # expression de date non constante
+
+    start = _lower_bound(tree.args.get("where"))
+    if not start:
+        return None
+
+    aggregates = list(tree.find_all(exp.AggFunc))
+    if not any(not isinstance(agg.parent, exp.Window) for agg in aggregates):
+        return None  # listing ligne à ligne : pas dans le snapshot
+    for agg in aggregates:
+        nested = any(inner is not agg for inner in agg.find_all(exp.AggFunc))
+        if isinstance(agg.parent, exp.Window):
+            if not nested:
+                return None  # fenêtre sur les lignes brutes (ex: COUNT(*) OVER ()) : non reproductible
+            continue  # fenêtre sur les groupes (ex: SUM(COUNT(*)) OVER ()) : inchangée
+        if nested:
+            return None
+        weighted = _weighted(agg)
+        if weighted is None:
+            return None
+        if weighted is not agg:
+            agg.replace(weighted)
+
+    group = tree.args.get("group")
+    if group is not None and group.args.get("all"):
+        # GROUP BY ALL (BigQuery) → positions des colonnes non agrégées
+        positions = [exp.Literal.number(i) for i, e in enumerate(tree.expressions, 1)
+                     if not e.find(exp.AggFunc, exp.Window)]
+        tree.set("group", exp.Group(expressions=positions) if positions else None)
+
+    table.replace(exp.to_table(SOURCE_TABLE))
+    return tree.sql(dialect="sqlite"), start
+
+
+# ---------------------------------------
+# Snapshot
+# ---------------------------------------
+class AnalyticsSnapshot:
+    """Agrégats quotidiens de sales.box_sales en SQLite, rafraîchis en arrière-plan."""
+
+    def __init__(self, path: str, refresh_s: float, max_age_s: float):
+        self.path = path
+        self.refresh_s = refresh_s
+        self.max_age_s = max_age_s
+        self.first_day: Optional[str] = None
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()  # un seul rafraîchissement à la fois
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- Stockage ----------
+    @contextmanager
+    def _connect(self):
+        """Connexion courte (une par appel) : commit si tout s'est bien passé, fermeture dans tous les cas."""
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _init_db(self):
+        columns = ", ".join(DIMENSIONS)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")  # lectures pendant les rafraîchissements
+            existing = [row[1] for row in con.execute(f"PRAGMA table_info({SOURCE_TABLE})")]
+            if existing and WEIGHT not in existing:
+                # Ancien schéma (poids nommé autrement) : historique rechargé au prochain rafraîchissement
+                con.execute(f"DROP TABLE {SOURCE_TABLE}")
+                con.execute("DROP TABLE IF EXISTS meta")
+            con.execute(f"CREATE TABLE IF NOT EXISTS {SOURCE_TABLE} "
+                        f"({DATE_COLUMN} TEXT, {columns}, {WEIGHT} INTEGER NOT NULL)")
+            con.execute(f"CREATE INDEX IF NOT EXISTS idx_{DATE_COLUMN} ON {SOURCE_TABLE} ({DATE_COLUMN})")
+            con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        self.first_day = meta.get("first_day")
+        self.refreshed_at = float(meta.get("refreshed_at", 0))
+
+    # ---------- Matérialisation ----------
+    def refresh(self):
+        """Recalcule les derniers jours (ou tout l'historique au premier passage) depuis BigQuery."""
+        from bq_arrow import read_batches
+        from bq_guard import job_config
+        from config import bq_client
+
+        with self._lock:
+            started = time.time()
+            today = datetime.now(PARIS).date()
+            history_start = (today - timedelta(days=ANALYTICS_SNAPSHOT_HISTORY_DAYS)).isoformat()
+            if self.first_day and self.first_day <= history_start:
+                start = (today - timedelta(days=ANALYTICS_SNAPSHOT_LOOKBACK_DAYS)).isoformat()
+            else:
+                start = history_start  # premier passage ou historique élargi
+
+            load_config = job_config(query_parameters=[bigquery.ScalarQueryParameter("start", "DATE", start)],
+                                     labels={"kind": "snapshot"})
+            load_config.job_timeout_ms = 15 * 60 * 1000  # premier passage : historique complet
+            sql = _LOAD_SQL.format(table=f"{bq_client.project}.{SOURCE_DATASET}.{SOURCE_TABLE}")
+            job = bq_client.query(sql, job_config=load_config)
+            _total, schema, batches = read_batches(job, 15 * 60, 2 ** 62, bq_client)
+            names = [field.name for field in schema]
+            insert = (f"INSERT INTO {SOURCE_TABLE} ({', '.join(names)}) "
+                      f"VALUES ({', '.join('?' for _ in names)})")
+
+            # Une transaction : les lectures voient l'ancien snapshot jusqu'au commit (WAL) ;
+            # les batches Arrow sont insérés au fil de la lecture, sans tout charger en mémoire
+            loaded = 0
+            with self._connect() as con:
+                con.execute(f"DELETE FROM {SOURCE_TABLE} WHERE {DATE_COLUMN} >= ? OR {DATE_COLUMN} < ?",
+                            (start, history_start))
+                for batch in batches:
+                    columns = [[v.isoformat() if hasattr(v, "isoformat") else v for v in column.to_pylist()]
+                               for column in batch.columns]
+                    con.executemany(insert, zip(*columns))
+                    loaded += batch.num_rows
+                self.first_day = history_start
+                self.refreshed_at = time.time()
+                con.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                [("first_day", self.first_day), ("refreshed_at", str(self.refreshed_at))])
+            print(f"[Snapshot] ✅ {loaded:,} agrégats rechargés depuis le {start} "
+                  f"(~{(job.total_bytes_processed or 0) / 2 ** 30:.2f} Go scannés) en {time.time() - started:.1f}s")
+
+    def _refresh_loop(self):
+        delay = max(self.refresh_s - (time.time() - self.refreshed_at), 0)
+        while True:
+            time.sleep(delay)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[Snapshot] ⚠️ rafraîchissement en échec : {str(e)[:200]}")
+            delay = self.refresh_s
+
+    def start(self):
+        """Ouvre le fichier (réponses possibles tout de suite s'il est récent) puis rafraîchit en arrière-plan."""
+        from config import bq_client
+
+        if not ANALYTICS_SNAPSHOT_ENABLED or self._thread or not bq_client:
+            return
+        try:
+            self._init_db()
+        except sqlite3.Error as e:
+            print(f"[Snapshot] ⚠️ snapshot {self.path} inutilisable : {e}")
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True, name="AnalyticsSnapshot")
+        self._thread.start()
+
+    # ---------- Consultation ----------
+    def freshness(self) -> str:
+        refreshed = datetime.fromtimestamp(self.refreshed_at, PARIS)
+        age_min = (time.time() - self.refreshed_at) / 60
+        return (f"⚡ Source : snapshot local de {SOURCE_DATASET}.{SOURCE_TABLE} "
+                f"(données BigQuery du {refreshed:%d/%m à %H:%M}, il y a {age_min:.0f} min) — "
+                f"précise cette fraîcheur dans ta réponse.")
+
+    def answer(self, sql: str, max_rows: int) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+        """(lignes, note de fraîcheur) si la requête est servie par le snapshot, sinon None."""
+        from config import bq_client
+
+        if not self._thread or not self.first_day or time.time() - self.refreshed_at > self.max_age_s:
+            return None
+        translated = translate(sql, bq_client.project)
+        if translated is None:
+            return None
+        local_sql, start = translated
+        if start < self.first_day:
+            return None
+
+        started = time.perf_counter()
+        try:
+            with self._connect() as con:
+                cursor = con.execute(local_sql)
+                names = [d[0] for d in cursor.description]
+                rows = [dict(zip(names, values)) for values in cursor.fetchmany(max_rows)]
+        except sqlite3.Error as e:
+            print(f"[Snapshot] ⚠️ requête non rejouable localement ({e}) → BigQuery")
+            return None
+        print(f"[Snapshot] ⚡ {len(rows)} ligne(s) servies localement en {(time.perf_counter() - started) * 1000:.1f}ms")
+        return rows, self.freshness()
+
+
+ANALYTICS_SNAPSHOT = AnalyticsSnapshot(
+    ANALYTICS_SNAPSHOT_PATH,
+    refresh_s=ANALYTICS_SNAPSHOT_REFRESH_MIN * 60,
+    max_age_s=ANALYTICS_SNAPSHOT_MAX_AGE_MIN * 60,
+)
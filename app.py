@@ -4,12 +4,14 @@
 import os
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from apscheduler.schedulers.background import BackgroundScheduler
-from config import app, bq_client, bq_client_normalized, notion_client, BOT_NAME
+from config import app, bq_client, bq_client_normalized, notion_client, BOT_NAME, ASYNC_MODE
 from context_loader import load_context
 from slack_handlers import setup_handlers
 from morning_summary import send_morning_summary
 from morning_summary_handlers import register_morning_summary_handlers
 from notion_export_handlers import register_notion_export_handlers
+from schema_catalog import SCHEMA_CATALOG
+from analytics_snapshot import ANALYTICS_SNAPSHOT
 
 
 def main():
@@ -54,19 +56,29 @@ def main():
 
     print(f"⚡️ {BOT_NAME} prêt avec {' + '.join(services) if services else 'Claude seul'}")
 
+    # Catalogue des schémas : fichier persisté tout de suite, BigQuery en arrière-plan
+    if bq_client or bq_client_normalized:
+        SCHEMA_CATALOG.start()
+
+    # Snapshot local des agrégats de sales.box_sales : fichier SQLite + rafraîchissement de fond
+    if bq_client:
+        ANALYTICS_SNAPSHOT.start()
+
     # Chargement du contexte
     print("\n📖 Chargement du contexte …")
     context = load_context()
     print(f"   Total : {len(context)} caractères\n")
 
     # Configuration des handlers Slack avec le contexte
-    setup_handlers(context)
+    # (en ASYNC_MODE, les handlers sont enregistrés sur l'AsyncApp par async_app.py)
+    if not ASYNC_MODE:
+        setup_handlers(context)
 
-    # Enregistrement des handlers interactifs pour le morning summary
-    register_morning_summary_handlers(app)
+        # Enregistrement des handlers interactifs pour le morning summary
+        register_morning_summary_handlers(app)
 
-    # Enregistrement des handlers pour l'export vers Notion
-    register_notion_export_handlers(app)
+        # Enregistrement des handlers pour l'export vers Notion
+        register_notion_export_handlers(app)
 
     print("🧠 Mémoire par thread active")
     print("🧾 Logs de coût Anthropic activés (console)")
@@ -98,7 +110,12 @@ def main():
         print("⏰ Bilan quotidien désactivé (MORNING_SUMMARY_ENABLED=false)")
 
     # Démarrage du bot en Socket Mode
-    SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
+    if ASYNC_MODE:
+        from async_app import run_socket_mode
+        print("🌀 ASYNC_MODE activé (AsyncApp + AsyncAnthropic)")
+        run_socket_mode(context)
+    else:
+        SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
 
 
 if __name__ == "__main__":
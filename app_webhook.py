@@ -5,7 +5,7 @@ import os
 from flask import Flask, request
 from slack_bolt.adapter.flask import SlackRequestHandler
 from apscheduler.schedulers.background import BackgroundScheduler
-from config import app, bq_client, bq_client_normalized, notion_client, BOT_NAME
+from config import app, bq_client, bq_client_normalized, notion_client, BOT_NAME, ASYNC_MODE
 from context_loader import load_context
 from slack_handlers import setup_handlers
 from morning_summary import send_morning_summary
@@ -61,13 +61,15 @@ def create_app():
     print(f"   Total : {len(context)} caractères\n")
 
     # Configuration des handlers Slack avec le contexte
-    setup_handlers(context)
+    # (en ASYNC_MODE, les handlers sont enregistrés sur l'AsyncApp par async_app.py)
+    if not ASYNC_MODE:
+        setup_handlers(context)
 
-    # Enregistrement des handlers interactifs pour le morning summary
-    register_morning_summary_handlers(app)
+        # Enregistrement des handlers interactifs pour le morning summary
+        register_morning_summary_handlers(app)
 
-    # Enregistrement des handlers pour l'export vers Notion
-    register_notion_export_handlers(app)
+        # Enregistrement des handlers pour l'export vers Notion
+        register_notion_export_handlers(app)
 
     print("🧠 Mémoire par thread active")
     print("🧾 Logs de coût Anthropic activés (console)")
@@ -95,6 +97,13 @@ def create_app():
     else:
         print("⏰ Bilan quotidien désactivé (MORNING_SUMMARY_ENABLED=false)")
 
+    # ASYNC_MODE : application aiohttp (AsyncApp) au lieu de Flask
+    # gunicorn --worker-class aiohttp.GunicornWebWorker app_webhook:flask_app
+    if ASYNC_MODE:
+        from async_app import create_web_app
+        print("\n🌀 Mode Event API asyncio (aiohttp)")
+        return create_web_app(context)
+
     # Créer l'application Flask pour les webhooks
     flask_app = Flask(__name__)
     handler = SlackRequestHandler(app)
@@ -131,8 +140,12 @@ if __name__ == "__main__":
     # Lancer le serveur Flask en mode développement
     # En production, utiliser gunicorn: gunicorn --bind 0.0.0.0:5000 app_webhook:flask_app
     port = int(os.getenv("PORT", "5000"))
-    flask_app.run(
-        host="0.0.0.0",  # Écoute sur toutes les interfaces
-        port=port,
-        debug=False      # IMPORTANT : désactiver debug en production
-    )
+    if ASYNC_MODE:
+        from aiohttp import web
+        web.run_app(flask_app, host="0.0.0.0", port=port)
+    else:
+        flask_app.run(
+            host="0.0.0.0",  # Écoute sur toutes les interfaces
+            port=port,
+            debug=False      # IMPORTANT : désactiver debug en production
+        )
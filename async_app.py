@@ -0,0 +1,323 @@
+# async_app.py
+"""
+Pipeline asyncio de bout en bout (ASYNC_MODE=true) : AsyncApp Slack + AsyncAnthropic + BigQuery sondé.
+
+Une conversation qui attend Claude ou BigQuery ne bloque plus de thread : des centaines de
+conversations peuvent être en vol sur une seule boucle. Les plafonds explicites sont :
+- ASYNC_MAX_CONVERSATIONS : conversations traitées simultanément
+- ANTHROPIC_MAX_CONCURRENCY : appels Claude simultanés (claude_client_async.py)
+- GROUP_LIMITS : tools par groupe BigQuery / Notion (tool_executor.py)
+
+Les handlers interactifs existants (export Notion, stop, morning summary, réactions) restent
+synchrones : ils sont enregistrés via un pont qui les exécute dans un thread.
+"""
+
+import os
+import asyncio
+import inspect
+from typing import Optional
+from slack_bolt.async_app import AsyncApp
+from config import app as sync_app, bq_client, bq_client_normalized, STREAMING_ENABLED, ASYNC_MAX_CONVERSATIONS, BOT_NAME
+import slack_handlers
+from slack_handlers import (
+    seen_events,
+    ACTIVE_THREADS,
+    get_bot_user_id,
+    strip_own_mention,
+    reload_context,
+    handle_reaction_added
+)
+from bq_report import build_report, parse_command as parse_report_command
+from claude_client import format_sql_queries
+from claude_client_async import ask_claude_async
+from thread_memory import get_last_queries, set_thread_channel
+from notion_export_handlers import create_message_blocks_with_notion_button, register_notion_export_handlers
+from morning_summary_handlers import register_morning_summary_handlers
+from slack_streaming import AsyncStreamingMessage
+from schema_catalog import SCHEMA_CATALOG
+
+async_app = AsyncApp(token=os.environ["SLACK_BOT_TOKEN"], process_before_response=False)
+
+_conversation_semaphore = None
+
+
+def _conversations() -> asyncio.Semaphore:
+    global _conversation_semaphore
+    if _conversation_semaphore is None:
+        _conversation_semaphore = asyncio.Semaphore(ASYNC_MAX_CONVERSATIONS)
+    return _conversation_semaphore
+
+
+# ---------------------------------------
+# Pont vers les handlers synchrones
+# ---------------------------------------
+class _SyncListenerBridge:
+    """
+    Expose `.action()` / `.event()` comme une App Bolt synchrone, mais enregistre les handlers
+    sur l'AsyncApp : ack() est fait côté asyncio, puis le handler tourne dans un thread avec le
+    WebClient synchrone (ack devient un no-op).
+    """
+
+    def __init__(self, target: AsyncApp):
+        self.target = target
+
+    @staticmethod
+    def _wrap(func):
+        params = inspect.signature(func).parameters
+
+        async def listener(body, client, logger, ack=None, event=None, action=None):
+            if ack is not None:
+                await ack()
+            available = {
+                "ack": lambda *args, **kwargs: None,
+                "body": body,
+                "event": event,
+                "action": action,
+                "client": sync_app.client,
+                "logger": logger,
+            }
+            kwargs = {name: value for name, value in available.items() if name in params}
+            await asyncio.to_thread(func, **kwargs)
+
+        listener.__name__ = func.__name__
+        return listener
+
+    def action(self, constraints):
+        def decorator(func):
+            self.target.action(constraints)(self._wrap(func))
+            return func
+        return decorator
+
+    def event(self, event_type):
+        def decorator(func):
+            self.target.event(event_type)(self._wrap(func))
+            return func
+        return decorator
+
+
+# ---------------------------------------
+# Envoi des réponses
+# ---------------------------------------
+async def start_stream_async(client, channel: str, thread_ts: str, prefix: str) -> Optional[AsyncStreamingMessage]:
+    """Poste le placeholder de streaming (None si le streaming est désactivé ou indisponible)."""
+    if not STREAMING_ENABLED:
+        return None
+    stream = AsyncStreamingMessage(client, channel, thread_ts, prefix=prefix)
+    return stream if await stream.start() else None
+
+
+async def send_answer_async(client, channel: str, thread_ts: str, text: str, logger,
+                            stream: Optional[AsyncStreamingMessage] = None):
+    """Équivalent asyncio de slack_handlers.send_answer."""
+    blocks = create_message_blocks_with_notion_button(text, thread_ts, channel)
+    if blocks is None:
+        logger.warning(f"⚠️ Message trop long ({len(text)} chars), envoi sans boutons")
+
+    if stream and await stream.finish(text, blocks):
+        return
+
+    if blocks is None:
+        await client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=text)
+    else:
+        await client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=text, blocks=blocks)
+
+
+async def _add_eyes(client, channel: str, ts: str, logger):
+    try:
+        await client.reactions_add(channel=channel, timestamp=ts, name="eyes")
+    except Exception as reaction_error:
+        logger.warning(f"⚠️ Impossible d'ajouter la réaction : {reaction_error}")
+
+
+# ---------------------------------------
+# Handlers asyncio
+# ---------------------------------------
+@async_app.event("app_mention")
+async def on_app_mention_async(body, event, client, logger):
+    event_id = body.get("event_id")
+
+    if seen_events.has_seen(event_id):
+        logger.info(f"⏭️ Événement {event_id[:12] if event_id else 'NO_ID'}… déjà traité, ignoré")
+        return
+
+    stream = None
+    try:
+        if event.get("subtype"):
+            seen_events.mark_seen(event_id)
+            return
+
+        channel   = event["channel"]
+        msg_ts    = event["ts"]
+        thread_ts = event.get("thread_ts", msg_ts)
+        raw_text  = event.get("text") or ""
+
+        bot_user_id = await asyncio.to_thread(get_bot_user_id)
+        prompt = strip_own_mention(raw_text, bot_user_id) or "Dis bonjour (très bref) avec une micro-blague."
+        logger.info(f"🔵 @mention reçue async (event={event_id[:12] if event_id else 'NO_ID'}): {prompt[:200]!r}")
+
+        await _add_eyes(client, channel, msg_ts, logger)
+
+        # Commandes spéciales (synchrones, exécutées dans un thread)
+        if prompt.lower() in ["reload context", "refresh context", "reload", "refresh"]:
+            await asyncio.to_thread(reload_context)
+            await client.chat_postMessage(
+                channel=channel,
+                thread_ts=thread_ts,
+                text="✅ Contexte rechargé ! J'ai mis à jour mes connaissances depuis Notion/DBT."
+            )
+            seen_events.mark_seen(event_id)
+            return
+
+        if prompt.lower() in ["morning summary", "morning", "bilan quotidien", "bilan matinal", "summary"]:
+            from morning_summary import send_morning_summary
+            logger.info(f"🌅 Commande morning summary reçue dans #{channel}")
+            try:
+                await client.chat_postMessage(channel=channel, thread_ts=thread_ts,
+                                              text="⏳ Génération du bilan quotidien en cours...")
+                success = await asyncio.to_thread(send_morning_summary, channel=channel)
+                await client.chat_postMessage(
+                    channel=channel,
+                    thread_ts=thread_ts,
+                    text="✅ Bilan quotidien envoyé !" if success
+                    else "❌ Erreur lors de la génération du bilan. Consultez les logs pour plus de détails."
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Erreur morning summary: {e}")
+            seen_events.mark_seen(event_id)
+            return
+
+        report_days = parse_report_command(prompt)
+        if report_days is not None:
+            logger.info(f"📊 Commande bq report ({report_days} j) reçue dans #{channel}")
+            text = await asyncio.to_thread(build_report, report_days)
+            await client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=text)
+            seen_events.mark_seen(event_id)
+            return
+
+        async with _conversations():
+            stream = await start_stream_async(client, channel, thread_ts, "🤖")
+            set_thread_channel(thread_ts, channel)
+            answer = await ask_claude_async(prompt, thread_ts, slack_handlers.CURRENT_CONTEXT, stream=stream,
+                                          user=event.get("user"))
+
+        if any(k in prompt.lower() for k in ["sql", "requête", "requete", "query", "liste", "export", "j'aimerais avoir", "notion", "détail", "detail"]):
+            queries = get_last_queries(thread_ts)
+            if queries:
+                answer += format_sql_queries(queries)
+
+        await send_answer_async(client, channel, thread_ts, f"🤖 {answer}", logger, stream)
+        ACTIVE_THREADS.add(thread_ts)
+        logger.info("✅ Réponse envoyée (thread ajouté aux actifs)")
+        seen_events.mark_seen(event_id)
+
+    except Exception as e:
+        logger.exception(f"❌ Erreur on_app_mention_async (event={event_id[:12] if event_id else 'NO_ID'}): {e}")
+        try:
+            if stream and await stream.finish(f"⚠️ Oups, j'ai eu un souci : `{str(e)[:200]}`"):
+                return
+            await client.chat_postMessage(
+                channel=event["channel"],
+                thread_ts=event.get("thread_ts", event["ts"]),
+                text=f"⚠️ Oups, j'ai eu un souci : `{str(e)[:200]}`"
+            )
+        except Exception:
+            pass
+
+
+@async_app.event("message")
+async def on_message_async(event, client, logger):
+    stream = None
+    try:
+        logger.info(f"📨 Message reçu : '{event.get('text', '')[:120]}…' channel={event.get('channel')} thread={event.get('thread_ts', 'NO_THREAD')}")
+        if event.get("subtype") or "thread_ts" not in event:
+            return
+
+        thread_ts = event["thread_ts"]
+        channel = event["channel"]
+        user = event.get("user", "")
+        text = (event.get("text") or "").strip()
+
+        bot_user_id = await asyncio.to_thread(get_bot_user_id)
+        if user == bot_user_id:
+            return
+        if bot_user_id and f"<@{bot_user_id}>" in text:
+            logger.info(f"⏭️ Message avec mention du bot → ignoré (géré par app_mention)")
+            return
+        if thread_ts not in ACTIVE_THREADS:
+            logger.info(f"⏭️ Thread {thread_ts[:10]}… non actif")
+            return
+
+        await _add_eyes(client, channel, event["ts"], logger)
+
+        async with _conversations():
+            stream = await start_stream_async(client, channel, thread_ts, "💬")
+            set_thread_channel(thread_ts, channel)
+            answer = await ask_claude_async(text, thread_ts, slack_handlers.CURRENT_CONTEXT, stream=stream,
+                                          user=user)
+
+        if any(k in text.lower() for k in ["sql", "requête", "requete", "query"]):
+            queries = get_last_queries(thread_ts)
+            if queries:
+                answer += format_sql_queries(queries)
+
+        await send_answer_async(client, channel, thread_ts, f"💬 {answer}", logger, stream)
+        logger.info("✅ Réponse envoyée dans le thread")
+    except Exception as e:
+        logger.exception(f"❌ Erreur on_message_async: {e}")
+        try:
+            if stream and await stream.finish(f"⚠️ Erreur : `{str(e)[:200]}`"):
+                return
+            await client.chat_postMessage(
+                channel=event.get("channel"),
+                thread_ts=event.get("thread_ts"),
+                text=f"⚠️ Erreur : `{str(e)[:200]}`"
+            )
+        except Exception:
+            pass
+
+
+def setup_async_app(context: str) -> AsyncApp:
+    """Initialise le contexte et enregistre les handlers synchrones via le pont."""
+    slack_handlers.CURRENT_CONTEXT = context
+
+    bridge = _SyncListenerBridge(async_app)
+    bridge.event("reaction_added")(handle_reaction_added)
+    register_morning_summary_handlers(bridge)
+    register_notion_export_handlers(bridge)
+
+    # Catalogue des schémas : même démarrage qu'app.py (sans effet s'il tourne déjà)
+    if bq_client or bq_client_normalized:
+        SCHEMA_CATALOG.start()
+
+    print(f"⚡️ Mode asyncio : {ASYNC_MAX_CONVERSATIONS} conversations max en vol")
+    return async_app
+
+
+# ---------------------------------------
+# Points d'entrée
+# ---------------------------------------
+def run_socket_mode(context: str):
+    """Démarre l'AsyncApp en Socket Mode (app.py avec ASYNC_MODE=true)."""
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+    setup_async_app(context)
+    asyncio.run(AsyncSocketModeHandler(async_app, os.environ["SLACK_APP_TOKEN"]).start_async())
+
+
+def create_web_app(context: str):
+    """Application aiohttp pour l'Event API (app_webhook.py avec ASYNC_MODE=true)."""
+    from aiohttp import web
+
+    setup_async_app(context)
+    web_app = async_app.web_app(path="/slack/events")
+
+    async def health(request):
+        return web.json_response({"status": "ok", "bot": BOT_NAME})
+
+    async def root(request):
+        return web.Response(text=f"🤖 {BOT_NAME} is running! (Event API mode, asyncio)")
+
+    web_app.router.add_get("/health", health)
+    web_app.router.add_get("/", root)
+    return web_app
+
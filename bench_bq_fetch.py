@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# bench_bq_fetch.py
+"""
+Benchmark des chemins de lecture des résultats BigQuery (cf. bq_arrow.py) :
+- rows    : itération des Row + dict(row) (chemin historique)
+- arrow   : record batches Arrow via les pages REST
+- storage : record batches Arrow via la Storage Read API (si installée)
+
+Chaque chemin tourne dans un process séparé pour mesurer son pic de RSS.
+Le job est terminé avant le chronomètre : on ne mesure que la lecture.
+
+    python bench_bq_fetch.py --rows 100000
+    python bench_bq_fetch.py --sql "SELECT * FROM \`projet.dataset.table\`" --rows 50000
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+
+DEFAULT_SQL = "SELECT * FROM `bigquery-public-data.samples.shakespeare`"
+PATHS = ("rows", "arrow", "storage")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss : Ko sous Linux, octets sous macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_path(path: str, sql: str, max_rows: int):
+    """Exécute la requête puis lit au plus `max_rows` lignes par le chemin donné (process enfant)."""
+    if path == "arrow":
+        os.environ["BQ_STORAGE_API_MIN_ROWS"] = str(2 ** 62)  # jamais de Storage API
+    elif path == "storage":
+        os.environ["BQ_STORAGE_API_MIN_ROWS"] = "0"
+    from google.cloud import bigquery
+    import bq_arrow
+
+    client = bigquery.Client(project=os.getenv("BIGQUERY_PROJECT_ID"))
+    job = client.query(sql)
+    while not job.done():
+        time.sleep(0.2)
+    rss_before = _peak_rss_mb()
+
+    started = time.perf_counter()
+    if path == "rows":
+        rows = []
+        for i, row in enumerate(job.result(), 1):
+            rows.append(dict(row))
+            if i >= max_rows:
+                break
+    else:
+        if path == "storage" and bq_arrow.bigquery_storage is None:
+            print(f"{path}\tSKIP\tgoogle-cloud-bigquery-storage non installé")
+            return
+        rows, _ = bq_arrow.fetch_rows(job, 600, max_rows, client)
+    elapsed = time.perf_counter() - started
+
+    print(f"{path}\t{len(rows)}\t{elapsed:.2f}\t{len(rows) / elapsed:,.0f}\t"
+          f"{rss_before:.0f}\t{_peak_rss_mb():.0f}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark lecture BigQuery : Row/dict vs Arrow")
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="Requête à lire (défaut: samples.shakespeare)")
+    parser.add_argument("--rows", type=int, default=100_000, help="Budget de lignes (défaut: 100000)")
+    parser.add_argument("--paths", nargs="+", default=list(PATHS), choices=PATHS, help="Chemins à comparer")
+    parser.add_argument("--child", choices=PATHS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_path(args.child, args.sql, args.rows)
+        return
+
+    print(f"📏 Lecture de ≤ {args.rows:,} lignes : {args.sql[:100]}\n")
+    print("chemin\tlignes\tsecondes\tlignes/s\tRSS avant (Mo)\tRSS pic (Mo)")
+    for path in args.paths:
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", path, "--sql", args.sql, "--rows", str(args.rows)],
+            capture_output=True, text=True
+        )
+        lines = [line for line in result.stdout.splitlines() if line.startswith(path)]
+        if result.returncode != 0 or not lines:
+            print(f"{path}\t❌ {(result.stderr.strip().splitlines() or ['?'])[-1]}")
+        else:
+            print(lines[-1])
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -3,8 +3,12 @@
 
 import os
 import json
-import re
+import time
+import asyncio
+import contextvars
 from datetime import datetime, timedelta
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from dateutil.relativedelta import relativedelta
 from config import (
     bq_client,
@@ -13,31 +17,42 @@ from config import (
     MAX_TOOL_CHARS,
     TOOL_TIMEOUT_S
 )
+from result_encoding import encode_rows
+from analytics_snapshot import ANALYTICS_SNAPSHOT
+from bq_engine import ENGINE, QueryRefused, QueryResult
+from bq_jobs import JobCancelled, query_kind
+from query_advisor import QUERY_ADVISOR
+from schema_catalog import SCHEMA_CATALOG, client_for_project, resolve as resolve_table
+from sql_ast import date_range, enforce_limit, fold_periods, has_aggregation, with_date_range
 
 
 def detect_project_from_sql(query: str) -> str:
-    """Détecte le projet BigQuery à utiliser d'après la requête SQL."""
-    q = query.lower()
-    if "teamdata-291012." in q:
-        return "default"
-    if "normalised-417010." in q or "normalized-417010." in q or "ops.shipments_all" in q or "crm.crm_data_detailed_by_user" in q or "reviews.reviews_by_user" in q:
+    """'normalized' si la requête s'exécute dans le second projet (d'après ses tables, cf. bq_engine.route), sinon 'default'."""
+    second = os.getenv("BIGQUERY_PROJECT_ID_2")
+    if second and ENGINE.billing_project(query, os.getenv("BIGQUERY_PROJECT_ID")) == second:
         return "normalized"
-    # fallback
     return "default"
 
 
+def route_query(query: str, project: str = "default"):
+    """
+    (client, SQL) : le projet qui exécute est déduit des tables de la requête (pool de clients
+    partagé) ; `project` ne sert qu'aux tables 'dataset.table' hors BQ_DATASET_PROJECTS.
+    """
+    default = os.getenv("BIGQUERY_PROJECT_ID_2") if project == "normalized" else None
+    return ENGINE.route(query, default or os.getenv("BIGQUERY_PROJECT_ID"))
+
+
 def _enforce_limit(q: str) -> str:
-    """Ajoute automatiquement un LIMIT si absent dans la requête."""
-    q_low = q.strip().lower()
-    if "/* no_limit */" in q_low:
-        return q
-    if q_low.startswith("select") and " limit " not in q_low:
-        return q.rstrip().rstrip(";") + f"\nLIMIT {MAX_ROWS + 1}"
-    return q
+    """Ajoute automatiquement un LIMIT si absent dans la requête (requête externe uniquement)."""
+    return enforce_limit(q, MAX_ROWS + 1)
 
 
 def _detect_aggregation(query: str) -> bool:
     """Détecte si la requête contient des agrégations (COUNT, SUM, AVG, etc.)."""
+    aggregated = has_aggregation(query)
+    if aggregated is not None:
+        return aggregated
     q_upper = query.upper()
     aggregations = ['COUNT(', 'SUM(', 'AVG(', 'MAX(', 'MIN(', 'COUNTIF(', 'ROUND(SUM(', 'ROUND(AVG(']
     return any(agg in q_upper for agg in aggregations)
@@ -45,75 +60,15 @@ def _detect_aggregation(query: str) -> bool:
 
 def _extract_date_range(query: str):
     """
-    Extrait les filtres de date d'une requête SQL.
+    Extrait les filtres de date d'une requête SQL (BETWEEN, >= / <=, = sur un littéral de date).
     Retourne (date_column, start_date, end_date) ou (None, None, None).
     """
-    # Chercher les patterns BETWEEN ... AND ...
-    # Format: column BETWEEN 'YYYY-MM-DD' AND 'YYYY-MM-DD'
-    between_pattern = r"(\w+)\s+BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'"
-    match = re.search(between_pattern, query, re.IGNORECASE)
-    if match:
-        return match.group(1), match.group(2), match.group(3)
-
-    # Chercher les patterns >= et <=
-    # Format: column >= 'YYYY-MM-DD' AND column <= 'YYYY-MM-DD'
-    gte_pattern = r"(\w+)\s*>=\s*'(\d{4}-\d{2}-\d{2})'"
-    lte_pattern = r"(\w+)\s*<=\s*'(\d{4}-\d{2}-\d{2})'"
-
-    gte_match = re.search(gte_pattern, query, re.IGNORECASE)
-    lte_match = re.search(lte_pattern, query, re.IGNORECASE)
-
-    if gte_match and lte_match and gte_match.group(1).lower() == lte_match.group(1).lower():
-        return gte_match.group(1), gte_match.group(2), lte_match.group(2)
-
-    # Chercher un seul date = 'YYYY-MM-DD'
-    eq_pattern = r"(\w+)\s*=\s*'(\d{4}-\d{2}-\d{2})'"
-    eq_match = re.search(eq_pattern, query, re.IGNORECASE)
-    if eq_match:
-        return eq_match.group(1), eq_match.group(2), eq_match.group(2)
-
-    return None, None, None
-
-
-def _generate_comparison_query(original_query: str, date_column: str, new_start: str, new_end: str) -> str:
-    """Génère une requête de comparaison en remplaçant les dates."""
-    # Remplacer BETWEEN
-    between_pattern = r"(\w+)\s+BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'"
-    new_query = re.sub(
-        between_pattern,
-        f"{date_column} BETWEEN '{new_start}' AND '{new_end}'",
-        original_query,
-        flags=re.IGNORECASE
-    )
-    if new_query != original_query:
-        return new_query
-
-    # Remplacer >= et <=
-    new_query = original_query
-    new_query = re.sub(
-        r"(\w+)\s*>=\s*'(\d{4}-\d{2}-\d{2})'",
-        f"{date_column} >= '{new_start}'",
-        new_query,
-        flags=re.IGNORECASE
-    )
-    new_query = re.sub(
-        r"(\w+)\s*<=\s*'(\d{4}-\d{2}-\d{2})'",
-        f"{date_column} <= '{new_end}'",
-        new_query,
-        flags=re.IGNORECASE
-    )
-    if new_query != original_query:
-        return new_query
-
-    # Remplacer =
-    new_query = re.sub(
-        r"(\w+)\s*=\s*'(\d{4}-\d{2}-\d{2})'",
-        f"{date_column} = '{new_start}'",
-        original_query,
-        flags=re.IGNORECASE
-    )
+    return date_range(query)
 
-    return new_query
+
+def _generate_comparison_query(original_query: str, new_start: str, new_end: str) -> Optional[str]:
+    """Génère une requête de comparaison en remplaçant les bornes de la période (None si impossible)."""
+    return with_date_range(original_query, new_start, new_end)
 
 
 def _calculate_previous_periods(start_date_str: str, end_date_str: str):
@@ -181,33 +136,81 @@ def _calculate_previous_periods(start_date_str: str, end_date_str: str):
         return {}
 
 
-def _execute_comparison_queries(client, original_query: str, date_column: str, comparisons: dict) -> dict:
-    """Exécute les requêtes de comparaison et retourne les résultats."""
-    results = {}
+# Requêtes de comparaison repliées en un seul job : un CASE étiquette chaque ligne avec sa
+# période, le prédicat de date devient un OR des périodes, et GROUP BY __period calcule toutes
+# les agrégations en un seul scan. Sinon (GROUP BY, sous-requêtes, fenêtres…) → jobs en parallèle.
+PERIOD_COLUMN = "__period"
+
+
+def _periods_overlap(comparisons: dict) -> bool:
+    spans = sorted((c['start'], c['end']) for c in comparisons.values())
+    return any(spans[i + 1][0] <= spans[i][1] for i in range(len(spans) - 1))
+
+
+def _build_folded_comparison_query(original_query: str, comparisons: dict) -> Optional[str]:
+    """
+    Une seule requête pour toutes les périodes de comparaison, ou None si le repli n'est pas sûr
+    (agrégat non scalaire, sous-requête, périodes qui se chevauchent, prédicat de date introuvable).
+    """
+    if len(comparisons) < 2 or _periods_overlap(comparisons):
+        return None
+    return fold_periods(original_query, comparisons, PERIOD_COLUMN)
+
 
-    for comp_type, comp_info in comparisons.items():
+@query_kind("compare")
+def _execute_comparison_queries(client, original_query: str, comparisons: dict) -> dict:
+    """
+    Exécute les comparaisons et retourne {période: {label, data}}.
+    Toutes les périodes en un seul job quand c'est possible, sinon un job par période en parallèle.
+    """
+    results = {}
+    pending = comparisons
+    folded = _build_folded_comparison_query(original_query, comparisons)
+    if folded:
         try:
-            comp_query = _generate_comparison_query(
-                original_query,
-                date_column,
-                comp_info['start'],
-                comp_info['end']
-            )
-
-            # Exécuter la requête de comparaison
-            job = client.query(_enforce_limit(comp_query))
-            rows = list(job.result(timeout=TOOL_TIMEOUT_S))
-
-            if rows:
-                results[comp_type] = {
+            started = time.time()
+            rows = run_query(client, _enforce_limit(folded)).rows
+            by_period = {row.get(PERIOD_COLUMN): row for row in rows}
+            print(f"[Comparisons] {len(comparisons)} périodes en 1 job ({time.time() - started:.2f}s)")
+            results = {
+                comp_type: {
                     'label': comp_info['label'],
-                    'data': dict(rows[0]) if rows else {}
+                    'data': {k: v for k, v in by_period[comp_type].items() if k != PERIOD_COLUMN}
                 }
+                for comp_type, comp_info in comparisons.items() if comp_type in by_period
+            }
+            # Période sans aucune ligne : GROUP BY __period ne la produit pas, alors que la requête
+            # seule renvoie sa ligne d'agrégats vides (COUNT 0, SUM NULL…) → requête dédiée
+            pending = {k: v for k, v in comparisons.items() if k not in by_period}
+            if not pending:
+                return results
+            print(f"[Comparisons] Période(s) sans ligne ({', '.join(pending)}) → requête par période")
         except Exception as e:
-            print(f"[Comparisons] Erreur {comp_type}: {e}")
-            continue
-
-    return results
+            print(f"[Comparisons] Requête repliée en échec, repli sur une requête par période : {e}")
+
+    def run_one(comp_type, comp_info):
+        comp_query = _generate_comparison_query(original_query, comp_info['start'], comp_info['end'])
+        if not comp_query:
+            return None
+        # Exécuter la requête de comparaison (via le cache partagé)
+        return run_query(client, _enforce_limit(comp_query)).rows
+
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1), thread_name_prefix="compare") as pool:
+        # Copie du contexte : les jobs restent rattachés au thread Slack (annulation, cf. bq_jobs)
+        futures = {comp_type: pool.submit(contextvars.copy_context().run, run_one, comp_type, comp_info) for comp_type, comp_info in pending.items()}
+        for comp_type, future in futures.items():
+            try:
+                rows = future.result()
+                if rows:
+                    results[comp_type] = {
+                        'label': comparisons[comp_type]['label'],
+                        'data': dict(rows[0]) if rows else {}
+                    }
+            except Exception as e:
+                print(f"[Comparisons] Erreur {comp_type}: {e}")
+                continue
+
+    return {comp_type: results[comp_type] for comp_type in comparisons if comp_type in results}
 
 
 def _format_with_comparisons(main_results: list, comparison_results: dict) -> str:
@@ -256,59 +259,71 @@ def _format_with_comparisons(main_results: list, comparison_results: dict) -> st
     return "\n".join(output_lines)
 
 
-def describe_table(table_name: str) -> str:
-    """Récupère la structure d'une table BigQuery (colonnes, types, descriptions)."""
+def _describe_one(table_name: str) -> dict:
     try:
-        parts = table_name.split(".")
-        if len(parts) == 3:
-            project_id, dataset_id, table_id = parts
-        elif len(parts) == 2:
-            project_id = os.getenv("BIGQUERY_PROJECT_ID")
-            dataset_id, table_id = parts
-        else:
-            return "❌ Format invalide. Utilise 'dataset.table' ou 'project.dataset.table'"
-
-        if project_id == os.getenv("BIGQUERY_PROJECT_ID"):
-            client = bq_client
-        elif project_id == os.getenv("BIGQUERY_PROJECT_ID_2"):
-            client = bq_client_normalized
-        else:
-            client = bq_client
-
-        if not client:
-            return "❌ BigQuery non configuré pour ce projet."
-
-        query = f"""
-        SELECT column_name, data_type, is_nullable, description
-        FROM `{project_id}.{dataset_id}.INFORMATION_SCHEMA.COLUMNS`
-        WHERE table_name = '{table_id}'
-        ORDER BY ordinal_position
-        """
-        rows = list(client.query(query).result())
-        if not rows:
-            query2 = f"""
-            SELECT column_name, data_type, is_nullable, description
-            FROM `{project_id}.{dataset_id}.INFORMATION_SCHEMA.COLUMN_FIELD_PATHS`
-            WHERE table_name = '{table_id}'
-            ORDER BY column_name
-            """
-            rows = list(client.query(query2).result())
-        if not rows:
-            return f"❌ Table '{project_id}.{dataset_id}.{table_id}' introuvable."
-
-        cols = []
-        for r in rows:
-            cols.append({
-                "nom": r.column_name,
-                "type": r.data_type,
-                "nullable": (str(getattr(r, "is_nullable", "YES")).upper() == "YES"),
-                **({"description": r.description} if getattr(r, "description", None) else {})
-            })
-        return json.dumps({"table": f"{project_id}.{dataset_id}.{table_id}", "colonnes": cols, "total": len(cols)}, ensure_ascii=False, indent=2)
+        project_id, dataset_id, table_id = resolve_table(table_name)
+    except ValueError as e:
+        return {"table": table_name, "erreur": str(e)}
+    ref = f"{project_id}.{dataset_id}.{table_id}"
+    if not client_for_project(project_id):
+        return {"table": ref, "erreur": "BigQuery non configuré pour ce projet."}
+    entry = SCHEMA_CATALOG.get(ref)
+    if not entry:
+        return {"table": ref, "erreur": "introuvable"}
+    described = {"table": ref, "colonnes": entry["columns"], "total": len(entry["columns"])}
+    if entry.get("partition"):
+        described["partitionnée_par"] = entry["partition"]
+    if entry.get("clustering"):
+        described["clusterisée_par"] = entry["clustering"]
+    return described
+
+
+def describe_table(table_name) -> str:
+    """
+    Récupère la structure d'une ou plusieurs tables BigQuery (colonnes, types, descriptions,
+    partitionnement), servie par le catalogue des schémas (cf. schema_catalog.py).
+    """
+    try:
+        names = [table_name] if isinstance(table_name, str) else list(table_name)
+        described = [_describe_one(name) for name in names]
+        if len(described) == 1:
+            only = described[0]
+            if "erreur" in only:
+                if only["erreur"] == "introuvable":
+                    return f"❌ Table '{only['table']}' introuvable."
+                return f"❌ {only['erreur']}"
+            return json.dumps(only, ensure_ascii=False, indent=2)
+        return json.dumps(described, ensure_ascii=False, indent=2)
     except Exception as e:
         return f"❌ Erreur describe_table: {str(e)}"
 
 
+# ---------------------------------------
+# Exécution (moteur partagé, cf. bq_engine.py)
+# ---------------------------------------
+def lookup_snapshot(client, sql: str, max_rows: int = MAX_ROWS + 1) -> Optional[QueryResult]:
+    """Résultat servi par le snapshot local de sales.box_sales (cf. analytics_snapshot.py), ou None."""
+    if client is not bq_client:
+        return None
+    answer = ANALYTICS_SNAPSHOT.answer(sql, max_rows)
+    if answer is None:
+        return None
+    rows, freshness = answer
+    return QueryResult(rows, len(rows), 0, cached=True, freshness=freshness)
+
+
+def run_query(client, sql: str, timeout: float = TOOL_TIMEOUT_S, max_rows: int = MAX_ROWS + 1) -> QueryResult:
+    """
+    Exécute une requête dérivée (comparaisons, drill-downs) : snapshot local, sinon moteur partagé
+    (cache, un seul job par requête identique en cours). Pas de dry run : la requête d'origine l'a passé.
+    Mêmes réécritures élagables que la requête d'origine (cf. query_advisor.py).
+    """
+    local = lookup_snapshot(client, sql, max_rows)
+    if local is not None:
+        return local
+    return ENGINE.run(client, QUERY_ADVISOR.advise(sql, client.project).sql, max_rows, timeout, gate=False)
+
+
 def execute_bigquery(query: str, thread_ts: str, project: str = "default") -> str:
     """
     Exécute une requête SQL sur BigQuery avec :
@@ -316,50 +331,81 @@ def execute_bigquery(query: str, thread_ts: str, project: str = "default") -> st
     2. Comparaisons automatiques MoM/YoY/QoQ
     """
     # Import local pour éviter dépendance circulaire
-    from thread_memory import add_query_to_thread, get_last_user_prompt
+    from thread_memory import add_query_to_thread
+
+    if not (bq_client or bq_client_normalized):
+        return "❌ BigQuery non configuré."
+    try:
+        add_query_to_thread(thread_ts, query)
+        # Client du projet des tables lues (tables d'un autre projet qualifiées), puis lecture seule
+        # vérifiée + LIMIT ajouté si absent. Les requêtes dérivées partent de `routed` : même client.
+        client, routed = route_query(query, project)
+        q = ENGINE.prepare(routed, MAX_ROWS + 1)
+        # Agrégats chauds : snapshot local (millisecondes), sinon filtres de partition élagables
+        # (cf. query_advisor.py) puis cache partagé / BigQuery (dry run, job sondé et annulable
+        # depuis Slack, un seul job par requête identique en cours)
+        result = lookup_snapshot(client, q)
+        notice = ""
+        if result is None:
+            advice = QUERY_ADVISOR.advise(q, client.project, client)
+            q, notice = advice.sql, advice.notice
+            result = ENGINE.run(client, q, MAX_ROWS + 1)
+        return _build_query_output(client, routed, q, result, thread_ts, notice)
+    except (QueryRefused, JobCancelled) as e:
+        return str(e)
+    except Exception as e:
+        return f"❌ Erreur BigQuery: {str(e)}"
+
+
+async def execute_bigquery_async(query: str, thread_ts: str, project: str = "default") -> str:
+    """Variante asyncio de execute_bigquery : le job principal est soumis puis sondé de façon coopérative."""
+    from thread_memory import add_query_to_thread
+
+    if not (bq_client or bq_client_normalized):
+        return "❌ BigQuery non configuré."
+    try:
+        add_query_to_thread(thread_ts, query)
+        client, routed = route_query(query, project)
+        q = ENGINE.prepare(routed, MAX_ROWS + 1)
+        result = await asyncio.to_thread(lookup_snapshot, client, q)
+        notice = ""
+        if result is None:
+            advice = await asyncio.to_thread(QUERY_ADVISOR.advise, q, client.project, client)
+            q, notice = advice.sql, advice.notice
+            result = await ENGINE.run_async(client, q, MAX_ROWS + 1)
+        # Lecture des lignes faite : enrichissements (drill-downs, comparaisons)
+        return await asyncio.to_thread(_build_query_output, client, routed, q, result, thread_ts, notice)
+    except (QueryRefused, JobCancelled) as e:
+        return str(e)
+    except Exception as e:
+        return f"❌ Erreur BigQuery: {str(e)}"
+
+
+def _build_query_output(client, query: str, q: str, result: QueryResult, thread_ts: str, notice: str = "") -> str:
+    """
+    Met en forme le résultat principal et l'enrichit (analyse proactive + comparaisons).
+    `query` : requête routée pour `client` (sans LIMIT auto), base des drill-downs et comparaisons ;
+    `q` : SQL exécutée. `notice` : avertissements du conseiller (fenêtre par défaut, filtres non élagables).
+    """
+    from thread_memory import get_last_user_prompt
     from proactive_analysis import (
         detect_analysis_context,
         execute_drill_downs,
         format_proactive_analysis
     )
 
-    client = bq_client_normalized if project == "normalized" else bq_client
-    if not client:
-        return "❌ BigQuery non configuré."
     try:
-        add_query_to_thread(thread_ts, query)
-        q = _enforce_limit(query)
-        job = client.query(q)
-        rows_iter = job.result(timeout=TOOL_TIMEOUT_S)
-
-        rows = []
-        for i, row in enumerate(rows_iter, 1):
-            rows.append(dict(row))
-            if i >= MAX_ROWS + 1:
-                break
+        rows = result.rows
+        total_rows = result.total_rows
+        note = notice + (f"{result.freshness}\n" if result.freshness else "")
 
-        # Logging BQ conso (console)
-        try:
-            bytes_proc = job.total_bytes_processed or 0
-            tib = bytes_proc / float(1024 ** 4)
-            # prix indicatif on-demand
-            price_per_tib = float(os.getenv("BQ_PRICE_PER_TIB", "6.25"))
-            cost = tib * price_per_tib
-            print(f"[BQ] processed={bytes_proc:,} bytes (~{tib:.6f} TiB) cost≈${cost:.4f}")
-        except Exception as e:
-            print(f"[BQ] log error: {e}")
-
-        # si trop long → résumé + SQL
+        # si trop long → aperçu compact + SQL
         if len(rows) > MAX_ROWS:
-            preview = rows[:3]
-            payload = {
-                "note": f"Résultat trop long (> {MAX_ROWS} lignes) — listing masqué.",
-                "preview_first_rows": preview,
-                "estimated_total_rows": f">{MAX_ROWS}",
-            }
-            text = json.dumps(payload, ensure_ascii=False, indent=2)
-            out = (text[:MAX_TOOL_CHARS] + " …") if len(text) > MAX_TOOL_CHARS else text
+            out = note + f"Résultat trop long (> {MAX_ROWS} lignes) — listing masqué, aperçu :\n"
+            out += encode_rows(rows[:MAX_ROWS], MAX_TOOL_CHARS // 2, total_rows or len(rows))
             out += f"\n\n-- SQL utilisée (avec LIMIT auto)\n```sql\n{q}\n```"
+            out += "\n\nPour le listing complet : relance la requête (sans LIMIT) avec export_bigquery, " \
+                   "le fichier sera envoyé dans le thread."
             return out
 
         # 🔍 NOUVELLE FONCTIONNALITÉ : ANALYSE PROACTIVE MULTI-DIMENSIONNELLE
@@ -417,22 +463,19 @@ def execute_bigquery(query: str, thread_ts: str, project: str = "default") -> st
 
                 if comparisons:
                     # Exécuter les requêtes de comparaison
-                    comparison_results = _execute_comparison_queries(client, query, date_column, comparisons)
+                    comparison_results = _execute_comparison_queries(client, query, comparisons)
 
                     if comparison_results:
                         # Formater avec comparaisons
                         comparison_output = _format_with_comparisons(rows, comparison_results)
 
         # 📦 ASSEMBLAGE FINAL DES RÉSULTATS
-        # Combiner : JSON brut + analyse proactive + comparaisons
+        # Combiner : résultat compact + analyse proactive + comparaisons
         output_parts = []
 
-        # 1. Résultat JSON principal
-        json_output = json.dumps(rows, default=str, ensure_ascii=False, indent=2)
-        if len(json_output) <= MAX_TOOL_CHARS:
-            output_parts.append("**📊 Résultat de la requête :**\n```json\n" + json_output + "\n```")
-        else:
-            output_parts.append(json_output[:MAX_TOOL_CHARS] + " …")
+        # 1. Résultat principal (TSV compact, troncature explicite)
+        table_output = encode_rows(rows, MAX_TOOL_CHARS, total_rows)
+        output_parts.append(note + "**📊 Résultat de la requête :**\n" + table_output)
 
         # 2. Analyse proactive (si disponible)
         if proactive_analysis_output:
@@ -447,7 +490,7 @@ def execute_bigquery(query: str, thread_ts: str, project: str = "default") -> st
             # On a des analyses enrichies
             return "\n\n".join(output_parts)
         else:
-            # Juste le JSON de base
-            return json_output or "Aucun résultat."
+            # Juste le résultat de base
+            return note + table_output
     except Exception as e:
         return f"❌ Erreur BigQuery: {str(e)}"
@@ -0,0 +1,124 @@
+# bq_arrow.py
+"""
+Lecture colonnaire des résultats BigQuery (Arrow).
+
+Au lieu d'itérer des `Row` et de construire un `dict(row)` par ligne, les résultats sont lus
+en record batches Arrow :
+- via la BigQuery Storage Read API quand elle est installée et que le budget de lignes dépasse
+  BQ_STORAGE_API_MIN_ROWS (lecture parallèle, format binaire)
+- sinon via les pages REST, dimensionnées sur le budget de lignes
+Dans les deux cas la lecture s'arrête dès que le budget est atteint : les pages suivantes ne
+sont jamais téléchargées. Les lignes ne sont matérialisées qu'à la fin, en bloc.
+
+pyarrow et google-cloud-bigquery-storage sont optionnels : sans pyarrow (ou avec
+BQ_ARROW_ENABLED=false), on garde la lecture ligne à ligne.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+except ImportError:  # lecture ligne à ligne
+    pa = None
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:  # pages REST uniquement
+    bigquery_storage = None
+
+# Lu ici (et non dans config.py) : module partagé avec bq_utils / bq_mcp_server, sans Slack
+BQ_ARROW_ENABLED = os.getenv("BQ_ARROW_ENABLED", "true").lower() == "true"
+BQ_ARROW_PAGE_ROWS = int(os.getenv("BQ_ARROW_PAGE_ROWS", "10000"))            # lignes max par page REST
+BQ_STORAGE_API_MIN_ROWS = int(os.getenv("BQ_STORAGE_API_MIN_ROWS", "20000"))  # budget à partir duquel lire en Storage API
+
+_storage_clients: Dict[int, Any] = {}
+_storage_lock = threading.Lock()
+
+
+def available() -> bool:
+    return pa is not None and BQ_ARROW_ENABLED
+
+
+def _storage_client(client):
+    """Client Storage Read API partagé par client BigQuery (mêmes credentials), ou None."""
+    if bigquery_storage is None or client is None:
+        return None
+    with _storage_lock:
+        storage = _storage_clients.get(id(client))
+        if storage is None:
+            try:
+                storage = bigquery_storage.BigQueryReadClient(credentials=client._credentials)
+            except Exception as e:
+                print(f"[BQ-Arrow] ⚠️ Storage Read API indisponible : {e}")
+                return None
+            _storage_clients[id(client)] = storage
+        return storage
+
+
+def read_batches(job, timeout: float, max_rows: int, client=None):
+    """
+    (nombre total de lignes, schéma BigQuery, générateur de record batches) d'un job, coupé à
+    `max_rows` lignes. Storage Read API si le budget le justifie (BigQuery la refuse d'elle-même
+    pour les petits résultats déjà servis en une page), pages REST sinon.
+    Les batches sont produits au fil de la lecture : la mémoire ne dépend pas de la taille du résultat.
+    """
+    storage = _storage_client(client) if max_rows >= BQ_STORAGE_API_MIN_ROWS else None
+    if storage is not None:
+        rows_iter = job.result(timeout=timeout)
+    else:
+        rows_iter = job.result(timeout=timeout, page_size=max(1, min(max_rows, BQ_ARROW_PAGE_ROWS)))
+
+    def batches():
+        count = 0
+        for batch in rows_iter.to_arrow_iterable(bqstorage_client=storage):
+            if count + batch.num_rows > max_rows:
+                batch = batch.slice(0, max_rows - count)
+            count += batch.num_rows
+            yield batch
+            if count >= max_rows:
+                return  # budget atteint : plus aucune page demandée
+
+    return getattr(rows_iter, "total_rows", None), rows_iter.schema or [], batches()
+
+
+def fetch_arrow(job, timeout: float, max_rows: int, client=None) -> Tuple["pa.Table", Optional[int]]:
+    """Au plus `max_rows` lignes d'un job en table Arrow, + nombre total de lignes du résultat."""
+    total_rows, schema, batches = read_batches(job, timeout, max_rows, client)
+    batches = list(batches)
+    if batches:
+        return pa.Table.from_batches(batches), total_rows
+    return pa.table({field.name: pa.array([]) for field in schema}), total_rows
+
+
+def fetch_rows(job, timeout: float, max_rows: int, client=None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Au plus `max_rows` lignes (dicts) + nombre total de lignes : Arrow si disponible, sinon Row par Row."""
+    if available():
+        table, total_rows = fetch_arrow(job, timeout, max_rows, client)
+        return table.to_pylist(), total_rows
+
+    rows_iter = job.result(timeout=timeout)
+    rows = []
+    for i, row in enumerate(rows_iter, 1):
+        rows.append(dict(row))
+        if i >= max_rows:
+            break
+    return rows, getattr(rows_iter, "total_rows", None)
+
+
+def fetch_columns(job, timeout: float, max_rows: int, client=None) -> Tuple[List[str], List[List[Any]]]:
+    """(noms de colonnes, lignes en listes) : les lignes sont reconstruites colonne par colonne."""
+    if available():
+        table, _ = fetch_arrow(job, timeout, max_rows, client)
+        columns = [column.to_pylist() for column in table.columns]
+        return table.column_names, [list(values) for values in zip(*columns)]
+
+    rows_iter = job.result(timeout=timeout)
+    fields = [schema_field.name for schema_field in rows_iter.schema]
+    rows = []
+    for i, row in enumerate(rows_iter):
+        if i >= max_rows:
+            break
+        rows.append([row.get(f) for f in fields])
+    return fields, rows
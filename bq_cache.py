@@ -0,0 +1,384 @@
+# bq_cache.py
+"""
+Cache partagé des résultats BigQuery (tous threads Slack confondus).
+
+Clé = SQL normalisé (sans commentaires, espaces compactés, mots-clés en majuscules ; identifiants
+et alias gardent leur casse) + projet + contexte de date :
+chaque CURRENT_DATE('fuseau') est résolu (ex: CURRENT_DATE('Europe/Paris') → date du jour à Paris),
+donc une requête « hier » ne ressert jamais le résultat de la veille. Les requêtes volatiles
+(CURRENT_TIMESTAMP, RAND, …) ne sont pas mises en cache.
+
+Requêtes identiques simultanées (plusieurs utilisateurs après le bilan du matin, requête répétée
+par le modèle dans la même boucle de tools) : SINGLE_FLIGHT ne lance qu'un job, les autres
+appelants attendent son résultat (cf. SingleFlight). Si ce job est annulé pour le thread qui l'a
+lancé (stop, message plus récent), un des appelants en attente relance la requête.
+
+Invalidation :
+- `last_modified` des tables référencées (métadonnées via get_table, elles-mêmes gardées
+  BQ_CACHE_METADATA_TTL_S secondes pour que les hits restent en millisecondes)
+- TTL (BQ_CACHE_TTL_S), seule garantie pour les vues et INFORMATION_SCHEMA
+- éviction LRU bornée en octets (BQ_CACHE_MAX_MB)
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from dateutil import tz
+import sql_ast
+from bq_config import (
+    BQ_CACHE_ENABLED,
+    BQ_CACHE_TTL_S,
+    BQ_CACHE_MAX_MB,
+    BQ_CACHE_METADATA_TTL_S,
+    BQ_SINGLE_FLIGHT_ENABLED
+)
+from bq_jobs import JobCancelled
+
+_VOLATILE_RE = re.compile(
+    r"\b(current_timestamp|current_datetime|current_time|rand|generate_uuid|session_user)\s*\(",
+    re.IGNORECASE
+)
+_CURRENT_DATE_RE = re.compile(r"\bcurrent_date\s*(?:\(\s*(?:'([^']*)'|\"([^\"]*)\")?\s*\))?", re.IGNORECASE)
+_TABLE_REF_RE = re.compile(r"\b(?:from|join)\s+(`[^`]+`|[\w-]+(?:\.[\w-]+){1,2})", re.IGNORECASE)
+_EXTRACT_FROM_RE = re.compile(r"\bextract\s*\(\s*\w+\s+from\b", re.IGNORECASE)  # EXTRACT(YEAR FROM t.col)
+# Littéraux (conservés tels quels) | commentaires (retirés)
+_SQL_TOKEN_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|(--[^\n]*|/\*.*?\*/)", re.DOTALL)
+
+
+# ---------------------------------------
+# Clé de cache
+# ---------------------------------------
+def _normalize_code(code: str) -> str:
+    # Espaces autour de la ponctuation : « a , b » et « a,b » donnent la même clé
+    code = re.sub(r"\s+", " ", code)
+    return re.sub(r"\s*([(),=<>+\-*/])\s*", r"\1", code)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    SQL canonique : sans commentaires, espaces compactés, mots-clés en majuscules (régénéré par sqlglot).
+    La casse des identifiants est gardée : alias des colonnes renvoyées, tables sensibles à la casse.
+    """
+    tree = sql_ast.parse(sql)
+    if tree is not None:
+        return tree.sql(dialect=sql_ast.DIALECT, comments=False, normalize_functions="upper")
+    # Non analysable : seuls commentaires et espaces sont normalisés, la casse reste celle du texte
+    parts, code, last = [], "", 0
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        code += sql[last:match.start()]
+        last = match.end()
+        if match.group(1):
+            parts.extend([_normalize_code(code), match.group(1)])
+            code = ""
+        else:
+            code += " "  # commentaire
+    parts.append(_normalize_code(code + sql[last:]))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def date_context(sql: str) -> str:
+    """Dates résolues des CURRENT_DATE de la requête (UTC si aucun fuseau, comme BigQuery)."""
+    dates = set()
+    for match in _CURRENT_DATE_RE.finditer(sql):
+        zone_name = match.group(1) or match.group(2) or "UTC"
+        zone = tz.gettz(zone_name) or tz.UTC
+        dates.add(f"{zone_name}={datetime.now(zone).date().isoformat()}")
+    return ",".join(sorted(dates))
+
+
+def query_key(project: str, sql: str, max_rows: Optional[int] = None) -> Optional[str]:
+    """Empreinte d'une requête (projet, nombre de lignes lues, dates résolues, SQL normalisé), None si volatile."""
+    if _VOLATILE_RE.search(sql):
+        return None
+    raw = f"{project}|{max_rows or ''}|{date_context(sql)}|{normalize_sql(sql)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_key(project: str, sql: str, max_rows: Optional[int] = None) -> Optional[str]:
+    """Clé de cache d'une requête (et du nombre de lignes lues), ou None si elle ne doit pas être mise en cache."""
+    return query_key(project, sql, max_rows) if BQ_CACHE_ENABLED else None
+
+
+def flight_key(project: str, sql: str, max_rows: Optional[int] = None, variant: str = "") -> Optional[str]:
+    """
+    Clé de déduplication des requêtes en cours (indépendante de l'activation du cache).
+    `variant` : paramètres d'exécution qui changent l'issue du job (ex: plafond d'octets facturés).
+    """
+    key = query_key(project, sql, max_rows) if BQ_SINGLE_FLIGHT_ENABLED else None
+    return f"{key}:{variant}" if key and variant else key
+
+
+def referenced_tables(sql: str, default_project: str) -> List[str]:
+    """Tables référencées (FROM / JOIN, hors CTE) sous forme projet.dataset.table."""
+    refs = sql_ast.table_refs(sql)
+    if refs is None:  # SQL non analysable : repli sur les FROM / JOIN du texte
+        refs = [m.group(1).strip("`") for m in _TABLE_REF_RE.finditer(_EXTRACT_FROM_RE.sub("extract(", sql))]
+    tables = []
+    for ref in refs:
+        parts = ref.split(".")
+        if len(parts) == 2:
+            parts = [default_project] + parts
+        if len(parts) == 3:
+            ref = ".".join(parts)
+            if ref not in tables:
+                tables.append(ref)
+    return tables
+
+
+# ---------------------------------------
+# Cache
+# ---------------------------------------
+class _Entry:
+    def __init__(self, value: Any, size: int, versions: Dict[str, Optional[float]]):
+        self.value = value
+        self.size = size
+        self.versions = versions
+        self.created = time.time()
+
+
+class QueryCache:
+    """Cache LRU borné en octets, avec TTL et invalidation sur `last_modified` des tables."""
+
+    def __init__(self, max_bytes: int, ttl_s: float, metadata_ttl_s: float):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.metadata_ttl_s = metadata_ttl_s
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._versions: Dict[str, Tuple[Optional[float], float]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    # ---------- Métadonnées ----------
+    def _table_version(self, client, ref: str) -> Optional[float]:
+        """Horodatage `modified` d'une table (None pour vues / tables inaccessibles → TTL seul)."""
+        now = time.time()
+        cached = self._versions.get(ref)
+        if cached and now - cached[1] < self.metadata_ttl_s:
+            return cached[0]
+        version = None
+        if "information_schema" not in ref.lower() and "*" not in ref:
+            try:
+                table = client.get_table(ref)
+                if getattr(table, "table_type", "TABLE") != "VIEW" and table.modified:
+                    version = table.modified.timestamp()
+            except Exception as e:
+                print(f"[BQ-Cache] ⚠️ métadonnées indisponibles pour {ref} : {str(e)[:100]}")
+        self._versions[ref] = (version, now)
+        return version
+
+    def table_versions(self, client, sql: str) -> Dict[str, Optional[float]]:
+        """Version courante de chaque table référencée par la requête."""
+        return {ref: self._table_version(client, ref) for ref in referenced_tables(sql, client.project)}
+
+    # ---------- Lecture / écriture ----------
+    def get(self, client, key: Optional[str]) -> Any:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+
+        reason = None
+        if time.time() - entry.created > self.ttl_s:
+            reason = "TTL expiré"
+        elif any(self._table_version(client, ref) != version for ref, version in entry.versions.items()):
+            reason = "table modifiée"
+        if reason:
+            self._drop(key)
+            self._count("invalidations")
+            self._count("misses")
+            print(f"[BQ-Cache] entrée invalidée ({reason})")
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return entry.value
+
+    def put(self, key: Optional[str], value: Any, size: int, versions: Dict[str, Optional[float]]):
+        if key is None or size > self.max_bytes // 4:
+            return  # résultat trop gros pour être partagé utilement
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old.size
+            self._entries[key] = _Entry(value, size, versions)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._bytes -= entry.size
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs du cache (hits, misses, invalidations, évictions, taille)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def log_stats(self):
+        s = self.stats()
+        print(f"[BQ-Cache] hits={s['hits']} misses={s['misses']} ({s['hit_ratio']:.0%}) "
+              f"invalidations={s['invalidations']} evictions={s['evictions']} "
+              f"entries={s['entries']} size={s['bytes'] / 2 ** 20:.1f}/{s['max_bytes'] / 2 ** 20:.0f} MB")
+
+
+# ---------------------------------------
+# Déduplication des requêtes en cours
+# ---------------------------------------
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.abandoned = False  # annulé pour le seul appelant qui l'exécutait
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Une seule exécution à la fois par clé : le premier appelant exécute, les appelants suivants
+    (même clé, pendant l'exécution) attendent et reçoivent le même résultat — ou la même exception.
+    Exception : une annulation propre à l'appelant qui exécute (JobCancelled : stop ou message plus
+    récent dans son thread, asyncio.CancelledError) n'est pas transmise, un appelant en attente
+    reprend l'exécution. Rien n'est gardé après la fin de l'appel : la réutilisation relève du cache.
+    """
+
+    PRIVATE_ERRORS = (JobCancelled, asyncio.CancelledError)
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def _join(self, key: str) -> Tuple[_Call, bool]:
+        """(appel en cours pour la clé, True si l'appelant doit l'exécuter)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _finish(self, key: str, call: _Call):
+        with self._lock:
+            self._calls.pop(key, None)
+        if call.waiters:
+            print(f"[BQ-Flight] résultat partagé avec {call.waiters} appel(s) identique(s)")
+        call.done.set()
+
+    @staticmethod
+    def _result(call: _Call, deadline: Optional[float], timeout: Optional[float]) -> Tuple[bool, Any]:
+        """(True, résultat) quand l'appel est terminé, (False, None) s'il a été abandonné par son exécutant."""
+        if not call.done.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+            raise TimeoutError(f"requête identique en cours depuis plus de {timeout}s")
+        if call.abandoned:
+            print("[BQ-Flight] requête identique annulée par son thread → relance")
+            return False, None
+        if call.error is not None:
+            raise call.error
+        return True, call.value
+
+    def _failed(self, call: _Call, error: BaseException):
+        if isinstance(error, self.PRIVATE_ERRORS):
+            call.abandoned = True
+        else:
+            call.error = error
+
+    def do(self, key: Optional[str], fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Exécute `fn()` ou attend (au plus `timeout` s) l'exécution identique déjà en cours."""
+        if key is None:
+            return fn()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            print("[BQ-Flight] requête identique déjà en cours → attente de son résultat")
+            finished, value = self._result(call, deadline, timeout)
+            if finished:
+                return value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            self._failed(call, e)
+            raise
+        finally:
+            self._finish(key, call)
+
+    async def do_async(self, key: Optional[str], fn: Callable[[], Awaitable[Any]],
+                       timeout: Optional[float] = None) -> Any:
+        """Variante asyncio de `do` : l'attente ne bloque pas la boucle d'événements."""
+        if key is None:
+            return await fn()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            print("[BQ-Flight] requête identique déjà en cours → attente de son résultat")
+            finished, value = await asyncio.to_thread(self._result, call, deadline, timeout)
+            if finished:
+                return value
+        try:
+            call.value = await fn()
+            return call.value
+        except BaseException as e:
+            self._failed(call, e)
+            raise
+        finally:
+            self._finish(key, call)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"leaders": self.leaders, "shared": self.shared, "in_flight": len(self._calls)}
+
+
+BQ_CACHE = QueryCache(
+    max_bytes=int(BQ_CACHE_MAX_MB * 1024 * 1024),
+    ttl_s=BQ_CACHE_TTL_S,
+    metadata_ttl_s=BQ_CACHE_METADATA_TTL_S,
+)
+
+SINGLE_FLIGHT = SingleFlight()
@@ -0,0 +1,78 @@
+# bq_config.py
+"""
+Configuration BigQuery partagée par le bot, bq_utils et le serveur MCP (cf. bq_engine.py).
+
+Sans Slack ni Anthropic : importable hors du bot. config.py ré-exporte ces constantes.
+"""
+
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).with_name(".env"))
+
+TOOL_TIMEOUT_S = int(os.getenv("TOOL_TIMEOUT_S", "120"))
+
+# ---------- Cache des résultats BigQuery (cf. bq_cache.py) ----------
+BQ_CACHE_ENABLED         = os.getenv("BQ_CACHE_ENABLED", "true").lower() == "true"
+BQ_CACHE_TTL_S           = float(os.getenv("BQ_CACHE_TTL_S", "3600"))          # durée de vie max d'un résultat
+BQ_CACHE_MAX_MB          = float(os.getenv("BQ_CACHE_MAX_MB", "64"))           # LRU borné en mémoire
+BQ_CACHE_METADATA_TTL_S  = float(os.getenv("BQ_CACHE_METADATA_TTL_S", "60"))   # fraîcheur des last_modified
+BQ_SINGLE_FLIGHT_ENABLED = os.getenv("BQ_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"  # un job par requête identique en cours
+
+# ---------- Garde-fou coût des requêtes (dry run avant exécution, cf. bq_guard.py) ----------
+BQ_DRY_RUN_ENABLED     = os.getenv("BQ_DRY_RUN_ENABLED", "true").lower() == "true"
+BQ_GATE_MAX_GB         = float(os.getenv("BQ_GATE_MAX_GB", "20"))          # au-delà : requête renvoyée au modèle
+BQ_MAX_BYTES_BILLED_GB = float(os.getenv("BQ_MAX_BYTES_BILLED_GB", "100"))  # plafond dur côté BigQuery
+BQ_PRICE_PER_TIB       = float(os.getenv("BQ_PRICE_PER_TIB", "6.25"))      # prix indicatif on-demand ($)
+
+# ---------- Conseiller partitionnement / clustering (cf. query_advisor.py) ----------
+QUERY_ADVISOR_ENABLED     = os.getenv("QUERY_ADVISOR_ENABLED", "true").lower() == "true"
+QUERY_ADVISOR_WINDOW_DAYS = int(os.getenv("QUERY_ADVISOR_WINDOW_DAYS", "90"))  # fenêtre par défaut sans borne de date (0 = jamais)
+QUERY_ADVISOR_LOG_PATH    = os.getenv("QUERY_ADVISOR_LOG_PATH", str(Path(__file__).with_name("query_advisor.jsonl")))  # dry runs avant/après ("" = off)
+
+# ---------- Snapshot local des agrégats chauds de sales.box_sales (cf. analytics_snapshot.py) ----------
+ANALYTICS_SNAPSHOT_ENABLED       = os.getenv("ANALYTICS_SNAPSHOT_ENABLED", "true").lower() == "true"
+ANALYTICS_SNAPSHOT_PATH          = os.getenv("ANALYTICS_SNAPSHOT_PATH", str(Path(__file__).with_name("analytics_snapshot.sqlite")))
+ANALYTICS_SNAPSHOT_HISTORY_DAYS  = int(os.getenv("ANALYTICS_SNAPSHOT_HISTORY_DAYS", "800"))   # profondeur (comparaisons YoY incluses)
+ANALYTICS_SNAPSHOT_LOOKBACK_DAYS = int(os.getenv("ANALYTICS_SNAPSHOT_LOOKBACK_DAYS", "7"))    # jours recalculés à chaque rafraîchissement
+ANALYTICS_SNAPSHOT_REFRESH_MIN   = float(os.getenv("ANALYTICS_SNAPSHOT_REFRESH_MIN", "30"))
+ANALYTICS_SNAPSHOT_MAX_AGE_MIN   = float(os.getenv("ANALYTICS_SNAPSHOT_MAX_AGE_MIN", "120"))  # au-delà : BigQuery
+
+# ---------- Clients et routage par projet (cf. bq_engine.py) ----------
+def _parse_dataset_projects(raw: str) -> dict:
+    """'ops=normalised-417010,sales=teamdata-291012' → {dataset: projet}."""
+    mapping = {}
+    for item in raw.split(","):
+        if "=" in item:
+            dataset, project = item.split("=", 1)
+            if dataset.strip() and project.strip():
+                mapping[dataset.strip()] = project.strip()
+    return mapping
+
+
+_SECOND_PROJECT = os.getenv("BIGQUERY_PROJECT_ID_2", "")
+BQ_CLIENT_POOL_SIZE = int(os.getenv("BQ_CLIENT_POOL_SIZE", "8"))  # clients (projet, location) gardés
+# Projet propriétaire des datasets cités sans projet ('ops.shipments_all') ; défaut : datasets du second projet
+BQ_DATASET_PROJECTS = _parse_dataset_projects(os.getenv(
+    "BQ_DATASET_PROJECTS",
+    ",".join(f"{dataset}={_SECOND_PROJECT}" for dataset in ("ops", "crm", "reviews")) if _SECOND_PROJECT else ""
+))
+# Projets qui peuvent exécuter (et payer) une requête routée ; une table d'un autre projet
+# (ex: bigquery-public-data) est lue depuis le projet par défaut, jamais facturée à son propriétaire
+BQ_BILLING_PROJECTS = {p.strip() for p in os.getenv(
+    "BQ_BILLING_PROJECTS",
+    ",".join([p for p in (os.getenv("BIGQUERY_PROJECT_ID"), _SECOND_PROJECT) if p] + list(BQ_DATASET_PROJECTS.values()))
+).split(",") if p.strip()}
+
+# ---------- Rapport coût / latence des jobs étiquetés (cf. bq_report.py) ----------
+BQ_REPORT_REGION = os.getenv("BQ_REPORT_REGION", "region-eu")  # région des vues INFORMATION_SCHEMA.JOBS_BY_PROJECT
+BQ_REPORT_PROJECTS = [p.strip() for p in os.getenv(
+    "BQ_REPORT_PROJECTS",
+    ",".join(p for p in (os.getenv("BIGQUERY_PROJECT_ID"), _SECOND_PROJECT) if p)
+).split(",") if p.strip()]
+
+# ---------- Outils hors bot : bq_utils, serveur MCP (cf. bq_engine.py) ----------
+BQ_ALLOWED_DATASETS          = {s.strip() for s in os.getenv("BQ_ALLOWED_DATASETS", "").split(",") if s.strip()}
+BQ_TOOLS_MAX_BYTES_BILLED_GB = float(os.getenv("BQ_TOOLS_MAX_BYTES_BILLED_GB", "1"))  # plafond dur par requête
+BQ_TOOLS_MAX_ROWS            = int(os.getenv("BQ_TOOLS_MAX_ROWS", "10000"))           # lignes max renvoyées
@@ -0,0 +1,325 @@
+# bq_engine.py
+"""
+Moteur d'exécution BigQuery unique, partagé par les trois fronts :
+- le bot Slack (bigquery_tools : requêtes, comparaisons, drill-downs ; export_tools)
+- bq_utils.run_sql
+- le serveur MCP (bq_mcp_server.query)
+
+Une requête passe toujours par les mêmes étapes :
+1. `prepare()` : lecture seule (AST sqlglot, regex en repli), datasets autorisés, LIMIT injecté
+2. cache partagé (cf. bq_cache) ; requêtes identiques en cours regroupées (SINGLE_FLIGHT)
+3. dry run avant les requêtes libres (cf. bq_guard), seuil plafonné par le budget du front
+4. job étiqueté (`app`, `frontend`), plafond d'octets facturés + timeout serveur, sondé et
+   annulable (cf. bq_jobs), lecture colonnaire arrêtée au budget de lignes (cf. bq_arrow)
+
+Les clients BigQuery sont partagés par (projet, location) dans un pool LRU borné ; `route()` choisit
+le projet qui exécute d'après les tables de la requête (+ BQ_DATASET_PROJECTS pour 'dataset.table').
+Sans Slack ni Anthropic (cf. bq_config.py) : importable par bq_utils et le serveur MCP.
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from google.cloud import bigquery
+from sqlglot import exp
+import sql_ast
+from bq_arrow import fetch_rows
+from bq_cache import BQ_CACHE, SINGLE_FLIGHT, cache_key, flight_key
+from bq_config import BQ_BILLING_PROJECTS, BQ_CLIENT_POOL_SIZE, BQ_DATASET_PROJECTS, BQ_GATE_MAX_GB, TOOL_TIMEOUT_S
+from bq_guard import check_query, job_config, scan_cost
+from bq_jobs import JOB_MANAGER, JobCancelled
+
+# Repli quand le SQL n'est pas analysable par sqlglot
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|TRUNCATE|CREATE|ALTER|GRANT|REVOKE|CALL|EXECUTE)\b",
+                       re.IGNORECASE)
+_TABLE_RE = re.compile(r"`?([a-zA-Z0-9\-_]+)\.([a-zA-Z0-9\-_]+)\.([a-zA-Z0-9\-_]+)`?")
+
+
+class QueryRefused(ValueError):
+    """Requête refusée avant exécution (écriture, dataset non autorisé, dry run) : message à renvoyer tel quel."""
+
+
+class QueryResult:
+    """Lignes d'une requête (au plus le budget demandé) et métadonnées du job."""
+
+    def __init__(self, rows: list, total_rows: Optional[int], bytes_processed: int, cached: bool = False,
+                 freshness: Optional[str] = None, columns: Optional[List[str]] = None):
+        self.rows = rows
+        self.total_rows = total_rows
+        self.bytes_processed = bytes_processed
+        self.cached = cached
+        self.freshness = freshness  # note de fraîcheur si servi par le snapshot local
+        self.columns = columns if columns is not None else (list(rows[0]) if rows else [])
+
+
+# ---------------------------------------
+# Garde-fous
+# ---------------------------------------
+def _dataset_refs(sql: str) -> Iterable[Tuple[Optional[str], str]]:
+    """(projet ou None, dataset) de chaque table qualifiée lue par la requête."""
+    parts = sql_ast.table_parts(sql)
+    if parts is None:
+        return [(project, dataset) for project, dataset, _table in _TABLE_RE.findall(sql)]
+    return [(project or None, dataset) for project, dataset, _table in parts]
+
+
+def check_read_only(sql: str, allowed: Iterable[str] = ()):
+    """Lève QueryRefused si la requête n'est pas une lecture, ou lit un dataset hors de `allowed` (si non vide)."""
+    tree = sql_ast.parse(sql)
+    if tree is None:
+        unsafe = _WRITE_RE.search(sql) or ";" in sql.strip().rstrip(";")
+    else:
+        unsafe = not isinstance(tree, exp.Query)
+    if unsafe:
+        raise QueryRefused("❌ Requête refusée (DDL/DML détecté). Lecture seule uniquement.")
+    allowed = set(allowed)
+    if allowed:
+        for project, dataset in _dataset_refs(sql):
+            # autorisé si le dataset est listé (peu importe le projet) OU si le projet est listé
+            if dataset not in allowed and project not in allowed:
+                raise QueryRefused(f"❌ Dataset non autorisé : {f'{project}.' if project else ''}{dataset}. "
+                                   f"Autorisés : {', '.join(sorted(allowed))}")
+
+
+# ---------------------------------------
+# Moteur
+# ---------------------------------------
+class BigQueryEngine:
+    """Clients partagés, garde-fous, cache, exécution et métriques communs à tous les fronts."""
+
+    def __init__(self):
+        self._clients: "OrderedDict[Tuple[Optional[str], Optional[str]], bigquery.Client]" = OrderedDict()
+        self._pinned: Set[Tuple[Optional[str], Optional[str]]] = set()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    # ---------- Clients ----------
+    def client(self, project: Optional[str] = None, location: Optional[str] = None,
+               pinned: bool = False) -> bigquery.Client:
+        """
+        Client BigQuery partagé pour (projet, location), créé à la demande.
+        Pool LRU borné à BQ_CLIENT_POOL_SIZE ; `pinned` : jamais évincé (clients principaux du bot).
+        """
+        key = (project, location)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = bigquery.Client(project=project, location=location)
+                self._clients[key] = client
+                print(f"[BQ-Engine] client {client.project} ({location or 'location auto'}) créé, "
+                      f"{len(self._clients)} client(s) dans le process")
+            self._clients.move_to_end(key)
+            if pinned:
+                self._pinned.add(key)
+            while len(self._clients) > BQ_CLIENT_POOL_SIZE:
+                victim = next((k for k in self._clients if k not in self._pinned), None)
+                if victim is None:
+                    break
+                # Pas de close() : un job en cours peut encore utiliser ce client
+                self._clients.pop(victim)
+                print(f"[BQ-Engine] client {victim[0]} ({victim[1] or 'location auto'}) retiré du pool")
+            return client
+
+    def _project_of(self, project: str, dataset: str, default_project: Optional[str]) -> Optional[str]:
+        return project or BQ_DATASET_PROJECTS.get(dataset) or default_project
+
+    def billing_project(self, sql: str, default_project: Optional[str] = None) -> Optional[str]:
+        """
+        Projet qui exécute la requête : celui de la table principale (FROM externe), sinon le
+        plus cité ; tables 'dataset.table' résolues par BQ_DATASET_PROJECTS puis `default_project`.
+        Seuls les projets configurés (BQ_BILLING_PROJECTS) sont retenus, sinon `default_project`.
+        """
+        parts = sql_ast.table_parts(sql) or []
+        projects = [self._project_of(project, dataset, default_project) for project, dataset, _table in parts]
+        billable = BQ_BILLING_PROJECTS | {default_project}
+        main = sql_ast.main_table(sql)
+        for part, resolved in zip(parts, projects):
+            if main == ".".join(p for p in part if p) and resolved in billable:
+                return resolved
+        projects = [p for p in projects if p and p in billable]
+        return max(projects, key=projects.count) if projects else default_project
+
+    def route(self, sql: str, default_project: Optional[str] = None,
+              location: Optional[str] = None) -> Tuple[bigquery.Client, str]:
+        """
+        (client du projet de facturation, SQL à exécuter) d'après les tables de la requête.
+        Une table 'dataset.table' d'un autre projet que celui qui exécute est qualifiée par
+        son projet : BigQuery la résoudrait sinon dans le projet du job.
+        """
+        billing = self.billing_project(sql, default_project)
+
+        def foreign(dataset: str) -> Optional[str]:
+            project = self._project_of("", dataset, default_project)
+            return project if project and project != billing else None
+
+        routed = sql_ast.qualify_tables(sql, foreign) or sql
+        if routed != sql:
+            print(f"[BQ-Engine] requête routée vers {billing} (tables qualifiées par projet)")
+        return self.client(billing, location), routed
+
+    # ---------- Métriques ----------
+    def _count(self, frontend: str, **deltas):
+        with self._lock:
+            stats = self._stats.setdefault(frontend, {"queries": 0, "cache_hits": 0, "jobs": 0, "refused": 0,
+                                                      "cancelled": 0, "errors": 0, "bytes": 0, "seconds": 0.0})
+            for name, value in deltas.items():
+                stats[name] += value
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {frontend: dict(stats) for frontend, stats in self._stats.items()}
+
+    def log_stats(self):
+        parts = [f"{frontend}: {s['queries']} requêtes ({s['cache_hits']} cache), {s['jobs']} jobs, "
+                 f"{s['bytes'] / 2 ** 30:.2f} Go, {s['refused']} refus, {s['errors']} erreurs"
+                 for frontend, s in self.stats().items()]
+        print("[BQ-Engine] " + " | ".join(parts))
+
+    # ---------- Étapes ----------
+    def prepare(self, sql: str, limit: int, allowed: Iterable[str] = (), frontend: str = "slack") -> str:
+        """SQL prêt à exécuter : lecture seule vérifiée, datasets autorisés, LIMIT ajouté si absent."""
+        sql = (sql or "").strip().rstrip(";").strip()
+        try:
+            check_read_only(sql, allowed)
+        except QueryRefused:
+            self._count(frontend, queries=1, refused=1)
+            raise
+        return sql_ast.enforce_limit(sql, limit)
+
+    def lookup(self, client, sql: str, max_rows: int, frontend: str = "slack"):
+        """(résultat en cache ou None, clé, versions des tables à associer au futur résultat)."""
+        key = cache_key(client.project, sql, max_rows)
+        if key is None:
+            return None, None, {}
+        started = time.perf_counter()
+        hit = BQ_CACHE.get(client, key)
+        if hit is not None:
+            print(f"[BQ-Cache] hit en {(time.perf_counter() - started) * 1000:.1f}ms "
+                  f"(~{hit.bytes_processed:,} bytes non rescannés)")
+            BQ_CACHE.log_stats()
+            self._count(frontend, queries=1, cache_hits=1)
+            return QueryResult(hit.rows, hit.total_rows, hit.bytes_processed, cached=True,
+                               columns=getattr(hit, "columns", None)), key, {}
+        # Versions lues AVANT le job : une table rafraîchie pendant la requête invalidera l'entrée
+        return None, key, BQ_CACHE.table_versions(client, sql)
+
+    def gate(self, client, sql: str, max_gb: Optional[float] = None, frontend: str = "slack"):
+        """Dry run : QueryRefused si la requête dépasse le seuil du front (plafonné par `max_gb`)."""
+        refusal = check_query(client, sql, min(BQ_GATE_MAX_GB, max_gb) if max_gb else BQ_GATE_MAX_GB)
+        if refusal:
+            self._count(frontend, refused=1)
+            raise QueryRefused(refusal)
+
+    def start(self, client, sql: str, timeout: float = TOOL_TIMEOUT_S, frontend: str = "slack",
+              gate: bool = True, max_gb: Optional[float] = None):
+        """Dry run (si `gate`) puis soumission du job étiqueté, sans attendre sa fin."""
+        if gate:
+            self.gate(client, sql, max_gb, frontend)
+        config = job_config(max_gb, timeout, labels={"frontend": frontend})
+        job = JOB_MANAGER.submit(client, sql, config)
+        self._count(frontend, jobs=1)
+        return job
+
+    def submit(self, client, sql: str, timeout: float = TOOL_TIMEOUT_S, frontend: str = "slack",
+               gate: bool = True, max_gb: Optional[float] = None):
+        """Job terminé (lecture des résultats laissée à l'appelant, ex: export en streaming)."""
+        job = self.start(client, sql, timeout, frontend, gate, max_gb)
+        JOB_MANAGER.wait(job, timeout)
+        return job
+
+    def _collect(self, client, job, timeout: float, key: Optional[str], versions: Optional[dict],
+                 max_rows: int, frontend: str) -> QueryResult:
+        """Lit les lignes d'un job terminé et les met en cache si la clé le permet."""
+        rows, total_rows = fetch_rows(job, timeout, max_rows, client)
+        bytes_proc = job.total_bytes_processed or 0
+        print(f"[BQ] {frontend} processed={bytes_proc:,} bytes (~{bytes_proc / float(1024 ** 4):.6f} TiB) "
+              f"cost≈${scan_cost(bytes_proc):.4f}")
+        self._count(frontend, bytes=bytes_proc)
+
+        columns = [field.name for field in (getattr(job, "schema", None) or [])] or None
+        result = QueryResult(rows, total_rows, bytes_proc, columns=columns)
+        if key is not None:
+            BQ_CACHE.put(key, result, len(json.dumps(rows, default=str)), versions or {})
+            BQ_CACHE.log_stats()
+        return result
+
+    def _track(self, frontend: str, started: float, fn: Callable[[], Any]) -> Any:
+        try:
+            return fn()
+        except QueryRefused:
+            raise
+        except JobCancelled:
+            self._count(frontend, cancelled=1)
+            raise
+        except Exception:
+            self._count(frontend, errors=1)
+            raise
+        finally:
+            self._count(frontend, queries=1, seconds=time.perf_counter() - started)
+            self.log_stats()
+
+    # ---------- Exécution ----------
+    @staticmethod
+    def _flight_key(client, sql: str, max_rows: int, max_gb: Optional[float]) -> Optional[str]:
+        # Le plafond d'octets facturés change l'issue du job : pas de partage entre plafonds différents
+        return flight_key(client.project, sql, max_rows, f"max_gb={max_gb}" if max_gb else "")
+
+    def run(self, client, sql: str, max_rows: int, timeout: float = TOOL_TIMEOUT_S, frontend: str = "slack",
+            gate: bool = True, max_gb: Optional[float] = None) -> QueryResult:
+        """
+        Exécute `sql` (déjà préparé) : cache, puis un seul job par requête identique en cours.
+        `gate` : dry run avant exécution (requêtes libres) ; `max_gb` : plafond d'octets du front.
+        Le dry run est fait pour chaque appelant, avant de rejoindre une exécution identique en cours :
+        le refus d'un front plus strict ne s'applique pas aux autres, et inversement.
+        """
+        started = time.perf_counter()
+        cached, key, versions = self.lookup(client, sql, max_rows, frontend)
+        if cached is not None:
+            return cached
+
+        def execute():
+            job = self.submit(client, sql, timeout, frontend, False, max_gb)
+            return self._collect(client, job, timeout, key, versions, max_rows, frontend)
+
+        def flight():
+            if gate:
+                self.gate(client, sql, max_gb, frontend)
+            return SINGLE_FLIGHT.do(self._flight_key(client, sql, max_rows, max_gb), execute, timeout)
+
+        return self._track(frontend, started, flight)
+
+    async def run_async(self, client, sql: str, max_rows: int, timeout: float = TOOL_TIMEOUT_S,
+                        frontend: str = "slack", gate: bool = True, max_gb: Optional[float] = None) -> QueryResult:
+        """Variante asyncio de `run` : le job est soumis puis sondé de façon coopérative."""
+        started = time.perf_counter()
+        cached, key, versions = await asyncio.to_thread(self.lookup, client, sql, max_rows, frontend)
+        if cached is not None:
+            return cached
+
+        async def execute():
+            job = await asyncio.to_thread(self.start, client, sql, timeout, frontend, False, max_gb)
+            await JOB_MANAGER.wait_async(job, timeout)
+            return await asyncio.to_thread(self._collect, client, job, timeout, key, versions, max_rows, frontend)
+
+        try:
+            if gate:
+                await asyncio.to_thread(self.gate, client, sql, max_gb, frontend)
+            return await SINGLE_FLIGHT.do_async(self._flight_key(client, sql, max_rows, max_gb), execute, timeout)
+        except JobCancelled:
+            self._count(frontend, cancelled=1)
+            raise
+        except QueryRefused:
+            raise
+        except Exception:
+            self._count(frontend, errors=1)
+            raise
+        finally:
+            self._count(frontend, queries=1, seconds=time.perf_counter() - started)
+            self.log_stats()
+
+
+ENGINE = BigQueryEngine()
@@ -0,0 +1,124 @@
+# bq_guard.py
+"""
+Garde-fou coût / latence avant d'exécuter le SQL écrit par le modèle.
+
+1. Dry run BigQuery (gratuit, ~100-300 ms) : octets estimés + erreurs SQL détectées sans
+   consommer le budget TOOL_TIMEOUT_S.
+2. Au-delà de BQ_GATE_MAX_GB : la requête n'est pas lancée, le tool_result explique pourquoi
+   (taille, coût, partitionnement / clustering des tables, pistes) pour que le modèle la réécrive.
+3. Les jobs réellement lancés portent un plafond dur (maximum_bytes_billed) et un timeout
+   côté serveur : un scan qui s'emballe est tué par BigQuery, pas seulement abandonné.
+   Ils sont aussi étiquetés (thread, utilisateur, tool… cf. bq_jobs.job_labels, bq_report.py).
+"""
+
+import re
+from typing import Optional
+from google.cloud import bigquery
+from bq_config import (
+    BQ_DRY_RUN_ENABLED,
+    BQ_GATE_MAX_GB,
+    BQ_MAX_BYTES_BILLED_GB,
+    BQ_PRICE_PER_TIB,
+    TOOL_TIMEOUT_S
+)
+from bq_jobs import JOB_MANAGER
+
+GB = 1024 ** 3
+
+_SELECT_STAR_RE = re.compile(r"\bselect\s+(?:distinct\s+)?(?:\w+\.)?\*", re.IGNORECASE)
+
+
+def scan_cost(bytes_processed: int) -> float:
+    """Coût indicatif on-demand d'un scan ($)."""
+    return bytes_processed / float(1024 ** 4) * BQ_PRICE_PER_TIB
+
+
+def job_config(max_gb: Optional[float] = None, timeout_s: Optional[float] = None, **kwargs) -> bigquery.QueryJobConfig:
+    """
+    Configuration des jobs lancés : plafond d'octets facturés + timeout serveur (défauts du bot),
+    labels du contexte courant complétés par `labels` (cf. bq_jobs.job_labels).
+    """
+    labels = {**JOB_MANAGER.job_labels(), **kwargs.pop("labels", {})}
+    return bigquery.QueryJobConfig(
+        maximum_bytes_billed=int((max_gb or BQ_MAX_BYTES_BILLED_GB) * GB),
+        job_timeout_ms=int((timeout_s or TOOL_TIMEOUT_S) * 1000),
+        labels=labels,
+        **kwargs
+    )
+
+
+class DryRun:
+    """Estimation d'une requête (octets scannés, tables référencées)."""
+
+    def __init__(self, bytes_processed: int, tables: list):
+        self.bytes_processed = bytes_processed
+        self.tables = tables
+
+    @property
+    def gb(self) -> float:
+        return self.bytes_processed / GB
+
+
+def dry_run(client, sql: str) -> DryRun:
+    """Dry run BigQuery (lève l'erreur BigQuery si le SQL est invalide)."""
+    job = client.query(sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    tables = [f"{t.project}.{t.dataset_id}.{t.table_id}" for t in (job.referenced_tables or [])]
+    return DryRun(job.total_bytes_processed or 0, tables)
+
+
+def _table_hint(client, ref: str) -> str:
+    """Taille, partitionnement et clustering d'une table (pour guider la réécriture)."""
+    try:
+        table = client.get_table(ref)
+    except Exception:
+        return f"- `{ref}`"
+    details = [f"{(table.num_bytes or 0) / GB:.1f} Go"]
+    partitioning = table.time_partitioning
+    if partitioning:
+        details.append(f"partitionnée par `{partitioning.field or '_PARTITIONTIME'}` ({partitioning.type_})")
+    elif table.range_partitioning:
+        details.append(f"partitionnée par plage sur `{table.range_partitioning.field}`")
+    else:
+        details.append("non partitionnée")
+    if table.clustering_fields:
+        details.append("clusterisée par " + ", ".join(f"`{f}`" for f in table.clustering_fields))
+    return f"- `{ref}` : " + ", ".join(details)
+
+
+def explain_refusal(client, sql: str, estimate: DryRun, gate_gb: float = BQ_GATE_MAX_GB) -> str:
+    """tool_result renvoyé au modèle quand une requête dépasse le seuil."""
+    lines = [
+        f"⛔ Requête NON exécutée : elle scannerait ~{estimate.gb:.1f} Go "
+        f"(≈${scan_cost(estimate.bytes_processed):.2f}, seuil {gate_gb:g} Go).",
+        "Tables lues :",
+    ]
+    lines.extend(_table_hint(client, ref) for ref in estimate.tables)
+    lines.append("Pour réduire le scan :")
+    lines.append("- filtre sur la colonne de partition avec des bornes littérales "
+                 "(ex: `date BETWEEN '2025-09-01' AND '2025-09-30'`, pas de fonction appliquée à la colonne)")
+    if _SELECT_STAR_RE.search(sql):
+        lines.append("- remplace `SELECT *` par les seules colonnes utiles (BigQuery facture par colonne lue)")
+    lines.append("- agrège dans BigQuery (GROUP BY) plutôt que de lister les lignes")
+    lines.append("Réécris la requête en conséquence puis relance-la.")
+    return "\n".join(lines)
+
+
+def check_query(client, sql: str, gate_gb: float = BQ_GATE_MAX_GB) -> Optional[str]:
+    """
+    Dry run avant exécution.
+    Retourne None si la requête peut partir, sinon le texte à renvoyer au modèle
+    (erreur SQL ou dépassement du seuil `gate_gb`).
+    """
+    if not BQ_DRY_RUN_ENABLED:
+        return None
+    try:
+        estimate = dry_run(client, sql)
+    except Exception as e:
+        return f"❌ Erreur BigQuery (dry run, requête non exécutée) : {str(e)}"
+
+    print(f"[BQ-Guard] dry run : ~{estimate.gb:.2f} Go (≈${scan_cost(estimate.bytes_processed):.4f}) "
+          f"sur {', '.join(estimate.tables) or '?'}")
+    if estimate.gb > gate_gb:
+        print(f"[BQ-Guard] ⛔ requête bloquée (> {gate_gb:g} Go)")
+        return explain_refusal(client, sql, estimate, gate_gb)
+    return None
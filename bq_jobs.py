@@ -0,0 +1,274 @@
+# bq_jobs.py
+"""
+Orchestration des jobs BigQuery lancés pour une conversation Slack.
+
+- Une « exécution » (QueryRun) par thread : ouverte au début d'ask_claude, fermée à la fin.
+  Un nouveau message dans le même thread remplace l'exécution précédente (ses jobs sont annulés).
+- Les jobs sont soumis via `submit()` (rattachés au thread courant) puis attendus par `wait()` /
+  `wait_async()` : sondage `job.done()` avec backoff au lieu d'un `job.result(timeout)` bloquant,
+  progression (état, étapes du plan, octets traités) affichée dans le placeholder Slack.
+- Annulation côté BigQuery (`job.cancel()`) quand l'utilisateur arrête le thread, quand le
+  timeout du job ou de la requête est atteint, ou quand la requête est remplacée ; la boucle de
+  tools de Claude est alors abandonnée (cf. `interrupted()`).
+
+Le thread Slack courant est porté par le contextvar `current_thread` (posé par tool_executor
+pour chaque tool, propagé aux pools internes via contextvars.copy_context()).
+
+Chaque job lancé porte des labels (cf. `job_labels()`) : bot, thread, utilisateur Slack, prompt,
+tool et nature de la requête (main/drilldown/compare/summary/…) ; bq_report.py agrège ensuite
+INFORMATION_SCHEMA.JOBS_BY_PROJECT sur ces labels.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Lu ici (et non dans config.py) : module utilisable hors du bot Slack
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "300"))  # durée max d'une requête utilisateur (tous jobs confondus)
+POLL_MIN_S, POLL_MAX_S = 0.25, 2.0
+APP_LABEL = "maelia"
+BOT_LABEL = os.getenv("BOT_NAME", "Franck")
+
+current_thread: contextvars.ContextVar = contextvars.ContextVar("bq_thread", default=None)
+current_tool: contextvars.ContextVar = contextvars.ContextVar("bq_tool", default=None)
+current_kind: contextvars.ContextVar = contextvars.ContextVar("bq_kind", default="main")
+
+_LABEL_RE = re.compile(r"[^\w-]+")
+
+
+def label_value(value) -> str:
+    """Valeur de label BigQuery valide : minuscules (accents admis), chiffres, '_' et '-', 63 caractères max."""
+    return _LABEL_RE.sub("_", str(value).lower()).strip("_")[:63]
+
+
+@contextlib.contextmanager
+def query_kind(kind: str):
+    """Nature des jobs lancés dans le bloc (label `kind`) ; utilisable aussi en décorateur."""
+    token = current_kind.set(kind)
+    try:
+        yield
+    finally:
+        current_kind.reset(token)
+
+
+class JobCancelled(Exception):
+    """Job (ou requête utilisateur) annulé : arrêt du thread, timeout, message plus récent."""
+
+
+class QueryRun:
+    """Requête utilisateur en cours dans un thread : jobs BigQuery associés + état d'annulation."""
+
+    def __init__(self, thread_ts: str, stream=None, timeout_s: float = REQUEST_TIMEOUT_S,
+                 user: Optional[str] = None, prompt: str = ""):
+        self.thread_ts = thread_ts
+        self.stream = stream
+        self.user = user
+        self.prompt = prompt
+        self.deadline = time.monotonic() + timeout_s
+        self.jobs: Dict[str, Any] = {}
+        self.cancelled = threading.Event()
+        self.reason: Optional[str] = None
+        try:
+            self.loop = asyncio.get_running_loop()  # progression d'un AsyncStreamingMessage
+        except RuntimeError:
+            self.loop = None
+
+
+def _describe(job, elapsed: float) -> str:
+    """Progression lisible d'un job : état, étapes du plan d'exécution, octets traités."""
+    state = {"PENDING": "en file", "RUNNING": "en cours"}.get(getattr(job, "state", None), "en cours")
+    parts = [f"⏳ BigQuery {state} ({elapsed:.0f}s)"]
+    plan = getattr(job, "query_plan", None) or []
+    if plan:
+        done = sum(1 for stage in plan if getattr(stage, "status", "") == "COMPLETE")
+        parts.append(f"étape {done}/{len(plan)}")
+    processed = getattr(job, "total_bytes_processed", None)
+    if processed:
+        parts.append(f"{processed / 2 ** 30:.2f} Go traités")
+    return " · ".join(parts)
+
+
+class JobManager:
+    """Jobs BigQuery par thread Slack : soumission, attente coopérative, annulation."""
+
+    def __init__(self):
+        self._runs: Dict[str, QueryRun] = {}
+        self._lock = threading.Lock()
+
+    # ---------- Cycle de vie d'une requête utilisateur ----------
+    def begin(self, thread_ts: str, stream=None, user: Optional[str] = None, prompt: str = "") -> QueryRun:
+        """Ouvre l'exécution d'un thread ; celle en cours (message précédent) est annulée."""
+        run = QueryRun(thread_ts, stream, user=user, prompt=prompt)
+        with self._lock:
+            previous = self._runs.get(thread_ts)
+            self._runs[thread_ts] = run
+        if previous is not None:
+            self._cancel(previous, "remplacée par un message plus récent du thread")
+        current_thread.set(thread_ts)
+        return run
+
+    def end(self, run: QueryRun):
+        with self._lock:
+            if self._runs.get(run.thread_ts) is run:
+                del self._runs[run.thread_ts]
+
+    def interrupted(self, run: Optional[QueryRun]) -> Optional[str]:
+        """Message d'interruption si l'exécution est annulée (ou vient de dépasser REQUEST_TIMEOUT_S)."""
+        if run is None:
+            return None
+        if not run.cancelled.is_set() and time.monotonic() > run.deadline:
+            self._cancel(run, f"délai de {REQUEST_TIMEOUT_S:.0f}s dépassé")
+        if run.cancelled.is_set():
+            return f"🛑 Requête interrompue : {run.reason}."
+        return None
+
+    def cancel_thread(self, thread_ts: str, reason: str) -> int:
+        """Annule la requête en cours d'un thread et ses jobs BigQuery. Retourne le nombre de jobs annulés."""
+        with self._lock:
+            run = self._runs.get(thread_ts)
+        return self._cancel(run, reason) if run is not None else 0
+
+    def jobs(self, thread_ts: str) -> List[str]:
+        """Identifiants des jobs BigQuery en cours pour un thread."""
+        with self._lock:
+            run = self._runs.get(thread_ts)
+            return list(run.jobs) if run else []
+
+    def _cancel(self, run: QueryRun, reason: str) -> int:
+        with self._lock:
+            if run.cancelled.is_set():
+                return 0
+            run.reason = reason
+            run.cancelled.set()
+            jobs = list(run.jobs.values())
+        for job in jobs:
+            self._cancel_job(job)
+        print(f"[BQ-Jobs] 🛑 thread {run.thread_ts[:10]}… : {reason} ({len(jobs)} job(s) annulé(s))")
+        return len(jobs)
+
+    @staticmethod
+    def _cancel_job(job):
+        try:
+            job.cancel()
+            print(f"[BQ-Jobs] job {job.job_id} annulé")
+        except Exception as e:
+            print(f"[BQ-Jobs] ⚠️ annulation du job {getattr(job, 'job_id', '?')} impossible : {e}")
+
+    # ---------- Jobs ----------
+    def current(self) -> Optional[QueryRun]:
+        thread_ts = current_thread.get()
+        if thread_ts is None:
+            return None
+        with self._lock:
+            return self._runs.get(thread_ts)
+
+    def job_labels(self, kind: Optional[str] = None) -> Dict[str, str]:
+        """Labels des jobs lancés depuis le contexte courant (thread, utilisateur, prompt, tool, nature)."""
+        run = self.current()
+        labels = {
+            "app": APP_LABEL,
+            "bot": BOT_LABEL,
+            "kind": kind or current_kind.get(),
+            "thread": current_thread.get(),
+            "user": run.user if run else None,
+            "prompt": run.prompt if run else None,
+            "tool": current_tool.get(),
+        }
+        labels = {key: label_value(value) for key, value in labels.items() if value}
+        return {key: value for key, value in labels.items() if value}
+
+    def raise_if_cancelled(self, run: Optional[QueryRun] = None):
+        run = run or self.current()
+        message = self.interrupted(run)
+        if message:
+            raise JobCancelled(message)
+
+    def submit(self, client, sql: str, job_config=None):
+        """Lance un job (sans attendre) et le rattache à la requête du thread courant."""
+        run = self.current()
+        self.raise_if_cancelled(run)
+        job = client.query(sql, job_config=job_config)
+        if run is not None:
+            with self._lock:
+                run.jobs[job.job_id] = job
+            if run.cancelled.is_set():  # annulé pendant la soumission
+                self._cancel_job(job)
+                raise JobCancelled(f"🛑 Requête interrompue : {run.reason}.")
+        return job
+
+    def _forget(self, run: Optional[QueryRun], job):
+        if run is not None:
+            with self._lock:
+                run.jobs.pop(job.job_id, None)
+
+    def _step(self, run: Optional[QueryRun], job, started: float, deadline: float) -> str:
+        """Contrôles entre deux sondages ; retourne le texte de progression à afficher."""
+        message = self.interrupted(run)
+        if message:
+            if job.job_id not in run.jobs:  # les jobs rattachés sont déjà annulés par _cancel
+                self._cancel_job(job)
+            raise JobCancelled(message)
+        now = time.monotonic()
+        if now > deadline:
+            self._cancel_job(job)
+            raise TimeoutError(f"job {job.job_id} > {deadline - started:.0f}s (annulé)")
+        return _describe(job, now - started)
+
+    def _report(self, run: Optional[QueryRun], text: str):
+        stream = run.stream if run is not None else None
+        if stream is None or not hasattr(stream, "on_progress"):
+            return
+        result = stream.on_progress(text)
+        if asyncio.iscoroutine(result):
+            # AsyncStreamingMessage : mise à jour exécutée sur la boucle de l'exécution
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is run.loop:
+                asyncio.ensure_future(result)
+            elif run.loop is not None:
+                asyncio.run_coroutine_threadsafe(result, run.loop)
+            else:
+                result.close()
+
+    def wait(self, job, timeout: float):
+        """Attend la fin d'un job en le sondant (réveil immédiat si la requête est annulée)."""
+        run = self.current()
+        started = time.monotonic()
+        deadline = started + timeout
+        interval = POLL_MIN_S
+        try:
+            while not job.done():
+                self._report(run, self._step(run, job, started, deadline))
+                if run is not None:
+                    run.cancelled.wait(interval)
+                else:
+                    time.sleep(interval)
+                interval = min(interval * 2, POLL_MAX_S)
+            self.raise_if_cancelled(run)  # job terminé… parce qu'annulé
+        finally:
+            self._forget(run, job)
+
+    async def wait_async(self, job, timeout: float):
+        """Variante asyncio de `wait` : le sondage ne bloque pas la boucle d'événements."""
+        run = self.current()
+        started = time.monotonic()
+        deadline = started + timeout
+        interval = POLL_MIN_S
+        try:
+            while not await asyncio.to_thread(job.done):
+                self._report(run, self._step(run, job, started, deadline))
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, POLL_MAX_S)
+            self.raise_if_cancelled(run)  # job terminé… parce qu'annulé
+        finally:
+            self._forget(run, job)
+
+
+JOB_MANAGER = JobManager()
@@ -1,28 +1,17 @@
 # bq_mcp_server.py
 import os, re
 from typing import List, Dict, Any
-from google.cloud import bigquery
 from mcp.server.fastmcp import FastMCP, Tool
+from bq_config import BQ_ALLOWED_DATASETS, BQ_TOOLS_MAX_BYTES_BILLED_GB, BQ_TOOLS_MAX_ROWS
+from bq_engine import ENGINE
 
 PROJECT   = os.environ.get("BQ_PROJECT")
 LOCATION  = os.environ.get("BQ_LOCATION", "europe-west1")
-ALLOWED   = set([s.strip() for s in os.environ.get("BQ_ALLOWED_DATASETS","").split(",") if s.strip()])
+ALLOWED   = BQ_ALLOWED_DATASETS
 
-bq = bigquery.Client(project=PROJECT, location=LOCATION)
+bq = ENGINE.client(PROJECT, LOCATION)  # client partagé par (projet, location), cf. bq_engine.py
 mcp = FastMCP("bigquery", "MCP server for BigQuery (read-only)")
 
-def _guard_sql(sql: str):
-    s = sql.strip().lower()
-    if not s.startswith("select"):
-        raise ValueError("Seules les requêtes SELECT sont autorisées.")
-    if any(k in s for k in [";"," insert "," update "," delete "," merge "," create "," drop "," truncate "]):
-        raise ValueError("DDL/DML interdits.")
-    # au moins 1 dataset autorisé présent
-    if ALLOWED:
-        ok = any(re.search(rf"`[^`]*\.{re.escape(ds)}\.", s) or re.search(rf"\b{re.escape(ds)}\.", s) for ds in ALLOWED)
-        if not ok:
-            raise ValueError(f"Dataset non autorisé. Autorisés: {sorted(ALLOWED)}")
-
 @mcp.tool()
 def list_tables(dataset: str) -> List[str]:
     """Liste les tables d'un dataset (ex: 'inter')."""
@@ -48,16 +37,12 @@ def describe_table(table: str) -> Dict[str, Any]:
 
 @mcp.tool()
 def query(sql: str, limit: int = 100) -> Dict[str, Any]:
-    """Exécute un SELECT BigQuery (lecture seule). Ajoute un LIMIT si absent."""
-    _guard_sql(sql)
-    if " limit " not in sql.lower():
-        sql = f"{sql.rstrip()} LIMIT {int(limit)}"
-    job = bq.query(sql, job_config=bigquery.QueryJobConfig(
-        use_legacy_sql=False,
-        maximum_bytes_billed=1_000_000_000  # 1 Go garde-fou
-    ))
-    rows = [dict(r.items()) for r in job]
-    return {"rows": rows, "row_count": len(rows)}
+    """Exécute une requête BigQuery en lecture seule (LIMIT ajouté si absent, dry run, cache partagé)."""
+    # Garde-fous, plafond d'octets et lecture arrêtée au budget : cf. bq_engine.py
+    limit = max(1, min(int(limit), BQ_TOOLS_MAX_ROWS))
+    sql = ENGINE.prepare(sql, limit, ALLOWED, frontend="mcp")
+    result = ENGINE.run(bq, sql, limit, timeout=120, frontend="mcp", max_gb=BQ_TOOLS_MAX_BYTES_BILLED_GB)
+    return {"rows": result.rows, "row_count": len(result.rows), "total_rows": result.total_rows}
 
 if __name__ == "__main__":
     # Par défaut, FastMCP lance un serveur stdio (parfait pour être spawn par un client MCP)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# bq_report.py
+"""
+Rapport coût / latence des jobs BigQuery lancés par le bot.
+
+Les jobs portent des labels (cf. bq_jobs.job_labels) : app, bot, thread, user, prompt, tool, kind.
+Ce module agrège INFORMATION_SCHEMA.JOBS_BY_PROJECT sur ces labels :
+- par jour : jobs, slot-ms, octets facturés, durée p50 / p95
+- par nature (main/drilldown/compare/summary/…) et par tool
+- prompts (threads) les plus coûteux de chaque jour
+
+    python bq_report.py --days 7 --top 5
+    @Franck bq report 14        (commande Slack, cf. slack_handlers.py)
+"""
+
+import re
+from typing import Dict, List, Optional
+from bq_config import BQ_REPORT_PROJECTS, BQ_REPORT_REGION
+from bq_engine import ENGINE
+from bq_guard import GB, scan_cost
+from bq_jobs import APP_LABEL, query_kind
+
+DEFAULT_DAYS = 7
+MAX_DAYS = 180  # rétention d'INFORMATION_SCHEMA.JOBS
+DEFAULT_TOP = 3
+
+_COMMAND_RE = re.compile(r"^bq\s+report(?:\s+(\d+))?$", re.IGNORECASE)
+
+_JOBS_SQL = """
+SELECT
+  DATE(creation_time, 'Europe/Paris') AS day,
+  IFNULL(total_slot_ms, 0) AS slot_ms,
+  IFNULL(total_bytes_billed, 0) AS bytes_billed,
+  TIMESTAMP_DIFF(end_time, creation_time, MILLISECOND) AS duration_ms,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'kind') AS kind,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'tool') AS tool,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'thread') AS thread,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'user') AS user,
+  (SELECT value FROM UNNEST(labels) WHERE key = 'prompt') AS prompt
+FROM `{project}`.`{region}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT
+WHERE creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)
+  AND job_type = 'QUERY'
+  AND state = 'DONE'
+  AND EXISTS (SELECT 1 FROM UNNEST(labels) WHERE key = 'app' AND value = '{app}')
+"""
+
+_DAILY_SQL = """
+WITH jobs AS ({jobs})
+SELECT
+  day,
+  COUNT(*) AS jobs,
+  SUM(slot_ms) AS slot_ms,
+  SUM(bytes_billed) AS bytes_billed,
+  APPROX_QUANTILES(duration_ms, 100)[OFFSET(50)] AS p50_ms,
+  APPROX_QUANTILES(duration_ms, 100)[OFFSET(95)] AS p95_ms
+FROM jobs
+GROUP BY day
+ORDER BY day DESC
+"""
+
+_BY_KIND_SQL = """
+WITH jobs AS ({jobs})
+SELECT
+  IFNULL(kind, 'main') AS kind,
+  IFNULL(tool, '-') AS tool,
+  COUNT(*) AS jobs,
+  SUM(slot_ms) AS slot_ms,
+  SUM(bytes_billed) AS bytes_billed,
+  APPROX_QUANTILES(duration_ms, 100)[OFFSET(95)] AS p95_ms
+FROM jobs
+GROUP BY kind, tool
+ORDER BY slot_ms DESC
+LIMIT 15
+"""
+
+_TOP_PROMPTS_SQL = """
+WITH jobs AS ({jobs})
+SELECT
+  day,
+  thread,
+  ANY_VALUE(user) AS user,
+  ANY_VALUE(prompt) AS prompt,
+  COUNT(*) AS jobs,
+  SUM(slot_ms) AS slot_ms,
+  SUM(bytes_billed) AS bytes_billed,
+  MAX(duration_ms) AS max_ms
+FROM jobs
+WHERE thread IS NOT NULL
+GROUP BY day, thread
+QUALIFY ROW_NUMBER() OVER (PARTITION BY day ORDER BY slot_ms DESC) <= {top}
+ORDER BY day DESC, slot_ms DESC
+"""
+
+
+def parse_command(text: str) -> Optional[int]:
+    """'bq report [jours]' → nombre de jours, None si ce n'est pas la commande."""
+    match = _COMMAND_RE.match((text or "").strip())
+    if not match:
+        return None
+    return max(1, min(int(match.group(1) or DEFAULT_DAYS), MAX_DAYS))
+
+
+def _jobs_sql(days: int, projects: List[str]) -> str:
+    """Jobs étiquetés du bot sur tous les projets (mêmes colonnes, UNION ALL)."""
+    return "\n  UNION ALL\n".join(
+        _JOBS_SQL.format(project=project, region=BQ_REPORT_REGION, days=int(days), app=APP_LABEL)
+        for project in projects
+    )
+
+
+@query_kind("report")
+def fetch_report(days: int = DEFAULT_DAYS, top: int = DEFAULT_TOP,
+                 projects: Optional[List[str]] = None) -> Dict[str, List[dict]]:
+    """{daily, by_kind, top_prompts} agrégés depuis INFORMATION_SCHEMA.JOBS_BY_PROJECT."""
+    projects = projects or BQ_REPORT_PROJECTS
+    if not projects:
+        raise ValueError("aucun projet BigQuery (BIGQUERY_PROJECT_ID ou BQ_REPORT_PROJECTS)")
+    client = ENGINE.client(projects[0])
+    jobs = _jobs_sql(days, projects)
+    sections = {
+        "daily": _DAILY_SQL.format(jobs=jobs),
+        "by_kind": _BY_KIND_SQL.format(jobs=jobs),
+        "top_prompts": _TOP_PROMPTS_SQL.format(jobs=jobs, top=int(top)),
+    }
+    return {name: ENGINE.run(client, sql, 1000, frontend="report", gate=False).rows
+            for name, sql in sections.items()}
+
+
+def _slot(ms) -> str:
+    hours = (ms or 0) / 3_600_000
+    return f"{hours:.1f} h slot" if hours >= 1 else f"{(ms or 0) / 60_000:.1f} min slot"
+
+
+def _bytes(value) -> str:
+    value = value or 0
+    return f"{value / GB:.1f} Go (~${scan_cost(value):.2f})"
+
+
+def _seconds(ms) -> str:
+    return f"{(ms or 0) / 1000:.1f}s"
+
+
+def format_report(report: Dict[str, List[dict]], days: int) -> str:
+    """Rapport lisible (markdown Slack)."""
+    if not report["daily"]:
+        return f"📊 Aucun job BigQuery étiqueté `app={APP_LABEL}` sur les {days} derniers jours."
+    lines = [f"📊 *Jobs BigQuery du bot — {days} derniers jours*", "", "*Par jour*"]
+    for row in report["daily"]:
+        lines.append(f"• {row['day']} : {row['jobs']} jobs · {_slot(row['slot_ms'])} · {_bytes(row['bytes_billed'])}"
+                     f" · p50 {_seconds(row['p50_ms'])} / p95 {_seconds(row['p95_ms'])}")
+
+    lines += ["", "*Par nature / tool*"]
+    for row in report["by_kind"]:
+        lines.append(f"• {row['kind']} / {row['tool']} : {row['jobs']} jobs · {_slot(row['slot_ms'])}"
+                     f" · {_bytes(row['bytes_billed'])} · p95 {_seconds(row['p95_ms'])}")
+
+    if report["top_prompts"]:
+        lines += ["", "*Prompts les plus coûteux*"]
+    for row in report["top_prompts"]:
+        user = f"<@{row['user'].upper()}>" if row.get("user") else "?"
+        prompt = (row.get("prompt") or "").replace("_", " ") or "(prompt inconnu)"
+        lines.append(f"• {row['day']} · {user} · _{prompt}_ · {row['jobs']} jobs · {_slot(row['slot_ms'])}"
+                     f" · {_bytes(row['bytes_billed'])} · max {_seconds(row['max_ms'])} (thread {row['thread']})")
+    return "\n".join(lines)
+
+
+def build_report(days: int = DEFAULT_DAYS, top: int = DEFAULT_TOP) -> str:
+    """Rapport prêt à poster, ou message d'erreur '❌ …'."""
+    try:
+        return format_report(fetch_report(days, top), days)
+    except Exception as e:
+        print(f"[BQ-Report] ❌ {e}")
+        return f"❌ Rapport BigQuery impossible : {str(e)[:300]}"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Coût / latence des jobs BigQuery du bot (labels)")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help=f"Fenêtre en jours (défaut: {DEFAULT_DAYS})")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help=f"Prompts par jour (défaut: {DEFAULT_TOP})")
+    parser.add_argument("--project", action="append", help="Projet(s) à agréger (défaut: BQ_REPORT_PROJECTS)")
+    args = parser.parse_args()
+
+    days = max(1, min(args.days, MAX_DAYS))
+    print(format_report(fetch_report(days, args.top, args.project), days))
+
+
+if __name__ == "__main__":
+    main()
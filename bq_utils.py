@@ -1,61 +1,27 @@
 import os
-import re
 from typing import List, Tuple
 from google.cloud import bigquery
+from bq_config import BQ_ALLOWED_DATASETS, BQ_TOOLS_MAX_BYTES_BILLED_GB, BQ_TOOLS_MAX_ROWS
+from bq_engine import ENGINE
 
 PROJECT = os.getenv("BQ_PROJECT")
 LOCATION = os.getenv("BQ_LOCATION", "EU")
-ALLOWED = set([s.strip() for s in os.getenv("BQ_ALLOWED_DATASETS", "").split(",") if s.strip()])
-
-_client = None
+ALLOWED = BQ_ALLOWED_DATASETS
 
 def get_client() -> bigquery.Client:
-    global _client
-    if _client is None:
-        _client = bigquery.Client(project=PROJECT, location=LOCATION)
-    return _client
-
-# sécurité simple : refuse les requêtes DDL/DML et datasets non autorisés
-_BLOCK_PATTERNS = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|TRUNCATE|CREATE|REPLACE)\b", re.IGNORECASE)
-
-def _check_safe(sql: str) -> None:
-    if _BLOCK_PATTERNS.search(sql):
-        raise ValueError("Requête refusée (DDL/DML détecté). Lecture seule uniquement.")
-    # datasets whitelist
-    found = re.findall(r"`?([a-zA-Z0-9\-_]+)\.([a-zA-Z0-9\-_]+)\.([a-zA-Z0-9\-_]+)`?", sql)
-    if ALLOWED and found:
-        for project, dataset, _table in found:
-            # autorise si dataset listé (peu importe le project) OU si project listé
-            if dataset not in ALLOWED and project not in ALLOWED:
-                raise ValueError(f"Dataset non autorisé: {project}.{dataset}")
+    # client partagé par (projet, location), cf. bq_engine.py
+    return ENGINE.client(PROJECT, LOCATION)
 
 def run_sql(sql: str, max_rows: int = 50) -> Tuple[List[str], List[List]]:
     """
-    Exécute la requête en lecture avec limites:
-      - max 1 Go scanné
-      - 60 s timeout
-      - renvoie jusqu'à max_rows lignes (par défaut 50)
+    Exécute la requête en lecture via le moteur partagé (cf. bq_engine.py) :
+      - lecture seule, datasets BQ_ALLOWED_DATASETS (ValueError sinon)
+      - max BQ_TOOLS_MAX_BYTES_BILLED_GB scannés (1 Go par défaut), dry run avant exécution
+      - 60 s timeout, cache partagé
+      - renvoie jusqu'à max_rows lignes (par défaut 50, plafonné à BQ_TOOLS_MAX_ROWS)
     """
-    sql = sql.strip().rstrip(";")
-    _check_safe(sql)
-
-    client = get_client()
-    job_config = bigquery.QueryJobConfig(
-        maximum_bytes_billed=1_000_000_000,  # 1GB safety
-        priority=bigquery.QueryPriority.INTERACTIVE,
-    )
-    # rajoute un LIMIT si aucun trouvé
-    if not re.search(r"\blimit\s+\d+\b", sql, re.IGNORECASE):
-        sql = f"{sql}\nLIMIT {max_rows}"
-
-    job = client.query(sql, job_config=job_config)
-    result = job.result(timeout=60)
-
-    fields = [schema_field.name for schema_field in result.schema]
-    rows = []
-    for i, row in enumerate(result):
-        if i >= max_rows:
-            break
-        rows.append([row.get(f) for f in fields])
-
-    return fields, rows
+    max_rows = max(1, min(int(max_rows), BQ_TOOLS_MAX_ROWS))
+    sql = ENGINE.prepare(sql, max_rows, ALLOWED, frontend="bq_utils")
+    result = ENGINE.run(get_client(), sql, max_rows, timeout=60, frontend="bq_utils",
+                        max_gb=BQ_TOOLS_MAX_BYTES_BILLED_GB)
+    return result.columns, [[row.get(column) for column in result.columns] for row in result.rows]
@@ -3,49 +3,67 @@
 
 import os
 import time
-from typing import List
-from anthropic import APIError
+from typing import List, Optional
+from anthropic import APIError, APIStatusError
 from config import (
     claude,
+    claude_scheduler,
+    http_pool_stats,
     ANTHROPIC_MODEL,
     ANTHROPIC_IN_PRICE,
     ANTHROPIC_OUT_PRICE,
-    MAX_TOOL_CHARS,
-    BOT_NAME
+    ANTHROPIC_FAST_MODEL,
+    ANTHROPIC_FAST_IN_PRICE,
+    ANTHROPIC_FAST_OUT_PRICE,
+    BOT_NAME,
+    CONTEXT_RETRIEVAL,
+    CONTEXT_TOP_K,
+    CONTEXT_MAX_CHARS
 )
+from context_index import select_context
+from model_router import route, timed_route, ROUTE_FAST, ROUTE_FULL
+from rate_limiter import QueueTimeout, current_user, current_priority, format_wait, PRIORITY_INTERACTIVE
 from thread_memory import (
+    estimate_tokens,
+    message_tokens,
     get_thread_history,
-    add_to_thread_history,
+    get_prompt_history,
+    add_turn,
+    tool_digest,
     clear_last_queries,
-    get_last_queries
+    get_last_queries,
+    get_last_user_prompt
 )
-from tools_definitions import TOOLS, execute_tool
+from tools_definitions import TOOLS
+from tool_executor import run_tool_calls
+from bq_jobs import JOB_MANAGER
+from http_pool import log_pool_stats
 
 
-def log_claude_usage(resp, *, label="CLAUDE"):
-    """Log l'utilisation et le coût d'un appel Claude."""
+def log_claude_usage(resp, *, label="CLAUDE", price_in=ANTHROPIC_IN_PRICE, price_out=ANTHROPIC_OUT_PRICE):
+    """Log l'utilisation, le coût et le taux de hit du prompt cache d'un appel Claude."""
     u = getattr(resp, "usage", None)
     if u is None:
         print(f"[{label}] usage: non fourni par l'API")
         return
 
-    in_tok  = getattr(u, "input_tokens", 0)
-    out_tok = getattr(u, "output_tokens", 0)
-    cache_create = getattr(u, "cache_creation_input_tokens", 0)
-    cache_read   = getattr(u, "cache_read_input_tokens", 0)
+    # input_tokens = tokens non cachés uniquement (après le dernier breakpoint)
+    in_tok  = getattr(u, "input_tokens", 0) or 0
+    out_tok = getattr(u, "output_tokens", 0) or 0
+    cache_create = getattr(u, "cache_creation_input_tokens", 0) or 0
+    cache_read   = getattr(u, "cache_read_input_tokens", 0) or 0
+    total_in = in_tok + cache_create + cache_read
 
-    cost_in  = (in_tok  / 1000.0) * ANTHROPIC_IN_PRICE
-    cost_out = (out_tok / 1000.0) * ANTHROPIC_OUT_PRICE
-
-    if cache_create or cache_read:
-        base_in       = (max(in_tok - cache_create - cache_read, 0) / 1000.0) * ANTHROPIC_IN_PRICE
-        cache_write_c = (cache_create / 1000.0) * ANTHROPIC_IN_PRICE * 1.25
-        cache_read_c  = (cache_read   / 1000.0) * ANTHROPIC_IN_PRICE * 0.10
-        cost_in = base_in + cache_write_c + cache_read_c
+    cost_in = ((in_tok / 1000.0) * price_in
+               + (cache_create / 1000.0) * price_in * 1.25
+               + (cache_read / 1000.0) * price_in * 0.10)
+    cost_out = (out_tok / 1000.0) * price_out
+    hit_ratio = cache_read / total_in if total_in else 0.0
 
     total = cost_in + cost_out
     print(f"[{label}] usage: in={in_tok} tok, out={out_tok} tok"
           + (f", cache_write={cache_create} tok, cache_read={cache_read} tok" if cache_create or cache_read else ""))
+    print(f"[{label}] cache: hit={hit_ratio:.0%} ({cache_read}/{total_in} tok d'entrée lus depuis le cache)")
     print(f"[{label}] cost: input≈${cost_in:.4f}, output≈${cost_out:.4f}, total≈${total:.4f}")
 
 
@@ -187,15 +205,14 @@ def get_system_prompt(context: str = "") -> str:
         "  → Réponds à la question avec insights\n"
         "\n"
         "✅ SI l'utilisateur demande explicitement une LISTE ('liste', 'export', 'j'aimerais avoir', 'télécharge', 'csv', 'excel') :\n"
-        "  → Exécute la requête normalement\n"
-        "  → Montre un APERÇU (5-10 premières lignes) dans Slack\n"
-        "  → Donne la REQUÊTE SQL COMPLÈTE formatée en bloc code\n"
-        "  → Explique : 'Pour obtenir toutes les X lignes, exécute cette requête dans BigQuery :'\n"
+        "  → Utilise export_bigquery (sans LIMIT) : le fichier complet (CSV gzip, ou Parquet si demandé) est envoyé dans le thread\n"
+        "  → Résume en 1-2 lignes (nombre de lignes, colonnes) ; ne recopie pas le listing\n"
+        "  → Ne demande jamais à l'utilisateur d'exécuter la requête lui-même\n"
         "\n"
         "✅ Exemples :\n"
         "  - 'Quel est le churn de septembre ?' → résumé + chiffres clés (pas de requête SQL)\n"
-        "  - 'j'aimerais avoir les churners de septembre' → aperçu 5 lignes + requête SQL complète\n"
-        "  - 'Liste des clients actifs' → aperçu + requête SQL complète\n"
+        "  - 'j'aimerais avoir les churners de septembre' → export_bigquery + résumé\n"
+        "  - 'Liste des clients actifs' → export_bigquery + résumé\n"
         "\n"
         "ROUTAGE TOOLS :\n"
         "- 'review'/'avis' → query_reviews (normalised-417010.reviews.reviews_by_user)\n"
@@ -206,8 +223,252 @@ def get_system_prompt(context: str = "") -> str:
     return base + ("\n\n" + context if context else "")
 
 
-def ask_claude(prompt: str, thread_ts: str, context: str = "", max_retries: int = 3) -> str:
-    """Envoie une requête à Claude et gère les outils."""
+# ---------------------------------------
+# Prompt caching (4 breakpoints max par requête)
+# ---------------------------------------
+# Ordre du préfixe caché : tools → system → messages. On pose un breakpoint sur :
+#   1. le dernier tool (cache tout le schéma TOOLS)
+#   2. le prompt système statique
+#   3. le contexte : les sections épinglées (CONTEXT_RETRIEVAL) ou le contexte complet
+#   4. le dernier message de la requête (le tour suivant de la boucle de tools relit ce préfixe)
+# Les sections retrouvées pour la question n'ont pas de breakpoint propre : elles sont
+# identiques pendant toute la boucle de tools et couvertes par le breakpoint n°4.
+# Les blocs sont construits une seule fois et jamais modifiés : les octets envoyés restent
+# identiques d'un appel à l'autre, condition pour que les préfixes matchent.
+EPHEMERAL = {"type": "ephemeral"}
+
+CACHED_TOOLS = [dict(tool) for tool in TOOLS]
+if CACHED_TOOLS:
+    CACHED_TOOLS[-1]["cache_control"] = EPHEMERAL
+
+_SYSTEM_BLOCK_CACHE = {}
+
+
+def _cached_block(text: str) -> dict:
+    """Bloc texte avec breakpoint, réutilisé tel quel tant que le texte ne change pas."""
+    block = _SYSTEM_BLOCK_CACHE.get(text)
+    if block is None:
+        if len(_SYSTEM_BLOCK_CACHE) > 8:
+            _SYSTEM_BLOCK_CACHE.clear()  # anciens contextes (reload_context)
+        block = _SYSTEM_BLOCK_CACHE[text] = {"type": "text", "text": text, "cache_control": EPHEMERAL}
+    return block
+
+
+def build_system_blocks(context: str = "", question: Optional[str] = None) -> list:
+    """
+    Blocs système : prompt statique + contexte, avec breakpoints de cache.
+    Avec une `question` (et CONTEXT_RETRIEVAL), seules les sections pertinentes du contexte
+    sont envoyées, en plus des règles épinglées.
+    """
+    system_blocks = [_cached_block(get_system_prompt())]
+    if not context:
+        return system_blocks
+
+    selection = select_context(question, CONTEXT_TOP_K, CONTEXT_MAX_CHARS) \
+        if question and CONTEXT_RETRIEVAL else None
+    if selection is None:
+        # Contexte complet (pas d'index disponible)
+        system_blocks.append(_cached_block(context))
+        return system_blocks
+
+    pinned, retrieved = selection
+    if pinned:
+        system_blocks.append(_cached_block(pinned))
+    if retrieved:
+        system_blocks.append({"type": "text", "text": "# CONTEXTE PERTINENT POUR CETTE QUESTION\n\n" + retrieved})
+    print(f"[Context] contexte envoyé : {len(pinned) + len(retrieved)} chars (sur {len(context)})")
+    return system_blocks
+
+
+def retrieval_query(prompt: str, thread_ts: str) -> str:
+    """Texte utilisé pour chercher le contexte : la question + la précédente du thread (suivis)."""
+    previous = get_last_user_prompt(thread_ts)
+    return f"{prompt}\n{previous}" if previous else prompt
+
+
+def _as_blocks(content) -> list:
+    """Contenu de message sous forme de liste de blocs (forme unique → octets stables)."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return list(content)
+
+
+def with_message_breakpoint(messages: list) -> list:
+    """
+    Copie de `messages` avec un breakpoint sur le dernier bloc du dernier message.
+    L'historique stocké n'est pas modifié (le breakpoint se déplace à chaque appel).
+    """
+    if not messages:
+        return messages
+    normalized = [{"role": m["role"], "content": _as_blocks(m["content"])} for m in messages]
+    tail = normalized[-1]["content"][-1]
+    if not isinstance(tail, dict):
+        tail = tail.model_dump(exclude_none=True)
+    normalized[-1]["content"][-1] = {**tail, "cache_control": EPHEMERAL}
+    return normalized
+
+
+def build_request(system_blocks: list, messages: list, max_tokens: int = 2048) -> dict:
+    """Requête Messages API avec les 4 breakpoints de cache."""
+    return dict(
+        model=ANTHROPIC_MODEL,
+        max_tokens=max_tokens,
+        system=system_blocks,
+        tools=CACHED_TOOLS,
+        messages=with_message_breakpoint(messages)
+    )
+
+
+def has_tool_use(content) -> bool:
+    """Vérifie s'il y a des tool_use dans le contenu d'une réponse."""
+    return any(block.type == "tool_use" for block in content)
+
+
+def extract_final_text(response) -> str:
+    """Concatène les blocs texte de la réponse finale."""
+    final_text_parts = []
+    for block in response.content:
+        if getattr(block, "type", "") == "text" and getattr(block, "text", "").strip():
+            final_text_parts.append(block.text.strip())
+
+    final_text = "\n".join(final_text_parts).strip()
+    return final_text or "🤔 Hmm, je n'ai pas de réponse claire."
+
+
+# ---------------------------------------
+# Route rapide (petit modèle, sans tools ni contexte)
+# ---------------------------------------
+FAST_SYSTEM_PROMPT = (
+    f"Tu t'appelles {BOT_NAME}, l'assistant data de l'équipe sur Slack. Réponds en français, "
+    "brièvement et chaleureusement. Tu n'as pas accès aux données dans ce mode : si on te pose "
+    "une question chiffrée, invite à la formuler précisément (ex : 'CA box de septembre en France')."
+)
+
+
+def build_fast_request(prompt: str, thread_ts: str) -> dict:
+    """Requête minimale pour la route rapide : 2 derniers tours + le message, pas de tools."""
+    history = get_prompt_history(thread_ts)[-4:]
+    return dict(
+        model=ANTHROPIC_FAST_MODEL,
+        max_tokens=400,
+        system=FAST_SYSTEM_PROMPT,
+        messages=history + [{"role": "user", "content": prompt}]
+    )
+
+
+def log_fast_usage(response):
+    log_claude_usage(response, label="CLAUDE-FAST",
+                     price_in=ANTHROPIC_FAST_IN_PRICE, price_out=ANTHROPIC_FAST_OUT_PRICE)
+
+
+# ---------------------------------------
+# Admission (cf. rate_limiter.py)
+# ---------------------------------------
+# Tentatives d'admission quand l'API répond 429/529 malgré le retry HTTP du SDK :
+# la tentative suivante repasse par la file (elle attend le retry-after, sans rafale).
+ADMISSION_ATTEMPTS = 3
+THROTTLED_STATUS = (429, 529)
+
+
+def estimate_request_tokens(request: dict) -> int:
+    """
+    Tokens d'entrée décomptés de l'ITPM (estimation, corrigée par l'usage réel) :
+    les blocs système avec breakpoint sont supposés déjà en cache.
+    """
+    system = request.get("system") or []
+    if isinstance(system, str):
+        total = estimate_tokens(system)
+    else:
+        total = sum(estimate_tokens(b.get("text", "")) for b in system if "cache_control" not in b)
+    return total + sum(message_tokens(m) for m in request.get("messages", []))
+
+
+def busy_message(wait_s: float) -> str:
+    """Message affiché quand l'API est saturée (avec l'attente estimée)."""
+    return (f"⏳ Beaucoup de demandes en ce moment, je n'ai pas pu te répondre à temps. "
+            f"Réessaie dans {format_wait(wait_s)}.")
+
+
+def _send(request: dict, stream=None):
+    if stream is None:
+        return claude.messages.create(**request)
+
+    stream.on_turn_start()
+    with claude.messages.stream(**request) as events:
+        for event in events:
+            if event.type == "text":
+                stream.on_text(event.text)
+        return events.get_final_message()
+
+
+def _call_claude(request: dict, stream=None):
+    """
+    Appelle l'API Messages après admission par l'ordonnanceur.
+    Sans `stream` : appel bloquant classique.
+    Avec `stream` (cf. slack_streaming.StreamingMessage) : Messages streaming API, le texte
+    et les tools annoncés sont relayés au fil de l'eau, puis on retourne le message final.
+    Lève QueueTimeout si l'attente en file dépasse ANTHROPIC_QUEUE_TIMEOUT_S.
+    """
+    est_in, est_out = estimate_request_tokens(request), request.get("max_tokens", 1024)
+    for attempt in range(ADMISSION_ATTEMPTS):
+        ticket = claude_scheduler.acquire(est_in, est_out,
+                                          on_wait=stream.on_queue if stream else None)
+        response = None
+        try:
+            response = _send(request, stream)
+            return response
+        except APIStatusError as e:
+            if e.status_code not in THROTTLED_STATUS or attempt == ADMISSION_ATTEMPTS - 1:
+                raise
+            claude_scheduler.observe_headers(e.status_code, e.response.headers)
+            print(f"⚠️ API limitée ({e.status_code}), nouvelle admission {attempt + 2}/{ADMISSION_ATTEMPTS}…")
+        finally:
+            claude_scheduler.release(ticket, getattr(response, "usage", None))
+
+
+def ask_claude(prompt: str, thread_ts: str, context: str = "", max_retries: int = 3,
+               stream=None, user: Optional[str] = None) -> str:
+    """
+    Envoie une requête à Claude et gère les outils.
+    Si `stream` est fourni, la réponse est streamée vers Slack pendant la boucle de tools.
+    Les messages triviaux sont routés vers le petit modèle (cf. model_router.py).
+    `user` (id Slack) sert à l'équité de la file d'attente des appels Claude.
+    Un nouveau message dans le même thread interrompt la requête en cours (cf. bq_jobs).
+    """
+    current_user.set(user or "anonymous")
+    current_priority.set(PRIORITY_INTERACTIVE)
+    run = JOB_MANAGER.begin(thread_ts, stream, user, prompt)
+    try:
+        route_name, _ = route(prompt, has_history=bool(get_thread_history(thread_ts)))
+        if route_name == ROUTE_FAST:
+            with timed_route(ROUTE_FAST):
+                answer = _ask_claude_fast(prompt, thread_ts, stream)
+            if answer is not None:
+                return answer
+        with timed_route(ROUTE_FULL):
+            return _ask_claude_full(prompt, thread_ts, context, max_retries, stream)
+    finally:
+        JOB_MANAGER.end(run)
+
+
+def _ask_claude_fast(prompt: str, thread_ts: str, stream=None) -> Optional[str]:
+    """Réponse du petit modèle, ou None en cas d'échec (on retombe sur la route complète)."""
+    try:
+        response = _call_claude(build_fast_request(prompt, thread_ts), stream)
+        log_fast_usage(response)
+        final_text = extract_final_text(response)
+        add_turn(thread_ts, prompt, final_text)
+        return final_text
+    except QueueTimeout as e:
+        return busy_message(e.estimated_wait)
+    except Exception as e:
+        print(f"[Router] ⚠️ Route rapide en échec, repli sur le modèle complet : {e}")
+        return None
+
+
+def _ask_claude_full(prompt: str, thread_ts: str, context: str = "", max_retries: int = 3,
+                     stream=None) -> str:
+    """Route complète : modèle principal, prompt système, contexte et tools."""
     for attempt in range(max_retries):
         try:
             print(f"\n🟦 CLAUDE REQUEST START (tentative {attempt + 1}/{max_retries})")
@@ -215,88 +476,64 @@ def ask_claude(prompt: str, thread_ts: str, context: str = "", max_retries: int
             print(f"   Prompt length: {len(prompt)} chars")
             print(f"   Context length: {len(context)} chars")
 
-            history = get_thread_history(thread_ts)
+            history = get_prompt_history(thread_ts)
             messages = history.copy()
             messages.append({"role": "user", "content": prompt})
             clear_last_queries(thread_ts)
 
-            # Prompt Caching : contexte lourd en bloc caché (éphemeral)
-            system_blocks = [
-                {"type": "text", "text": get_system_prompt(context).split("\n\n# DOCUMENTATION")[0]},
-            ]
-            # Ajoute CONTEXT caché seulement s'il existe
-            if context:
-                system_blocks.append({"type": "text", "text": context, "cache_control": {"type": "ephemeral"}})
-
-            print(f"🟦 Appel API Anthropic (model={ANTHROPIC_MODEL}, {len(messages)} messages)...")
-            response = claude.messages.create(
-                model=ANTHROPIC_MODEL,
-                max_tokens=2048,
-                system=system_blocks,
-                tools=TOOLS,
-                messages=messages
-            )
+            system_blocks = build_system_blocks(context, retrieval_query(prompt, thread_ts))
+
+            print(f"🟦 Appel API Anthropic (model={ANTHROPIC_MODEL}, {len(messages)} messages"
+                  f"{', streaming' if stream else ''})...")
+            response = _call_claude(build_request(system_blocks, messages), stream)
             print(f"🟦 Réponse API reçue (stop_reason={response.stop_reason})")
             log_claude_usage(response)
 
-            # Fonction helper pour vérifier s'il y a des tool_use dans le contenu
-            def has_tool_use(content):
-                return any(block.type == "tool_use" for block in content)
-
             iteration = 0
+            digests = []
             # Exécuter les tools tant qu'il y en a (peu importe le stop_reason)
             while has_tool_use(response.content) and iteration < 10:
                 iteration += 1
                 messages.append({"role": "assistant", "content": response.content})
 
-                tool_results = []
-                for block in response.content:
-                    if block.type == "tool_use":
-                        print(f"[🔧] {block.name}")
-                        result = execute_tool(block.name, block.input, thread_ts)
-                        # Tronquage défensif pour éviter d'inonder le modèle
-                        if isinstance(result, str) and len(result) > MAX_TOOL_CHARS:
-                            result = result[:MAX_TOOL_CHARS] + " …\n(Contenu tronqué)"
-                        tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": result})
+                # Tools du tour exécutés en parallèle, tool_result dans l'ordre d'origine
+                tool_results = run_tool_calls(
+                    response.content,
+                    thread_ts,
+                    on_tool=stream.on_tool if stream else None
+                )
 
+                tool_blocks = [b for b in response.content if b.type == "tool_use"]
+                digests.extend(tool_digest(b.name, b.input, r["content"]) for b, r in zip(tool_blocks, tool_results))
                 messages.append({"role": "user", "content": tool_results})
 
-                response = claude.messages.create(
-                    model=ANTHROPIC_MODEL,
-                    max_tokens=2048,
-                    system=system_blocks,
-                    tools=TOOLS,
-                    messages=messages
-                )
-                log_claude_usage(response)
+                # Thread arrêté, délai dépassé ou message plus récent : on abandonne la boucle
+                stop = JOB_MANAGER.interrupted(JOB_MANAGER.current())
+                if stop:
+                    print(f"[BQ-Jobs] {stop} (après {iteration} tour(s) de tools)")
+                    return stop
 
-            final_text_parts = []
-            for block in response.content:
-                if getattr(block, "type", "") == "text" and getattr(block, "text", "").strip():
-                    final_text_parts.append(block.text.strip())
+                response = _call_claude(build_request(system_blocks, messages), stream)
+                log_claude_usage(response)
 
-            final_text = "\n".join(final_text_parts).strip()
-            if not final_text:
-                final_text = "🤔 Hmm, je n'ai pas de réponse claire."
+            final_text = extract_final_text(response)
 
-            add_to_thread_history(thread_ts, "user", prompt)
-            add_to_thread_history(thread_ts, "assistant", final_text)
+            add_turn(thread_ts, prompt, final_text, digests)
+            log_pool_stats(http_pool_stats)
             return final_text
 
+        except QueueTimeout as e:
+            print(f"⏳ File d'attente Claude trop longue (~{e.estimated_wait:.0f}s restantes)")
+            return busy_message(e.estimated_wait)
         except APIError as e:
             msg = str(e)
-            if "529" in msg or "overloaded" in msg.lower():
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) * 2
-                    print(f"⚠️ API surchargée, retry {attempt + 1}/{max_retries} dans {wait_time}s…")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    return "⚠️ L'API est temporairement surchargée. Réessaie dans quelques minutes."
+            # 429/529 : déjà réadmis via la file (retry-after respecté) dans _call_claude
+            if getattr(e, "status_code", None) in THROTTLED_STATUS or "overloaded" in msg.lower():
+                return busy_message(claude_scheduler.estimate_wait())
             elif "timeout" in msg.lower():
                 return "⏱️ Désolé, ma requête a pris trop de temps. Peux-tu reformuler ou simplifier ?"
             elif "rate" in msg.lower() or "limit" in msg.lower():
-                return "🚦 Limite d'API atteinte. Réessaie dans quelques secondes."
+                return busy_message(claude_scheduler.estimate_wait())
             else:
                 return f"⚠️ Erreur technique : {msg[:200]}"
         except (BrokenPipeError, ConnectionError, OSError) as e:
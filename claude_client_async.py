@@ -0,0 +1,183 @@
+# claude_client_async.py
+"""Interface asyncio avec Claude (AsyncAnthropic) pour le mode ASYNC_MODE=true."""
+
+import asyncio
+from typing import Optional
+from anthropic import APIError, APIStatusError
+from config import (
+    get_async_claude,
+    claude_scheduler,
+    ANTHROPIC_MAX_CONCURRENCY
+)
+from rate_limiter import QueueTimeout, current_user, current_priority, PRIORITY_INTERACTIVE
+from thread_memory import (
+    get_thread_history,
+    get_prompt_history,
+    add_turn,
+    tool_digest,
+    clear_last_queries
+)
+from tool_executor import run_tool_calls_async
+from bq_jobs import JOB_MANAGER
+from model_router import route, timed_route, ROUTE_FAST, ROUTE_FULL
+from claude_client import (
+    build_system_blocks,
+    build_request,
+    build_fast_request,
+    log_fast_usage,
+    retrieval_query,
+    extract_final_text,
+    has_tool_use,
+    log_claude_usage,
+    estimate_request_tokens,
+    busy_message,
+    ADMISSION_ATTEMPTS,
+    THROTTLED_STATUS
+)
+
+_claude_semaphore = None
+
+
+def _semaphore() -> asyncio.Semaphore:
+    """Limite le nombre d'appels Claude simultanés (créé dans la boucle courante)."""
+    global _claude_semaphore
+    if _claude_semaphore is None:
+        _claude_semaphore = asyncio.Semaphore(ANTHROPIC_MAX_CONCURRENCY)
+    return _claude_semaphore
+
+
+async def _send_async(request: dict, stream=None):
+    claude = get_async_claude()
+    async with _semaphore():
+        if stream is None:
+            return await claude.messages.create(**request)
+
+        stream.on_turn_start()
+        async with claude.messages.stream(**request) as events:
+            async for event in events:
+                if event.type == "text":
+                    await stream.on_text(event.text)
+            return await events.get_final_message()
+
+
+async def _call_claude_async(request: dict, stream=None):
+    """Appel API Messages asynchrone après admission (streamé vers Slack si `stream` est fourni)."""
+    est_in, est_out = estimate_request_tokens(request), request.get("max_tokens", 1024)
+    for attempt in range(ADMISSION_ATTEMPTS):
+        ticket = await claude_scheduler.acquire_async(est_in, est_out,
+                                                      on_wait=stream.on_queue if stream else None)
+        response = None
+        try:
+            response = await _send_async(request, stream)
+            return response
+        except APIStatusError as e:
+            if e.status_code not in THROTTLED_STATUS or attempt == ADMISSION_ATTEMPTS - 1:
+                raise
+            claude_scheduler.observe_headers(e.status_code, e.response.headers)
+            print(f"⚠️ API limitée ({e.status_code}), nouvelle admission {attempt + 2}/{ADMISSION_ATTEMPTS}…")
+        finally:
+            claude_scheduler.release(ticket, getattr(response, "usage", None))
+
+
+async def ask_claude_async(prompt: str, thread_ts: str, context: str = "", max_retries: int = 3,
+                           stream=None, user: Optional[str] = None) -> str:
+    """Équivalent asyncio de claude_client.ask_claude (même routage, prompts, tools et mémoire)."""
+    current_user.set(user or "anonymous")
+    current_priority.set(PRIORITY_INTERACTIVE)
+    run = JOB_MANAGER.begin(thread_ts, stream, user, prompt)
+    try:
+        route_name, _ = await asyncio.to_thread(route, prompt, bool(get_thread_history(thread_ts)))
+        if route_name == ROUTE_FAST:
+            with timed_route(ROUTE_FAST):
+                answer = await _ask_claude_fast_async(prompt, thread_ts, stream)
+            if answer is not None:
+                return answer
+        with timed_route(ROUTE_FULL):
+            return await _ask_claude_full_async(prompt, thread_ts, context, max_retries, stream)
+    finally:
+        JOB_MANAGER.end(run)
+
+
+async def _ask_claude_fast_async(prompt: str, thread_ts: str, stream=None) -> Optional[str]:
+    try:
+        response = await _call_claude_async(build_fast_request(prompt, thread_ts), stream)
+        log_fast_usage(response)
+        final_text = extract_final_text(response)
+        add_turn(thread_ts, prompt, final_text)
+        return final_text
+    except QueueTimeout as e:
+        return busy_message(e.estimated_wait)
+    except Exception as e:
+        print(f"[Router] ⚠️ Route rapide en échec, repli sur le modèle complet : {e}")
+        return None
+
+
+async def _ask_claude_full_async(prompt: str, thread_ts: str, context: str = "", max_retries: int = 3,
+                                 stream=None) -> str:
+    for attempt in range(max_retries):
+        try:
+            print(f"\n🟦 CLAUDE REQUEST START async (tentative {attempt + 1}/{max_retries})")
+            print(f"   Thread: {thread_ts}")
+
+            history = get_prompt_history(thread_ts)
+            messages = history.copy()
+            messages.append({"role": "user", "content": prompt})
+            clear_last_queries(thread_ts)
+
+            system_blocks = build_system_blocks(context, retrieval_query(prompt, thread_ts))
+
+            response = await _call_claude_async(build_request(system_blocks, messages), stream)
+            log_claude_usage(response)
+
+            iteration = 0
+            digests = []
+            while has_tool_use(response.content) and iteration < 10:
+                iteration += 1
+                messages.append({"role": "assistant", "content": response.content})
+
+                tool_results = await run_tool_calls_async(
+                    response.content,
+                    thread_ts,
+                    on_tool=stream.on_tool if stream else None
+                )
+
+                tool_blocks = [b for b in response.content if b.type == "tool_use"]
+                digests.extend(tool_digest(b.name, b.input, r["content"]) for b, r in zip(tool_blocks, tool_results))
+                messages.append({"role": "user", "content": tool_results})
+
+                stop = JOB_MANAGER.interrupted(JOB_MANAGER.current())
+                if stop:
+                    print(f"[BQ-Jobs] {stop} (après {iteration} tour(s) de tools)")
+                    return stop
+
+                response = await _call_claude_async(build_request(system_blocks, messages), stream)
+                log_claude_usage(response)
+
+            final_text = extract_final_text(response)
+            add_turn(thread_ts, prompt, final_text, digests)
+            return final_text
+
+        except QueueTimeout as e:
+            print(f"⏳ File d'attente Claude trop longue (~{e.estimated_wait:.0f}s restantes)")
+            return busy_message(e.estimated_wait)
+        except APIError as e:
+            msg = str(e)
+            # 429/529 : déjà réadmis via la file (retry-after respecté) dans _call_claude_async
+            if getattr(e, "status_code", None) in THROTTLED_STATUS or "overloaded" in msg.lower():
+                return busy_message(claude_scheduler.estimate_wait())
+            elif "timeout" in msg.lower():
+                return "⏱️ Désolé, ma requête a pris trop de temps. Peux-tu reformuler ou simplifier ?"
+            elif "rate" in msg.lower() or "limit" in msg.lower():
+                return busy_message(claude_scheduler.estimate_wait())
+            return f"⚠️ Erreur technique : {msg[:200]}"
+        except (BrokenPipeError, ConnectionError, OSError) as e:
+            if attempt < max_retries - 1:
+                wait_time = (2 ** attempt) * 2
+                print(f"⚠️ Erreur réseau ({type(e).__name__}), retry {attempt + 1}/{max_retries} dans {wait_time}s…")
+                await asyncio.sleep(wait_time)
+                continue
+            return f"⚠️ Problème de connexion réseau ({type(e).__name__}). Vérifie ta connexion et réessaie."
+        except Exception as e:
+            return f"⚠️ Erreur inattendue : {str(e)[:200]}"
+
+    return "⚠️ Impossible de joindre le modèle après plusieurs tentatives."
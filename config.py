@@ -7,9 +7,10 @@ from pathlib import Path
 from dotenv import load_dotenv
 from slack_bolt import App
 from anthropic import Anthropic
-import httpx
-from google.cloud import bigquery
 from notion_client import Client as NotionClient
+from http_pool import PoolStats, build_keepalive_client
+from rate_limiter import ClaudeScheduler
+from bq_engine import ENGINE
 
 # ---------------------------------------
 # STDOUT en flush (logs visibles en direct)
@@ -31,24 +32,116 @@ ANTHROPIC_MODEL     = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929")
 ANTHROPIC_IN_PRICE  = float(os.getenv("ANTHROPIC_PRICE_IN",  "0.003"))   # $ / 1k tokens (input)
 ANTHROPIC_OUT_PRICE = float(os.getenv("ANTHROPIC_PRICE_OUT", "0.015"))   # $ / 1k tokens (output)
 
+# ---------- Routage vers un petit modèle rapide (cf. model_router.py) ----------
+ANTHROPIC_FAST_MODEL     = os.getenv("ANTHROPIC_FAST_MODEL", "claude-haiku-4-5")
+ANTHROPIC_FAST_IN_PRICE  = float(os.getenv("ANTHROPIC_FAST_PRICE_IN",  "0.001"))   # $ / 1k tokens
+ANTHROPIC_FAST_OUT_PRICE = float(os.getenv("ANTHROPIC_FAST_PRICE_OUT", "0.005"))   # $ / 1k tokens
+MODEL_ROUTER_ENABLED     = os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true"
+MODEL_ROUTER_USE_LLM     = os.getenv("MODEL_ROUTER_USE_LLM", "false").lower() == "true"  # arbitre si incertain
+
 MAX_ROWS        = int(os.getenv("MAX_ROWS_TO_RETURN", "50"))      # seuil listing
 MAX_TOOL_CHARS  = int(os.getenv("MAX_TOOL_CHARS", "2000"))        # seuil chars tool_result renvoyé au LLM
-TOOL_TIMEOUT_S  = int(os.getenv("TOOL_TIMEOUT_S", "120"))
 HISTORY_LIMIT   = int(os.getenv("HISTORY_LIMIT", "20"))           # limite historique conversation
 
+# ---------- BigQuery : timeout, cache, garde-fou coût, routage (définis dans bq_config.py, partagé hors bot) ----------
+from bq_config import (
+    TOOL_TIMEOUT_S,
+    BQ_CACHE_ENABLED,
+    BQ_CACHE_TTL_S,
+    BQ_CACHE_MAX_MB,
+    BQ_CACHE_METADATA_TTL_S,
+    BQ_SINGLE_FLIGHT_ENABLED,
+    BQ_DRY_RUN_ENABLED,
+    BQ_GATE_MAX_GB,
+    BQ_MAX_BYTES_BILLED_GB,
+    BQ_PRICE_PER_TIB,
+    BQ_DATASET_PROJECTS,
+    BQ_BILLING_PROJECTS
+)
+
+# ---------- Catalogue des schémas (cf. schema_catalog.py) ----------
+SCHEMA_CATALOG_ENABLED      = os.getenv("SCHEMA_CATALOG_ENABLED", "true").lower() == "true"
+# Datasets préchargés ("dataset" dans les deux projets ou "project.dataset") ; vide → tous
+SCHEMA_CATALOG_DATASETS     = [s.strip() for s in os.getenv("SCHEMA_CATALOG_DATASETS",
+                                                            os.getenv("BQ_ALLOWED_DATASETS", "")).split(",") if s.strip()]
+SCHEMA_CATALOG_PATH         = os.getenv("SCHEMA_CATALOG_PATH", str(Path(__file__).with_name("schema_catalog.json")))
+SCHEMA_CATALOG_REFRESH_MIN  = float(os.getenv("SCHEMA_CATALOG_REFRESH_MIN", "360"))  # rafraîchissement de fond
+SCHEMA_CATALOG_MISS_TTL_MIN = float(os.getenv("SCHEMA_CATALOG_MISS_TTL_MIN", "10"))   # table introuvable : pas de relecture avant
+SCHEMA_CATALOG_SAVE_DELAY_S = float(os.getenv("SCHEMA_CATALOG_SAVE_DELAY_S", "30"))   # écritures du fichier regroupées
+
+# ---------- Snapshot local des agrégats chauds de sales.box_sales (défini dans bq_config.py, cf. analytics_snapshot.py) ----------
+from bq_config import (
+    ANALYTICS_SNAPSHOT_ENABLED,
+    ANALYTICS_SNAPSHOT_PATH,
+    ANALYTICS_SNAPSHOT_HISTORY_DAYS,
+    ANALYTICS_SNAPSHOT_LOOKBACK_DAYS,
+    ANALYTICS_SNAPSHOT_REFRESH_MIN,
+    ANALYTICS_SNAPSHOT_MAX_AGE_MIN
+)
+
+# ---------- Conseiller partitionnement / clustering (défini dans bq_config.py, cf. query_advisor.py) ----------
+from bq_config import QUERY_ADVISOR_ENABLED, QUERY_ADVISOR_WINDOW_DAYS, QUERY_ADVISOR_LOG_PATH
+
+# ---------- Exports de résultats complets en fichier Slack (cf. export_tools.py) ----------
+EXPORT_MAX_ROWS   = int(os.getenv("EXPORT_MAX_ROWS", "1000000"))   # lignes max d'un export
+EXPORT_MAX_MB     = float(os.getenv("EXPORT_MAX_MB", "200"))       # taille max du fichier (compressé)
+EXPORT_PROGRESS_S = float(os.getenv("EXPORT_PROGRESS_S", "5"))     # fréquence des messages de progression
+EXPORT_TIMEOUT_S  = int(os.getenv("EXPORT_TIMEOUT_S", "600"))      # durée max du job + de la lecture
+
+# ---------- Mémoire des threads (budget de tokens + résumé glissant) ----------
+THREAD_TOKEN_BUDGET       = int(os.getenv("THREAD_TOKEN_BUDGET", "8000"))        # plafond dur par thread
+MEMORY_SUMMARY_MODEL      = os.getenv("MEMORY_SUMMARY_MODEL", ANTHROPIC_FAST_MODEL)  # modèle du résumé
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "600"))
+MEMORY_DIGEST_MAX_CHARS   = int(os.getenv("MEMORY_DIGEST_MAX_CHARS", "1500"))    # digests tools par tour
+
+# ---------- Contexte : index de recherche par sections (cf. context_index.py) ----------
+CONTEXT_RETRIEVAL       = os.getenv("CONTEXT_RETRIEVAL", "true").lower() == "true"
+CONTEXT_TOP_K           = int(os.getenv("CONTEXT_TOP_K", "8"))
+CONTEXT_MAX_CHARS       = int(os.getenv("CONTEXT_MAX_CHARS", "12000"))   # sections retrouvées par question
+CONTEXT_PINNED_SECTIONS = [s.strip() for s in os.getenv(
+    "CONTEXT_PINNED_SECTIONS",
+    "Équipe,RÈGLES CRITIQUES,GESTION DES DATES,Checklist avant chaque requête,Notes Importantes"
+).split(",") if s.strip()]
+
+# ---------- Streaming des réponses dans Slack ----------
+STREAMING_ENABLED        = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+STREAM_UPDATE_INTERVAL_S = float(os.getenv("STREAM_UPDATE_INTERVAL_S", "1.0"))  # throttle chat_update
+
 # ---------- Slack / Anthropic ----------
 app = App(token=os.environ["SLACK_BOT_TOKEN"], process_before_response=False)
 
-# Configuration HTTP client avec connection pooling désactivé
-# pour éviter les broken pipe sur connexions réutilisées stale
-http_client = httpx.Client(
+# Configuration HTTP client keep-alive avec health-check (cf. http_pool.py) :
+# les connexions inactives sont retirées avant le timeout d'inactivité du proxy,
+# et une requête tombée sur un socket stale est rejouée une fois sur une connexion neuve.
+# ANTHROPIC_KEEPALIVE=false → ancien comportement (une connexion neuve par appel), pour comparer.
+ANTHROPIC_KEEPALIVE          = os.getenv("ANTHROPIC_KEEPALIVE", "true").lower() == "true"
+ANTHROPIC_KEEPALIVE_EXPIRY_S = float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY_S", "20"))  # < idle timeout proxy
+ANTHROPIC_MAX_CONNECTIONS    = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "10"))
+
+# Budgets de l'API Anthropic (cf. rate_limiter.py) : admission des appels Claude par token
+# buckets, file d'attente avec priorité (interactif > arrière-plan) et équité par utilisateur.
+# À aligner sur le tier de l'organisation ; les en-têtes anthropic-ratelimit-* recalent les buckets.
+ANTHROPIC_RPM             = int(os.getenv("ANTHROPIC_RPM", "50"))
+ANTHROPIC_ITPM            = int(os.getenv("ANTHROPIC_ITPM", "30000"))   # tokens d'entrée / min (hors cache)
+ANTHROPIC_OTPM            = int(os.getenv("ANTHROPIC_OTPM", "8000"))    # tokens de sortie / min
+ANTHROPIC_QUEUE_TIMEOUT_S = float(os.getenv("ANTHROPIC_QUEUE_TIMEOUT_S", "120"))  # attente max en file
+
+claude_scheduler = ClaudeScheduler(
+    rpm=ANTHROPIC_RPM,
+    itpm=ANTHROPIC_ITPM,
+    otpm=ANTHROPIC_OTPM,
+    queue_timeout=ANTHROPIC_QUEUE_TIMEOUT_S,
+)
+
+http_pool_stats = PoolStats()
+http_client = build_keepalive_client(
+    os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com"),
     timeout=120.0,
-    limits=httpx.Limits(
-        max_connections=5,        # Max 5 connexions simultanées
-        max_keepalive_connections=0,  # ❗ Désactive keep-alive → force nouvelle connexion
-        keepalive_expiry=0.0      # Expire immédiatement les connexions
-    ),
-    follow_redirects=True
+    max_connections=ANTHROPIC_MAX_CONNECTIONS,
+    max_keepalive=ANTHROPIC_MAX_CONNECTIONS if ANTHROPIC_KEEPALIVE else 0,
+    keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY_S if ANTHROPIC_KEEPALIVE else 0.0,
+    stats=http_pool_stats,
+    event_hooks=claude_scheduler.http_hooks(),  # retry-after / en-têtes de rate limit
 )
 
 # Configuration du client Anthropic avec HTTP client custom
@@ -57,18 +150,55 @@ claude = Anthropic(
     api_key=os.environ["ANTHROPIC_API_KEY"],
     timeout=120.0,  # Timeout global de 120 secondes
     max_retries=2,  # Retry automatique au niveau HTTP (en plus du retry applicatif)
-    http_client=http_client  # ❗ Client HTTP custom sans keep-alive
+    http_client=http_client  # ❗ Client HTTP keep-alive health-checké
 )
 
+# ---------- Mode asyncio (AsyncApp + AsyncAnthropic, cf. async_app.py) ----------
+ASYNC_MODE                = os.getenv("ASYNC_MODE", "false").lower() == "true"
+ASYNC_MAX_CONVERSATIONS   = int(os.getenv("ASYNC_MAX_CONVERSATIONS", "200"))  # conversations en vol
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "20"))  # appels Claude simultanés
+
+_claude_async = None
+
+
+def get_async_claude():
+    """Client AsyncAnthropic (créé à la demande, dans la boucle asyncio qui l'utilise)."""
+    global _claude_async
+    if _claude_async is None:
+        from anthropic import AsyncAnthropic
+        import httpx
+        from http_pool import proxy_for
+
+        base_url = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+        _claude_async = AsyncAnthropic(
+            api_key=os.environ["ANTHROPIC_API_KEY"],
+            timeout=120.0,
+            max_retries=2,
+            http_client=httpx.AsyncClient(
+                proxy=proxy_for(base_url),
+                trust_env=False,
+                timeout=120.0,
+                follow_redirects=True,
+                event_hooks=claude_scheduler.async_http_hooks(),
+                limits=httpx.Limits(
+                    max_connections=ANTHROPIC_MAX_CONCURRENCY,
+                    max_keepalive_connections=ANTHROPIC_MAX_CONCURRENCY if ANTHROPIC_KEEPALIVE else 0,
+                    keepalive_expiry=ANTHROPIC_KEEPALIVE_EXPIRY_S if ANTHROPIC_KEEPALIVE else 0.0,
+                ),
+            ),
+        )
+    return _claude_async
+
 # ---------- BigQuery ----------
 bq_client = None
 bq_client_normalized = None  # second projet
 
 try:
+    # Clients partagés avec les autres fronts du moteur (cf. bq_engine.py)
     if os.getenv("BIGQUERY_PROJECT_ID"):
-        bq_client = bigquery.Client(project=os.getenv("BIGQUERY_PROJECT_ID"))
+        bq_client = ENGINE.client(os.getenv("BIGQUERY_PROJECT_ID"), pinned=True)
     if os.getenv("BIGQUERY_PROJECT_ID_2"):
-        bq_client_normalized = bigquery.Client(project=os.getenv("BIGQUERY_PROJECT_ID_2"))
+        bq_client_normalized = ENGINE.client(os.getenv("BIGQUERY_PROJECT_ID_2"), pinned=True)
 except Exception as e:
     print(f"⚠️ BigQuery init error: {e}")
     bq_client = bq_client or None
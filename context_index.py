@@ -0,0 +1,190 @@
+# context_index.py
+"""
+Index de recherche local (BM25, pur Python) sur les sections du contexte.
+
+Au lieu d'envoyer tout le contexte (context.md, requêtes Periscope, docs DBT, Notion) à chaque
+question, on découpe les sources en sections Markdown et on ne garde que les top-k sections
+pertinentes. Les règles toujours actives (CONTEXT_PINNED_SECTIONS) restent épinglées.
+L'index est reconstruit par context_loader.load_context (démarrage et reload_context).
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Sections plus longues que ça → découpées par paragraphes
+MAX_SECTION_CHARS = 2500
+
+_STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "de", "du", "d", "l", "et", "ou", "a", "au", "aux",
+    "en", "dans", "par", "pour", "sur", "avec", "sans", "ce", "ces", "cet", "cette", "qui", "que",
+    "quoi", "quel", "quelle", "quels", "quelles", "est", "sont", "etre", "pas", "ne", "plus",
+    "se", "sa", "son", "ses", "il", "elle", "on", "nous", "vous", "je", "tu", "me", "moi", "mon",
+    "ma", "mes", "y", "the", "of", "and", "to", "in", "is", "for", "on", "by",
+}
+
+_HEADING_RE = re.compile(r"^(#{1,3})\s+(.*)$")
+
+
+class Section:
+    """Section de contexte indexée (titre hiérarchique + contenu)."""
+
+    def __init__(self, title: str, text: str, source: str):
+        self.title = title
+        self.text = text
+        self.source = source
+        self.pinned = False
+        self.tokens: List[str] = []
+
+    def render(self) -> str:
+        return self.text.strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalisés : minuscules, sans accents, identifiants découpés (box_sales → box, sales)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = []
+    for word in re.findall(r"[a-z0-9_.]+", text):
+        parts = [p for p in re.split(r"[._]", word) if p]
+        if len(parts) > 1:
+            tokens.append(word.strip("."))
+        tokens.extend(p for p in parts if p not in _STOPWORDS and len(p) > 1)
+    return tokens
+
+
+def split_sections(markdown: str, source: str) -> List[Section]:
+    """Découpe un document Markdown en sections (titres #, ##, ###), puis par paragraphes si trop long."""
+    sections = []
+    path: List[str] = []
+    current: List[str] = []
+    title = source
+
+    def flush():
+        body = "\n".join(current).strip()
+        if body:
+            sections.extend(_chunk(title, body, source))
+
+    for line in markdown.splitlines():
+        match = _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = path[:level - 1] + [match.group(2).strip()]
+            title = " › ".join(path)
+            current = [line]
+        else:
+            current.append(line)
+    flush()
+    return sections
+
+
+def _chunk(title: str, body: str, source: str) -> List[Section]:
+    if len(body) <= MAX_SECTION_CHARS:
+        return [Section(title=title, text=body, source=source)]
+    chunks, buf = [], ""
+    for paragraph in re.split(r"\n\s*\n", body):
+        if buf and len(buf) + len(paragraph) > MAX_SECTION_CHARS:
+            chunks.append(buf)
+            buf = ""
+        buf = (buf + "\n\n" + paragraph) if buf else paragraph
+    if buf:
+        chunks.append(buf)
+    return [
+        Section(title=title, text=chunk if i == 0 else f"({title}, suite)\n{chunk}", source=source)
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+class ContextIndex:
+    """Index BM25 (k1=1.5, b=0.75) sur les sections non épinglées."""
+
+    def __init__(self, sections: List[Section], pinned_patterns: Optional[List[str]] = None,
+                 k1: float = 1.5, b: float = 0.75):
+        patterns = [p.lower() for p in (pinned_patterns or []) if p]
+        for section in sections:
+            section.pinned = any(p in section.title.lower() for p in patterns)
+            section.tokens = tokenize(section.title + "\n" + section.text)
+
+        self.sections = sections
+        self.pinned = [s for s in sections if s.pinned]
+        self.candidates = [s for s in sections if not s.pinned]
+        self.k1 = k1
+        self.b = b
+
+        self._tf: List[Counter] = [Counter(s.tokens) for s in self.candidates]
+        self._len = [len(s.tokens) for s in self.candidates]
+        self._avg_len = (sum(self._len) / len(self._len)) if self._len else 0.0
+        df: Dict[str, int] = Counter()
+        for tf in self._tf:
+            df.update(tf.keys())
+        n = len(self.candidates)
+        self._idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    def __len__(self):
+        return len(self.sections)
+
+    def score(self, query: str) -> List[Tuple[float, int]]:
+        terms = set(tokenize(query))
+        scored = []
+        for i, tf in enumerate(self._tf):
+            s = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._len[i] / (self._avg_len or 1))
+            for term in terms:
+                f = tf.get(term)
+                if f:
+                    s += self._idf[term] * f * (self.k1 + 1) / (f + norm)
+            if s > 0:
+                scored.append((s, i))
+        scored.sort(key=lambda x: -x[0])
+        return scored
+
+    def search(self, query: str, k: int, max_chars: int) -> List[Section]:
+        """Top-k sections (dans l'ordre du document), dans la limite de max_chars."""
+        picked, used = [], 0
+        for _, i in self.score(query)[:k]:
+            section = self.candidates[i]
+            if used + len(section.text) > max_chars:
+                continue
+            picked.append(i)
+            used += len(section.text)
+        return [self.candidates[i] for i in sorted(picked)]
+
+    def pinned_text(self) -> str:
+        return "\n\n".join(s.render() for s in self.pinned)
+
+
+# ---------------------------------------
+# Index courant (reconstruit par load_context)
+# ---------------------------------------
+CONTEXT_INDEX: Optional[ContextIndex] = None
+
+
+def build_index(sources: List[Tuple[str, str]], pinned_patterns: List[str]) -> ContextIndex:
+    """Construit l'index à partir de (nom de source, markdown) et le publie comme index courant."""
+    global CONTEXT_INDEX
+    sections = []
+    for source, markdown in sources:
+        if markdown:
+            sections.extend(split_sections(markdown, source))
+    index = ContextIndex(sections, pinned_patterns)
+    CONTEXT_INDEX = index
+    print(f"🔎 Index de contexte : {len(index)} sections "
+          f"({len(index.pinned)} épinglées, {len(index.candidates)} indexées)")
+    return index
+
+
+def select_context(question: str, k: int, max_chars: int) -> Optional[Tuple[str, str]]:
+    """
+    (texte épinglé, sections pertinentes) pour une question, ou None si aucun index n'est prêt.
+    Le texte épinglé est identique d'une question à l'autre (préfixe cachable).
+    """
+    index = CONTEXT_INDEX
+    if index is None or not len(index):
+        return None
+    hits = index.search(question, k, max_chars)
+    print(f"[Context] {len(hits)} sections retenues : " + ", ".join(s.title.split(" › ")[-1][:40] for s in hits))
+    retrieved = "\n\n".join(f"<!-- {s.source} -->\n{s.render()}" for s in hits)
+    return index.pinned_text(), retrieved
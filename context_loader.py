@@ -54,12 +54,18 @@ def parse_dbt_manifest_inline(manifest_path: str, schemas_filter: List[str] = No
 
 
 def load_context() -> str:
-    """Charge le contexte depuis les fichiers Markdown, DBT et Notion."""
+    """
+    Charge le contexte depuis les fichiers Markdown, DBT et Notion.
+    Reconstruit aussi l'index de sections (context_index) utilisé pour ne sélectionner
+    que les parties pertinentes à chaque question.
+    """
     # Import local pour éviter dépendance circulaire
     from notion_tools import read_notion_page
-    from config import notion_client, BOT_NAME
+    from config import notion_client, BOT_NAME, CONTEXT_RETRIEVAL, CONTEXT_PINNED_SECTIONS
+    from context_index import build_index
 
     parts = []
+    sources = []
 
     # Charger le bon fichier de contexte selon le bot
     if BOT_NAME == "FRIDA":
@@ -68,20 +74,28 @@ def load_context() -> str:
         context_file = Path(__file__).with_name("context.md")
 
     if context_file.exists():
-        parts.append(context_file.read_text(encoding="utf-8"))
+        text = context_file.read_text(encoding="utf-8")
+        parts.append(text)
+        sources.append((context_file.name, text))
 
     periscope_file = Path(__file__).with_name("periscope_queries.md")
     if periscope_file.exists():
+        text = periscope_file.read_text(encoding="utf-8")
         parts.append("\n\n# REQUÊTES PERISCOPE DE RÉFÉRENCE\n\n")
-        parts.append(periscope_file.read_text(encoding="utf-8"))
+        parts.append(text)
+        sources.append(("periscope", "# REQUÊTES PERISCOPE DE RÉFÉRENCE\n\n" + text))
 
+    # Avec l'index de recherche, seules les sections pertinentes sont envoyées :
+    # on peut charger tous les schémas DBT (DBT_SCHEMAS vide = tous).
     dbt_manifest_path = os.getenv("DBT_MANIFEST_PATH", "")
-    dbt_schemas = [s.strip() for s in os.getenv("DBT_SCHEMAS", "sales,user,inter").split(',') if s.strip()]
+    default_schemas = "" if CONTEXT_RETRIEVAL else "sales,user,inter"
+    dbt_schemas = [s.strip() for s in os.getenv("DBT_SCHEMAS", default_schemas).split(',') if s.strip()]
     if dbt_manifest_path and Path(dbt_manifest_path).exists():
         dbt_doc = parse_dbt_manifest_inline(dbt_manifest_path, dbt_schemas)
         if dbt_doc:
             parts.append("\n\n# DOCUMENTATION DBT (AUTO-GÉNÉRÉE)\n\n")
             parts.append(dbt_doc)
+            sources.append(("dbt", dbt_doc))
 
     notion_page_id = os.getenv("NOTION_CONTEXT_PAGE_ID")
     if notion_client and notion_page_id:
@@ -90,6 +104,13 @@ def load_context() -> str:
             if notion_content and not notion_content.startswith("❌"):
                 parts.append("\n\n# DOCUMENTATION NOTION\n\n")
                 parts.append(notion_content)
+                sources.append(("notion", notion_content))
         except Exception as e:
             print(f"⚠️  Erreur chargement Notion: {e}")
+
+    if CONTEXT_RETRIEVAL:
+        try:
+            build_index(sources, CONTEXT_PINNED_SECTIONS)
+        except Exception as e:
+            print(f"⚠️  Erreur construction index de contexte (contexte complet utilisé) : {e}")
     return ''.join(parts)
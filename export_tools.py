@@ -0,0 +1,296 @@
+# export_tools.py
+"""
+Export du résultat complet d'une requête BigQuery en fichier Slack (CSV gzip ou Parquet).
+
+Au lieu d'un aperçu + « exécute cette requête toi-même » :
+- la requête part sans LIMIT (après le dry run, cf. bq_engine)
+- le résultat est lu page par page (record batches Arrow, cf. bq_arrow.read_batches) et écrit
+  au fil de l'eau dans un fichier temporaire : la mémoire ne dépend pas du nombre de lignes
+- plafonds EXPORT_MAX_ROWS (lignes) et EXPORT_MAX_MB (taille du fichier) : au-delà, le fichier
+  est envoyé tel quel et signalé comme partiel
+- un message de progression est mis à jour dans le thread (toutes les EXPORT_PROGRESS_S s)
+- le fichier est envoyé dans le thread via files_upload_v2, puis supprimé du disque
+"""
+
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import bq_arrow
+from bq_arrow import pa, read_batches
+from config import (
+    app,
+    bq_client,
+    bq_client_normalized,
+    EXPORT_MAX_ROWS,
+    EXPORT_MAX_MB,
+    EXPORT_PROGRESS_S,
+    EXPORT_TIMEOUT_S,
+    MAX_TOOL_CHARS
+)
+from result_encoding import encode_rows
+from bq_engine import ENGINE, QueryRefused, check_read_only
+from bq_jobs import JOB_MANAGER, JobCancelled
+
+FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+PREVIEW_ROWS = 5
+
+
+# ---------------------------------------
+# Écriture du fichier
+# ---------------------------------------
+def _json_cell(value: Any) -> Any:
+    """STRUCT / ARRAY → JSON (une cellule CSV par valeur)."""
+    return json.dumps(value, ensure_ascii=False, default=str) if isinstance(value, (dict, list)) else value
+
+
+def _flatten_nested(batch):
+    """Colonnes imbriquées (STRUCT / ARRAY) d'un batch converties en texte JSON pour le CSV."""
+    for i, field in enumerate(batch.schema):
+        if pa.types.is_nested(field.type):
+            values = [None if v is None else _json_cell(v) for v in batch.column(i).to_pylist()]
+            batch = batch.set_column(i, field.name, pa.array(values, type=pa.string()))
+    return batch
+
+
+class _ArrowCsvWriter:
+    """CSV gzip écrit batch par batch par pyarrow."""
+
+    def __init__(self, path: str, names: List[str]):
+        import pyarrow.csv as pacsv
+
+        self._pacsv = pacsv
+        self.names = names
+        self.raw = pa.OSFile(path, "wb")
+        self.sink = pa.CompressedOutputStream(self.raw, "gzip")
+        self.writer = None
+
+    def write(self, batch):
+        batch = _flatten_nested(batch)
+        if self.writer is None:
+            self.writer = self._pacsv.CSVWriter(self.sink, batch.schema)
+        self.writer.write_batch(batch)
+
+    def size(self) -> int:
+        return self.raw.tell()  # octets compressés déjà écrits
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        else:  # résultat vide : en-tête seul
+            self.sink.write((",".join(self.names) + "\n").encode("utf-8"))
+        self.sink.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+
+class _ParquetWriter:
+    """Parquet (zstd) écrit batch par batch."""
+
+    def __init__(self, path: str, names: List[str]):
+        import pyarrow.parquet as pq
+
+        self._pq = pq
+        self.path = path
+        self.names = names
+        self.writer = None
+
+    def write(self, batch):
+        if self.writer is None:
+            self.writer = self._pq.ParquetWriter(self.path, batch.schema, compression="zstd")
+        self.writer.write_batch(batch)
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def close(self):
+        if self.writer is None:  # résultat vide : schéma seul
+            self.writer = self._pq.ParquetWriter(self.path, pa.schema([(n, pa.string()) for n in self.names]))
+        self.writer.close()
+
+
+class _RowCsvWriter:
+    """CSV gzip ligne à ligne (sans pyarrow)."""
+
+    def __init__(self, path: str, names: List[str]):
+        self.names = names
+        self.raw = open(path, "wb")
+        self.file = gzip.open(self.raw, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(names)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.writer.writerows([_json_cell(row.get(name)) for name in self.names] for row in rows)
+
+    def size(self) -> int:
+        return self.raw.tell()
+
+    def close(self):
+        self.file.close()
+        self.raw.close()
+
+
+def _row_pages(rows_iter, max_rows: int):
+    """Pages de lignes (dicts) d'un RowIterator, coupées à `max_rows` lignes."""
+    count = 0
+    for page in rows_iter.pages:
+        rows = [dict(row) for row in page][:max_rows - count]
+        count += len(rows)
+        yield rows
+        if count >= max_rows:
+            return
+
+
+def _head(chunk, n: int) -> List[Dict[str, Any]]:
+    return chunk[:n] if isinstance(chunk, list) else chunk.slice(0, n).to_pylist()
+
+
+def _filename(filename: Optional[str], fmt: str) -> str:
+    base = filename or f"export_{datetime.now().strftime('%Y%m%d_%H%M')}"
+    for ext in (".gz", ".csv", ".parquet"):
+        base = base[:-len(ext)] if base.lower().endswith(ext) else base
+    base = re.sub(r"[^\w.-]+", "_", base).strip("._") or "export"
+    return base + FORMATS[fmt]
+
+
+# ---------------------------------------
+# Progression dans le thread
+# ---------------------------------------
+class _Progress:
+    """Message de progression posté dans le thread puis mis à jour (au plus toutes les EXPORT_PROGRESS_S s)."""
+
+    def __init__(self, client, channel: str, thread_ts: str):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.ts = None
+        self.last = 0.0
+
+    def update(self, text: str, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last < EXPORT_PROGRESS_S:
+            return
+        self.last = now
+        try:
+            if self.ts is None:
+                resp = self.client.chat_postMessage(channel=self.channel, thread_ts=self.thread_ts, text=text)
+                self.ts = resp["ts"]
+            else:
+                self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+        except Exception as e:
+            print(f"[Export] ⚠️ progression non publiée : {e}")
+
+
+# ---------------------------------------
+# Tool
+# ---------------------------------------
+def export_query(query: str, thread_ts: str, project: str = "default", fmt: str = "csv",
+                 filename: Optional[str] = None) -> str:
+    """
+    Exécute `query` sans LIMIT et envoie le résultat complet dans le thread Slack
+    (CSV gzip ou Parquet). Retourne un résumé pour le modèle (pas le listing).
+    """
+    from bigquery_tools import route_query
+    from thread_memory import add_query_to_thread, get_thread_channel
+
+    fmt = (fmt or "csv").lower()
+    if fmt not in FORMATS:
+        return f"❌ Format d'export inconnu '{fmt}' : utilise 'csv' ou 'parquet'."
+    if fmt == "parquet" and not bq_arrow.available():
+        return "❌ Export Parquet indisponible (pyarrow non installé) : utilise format='csv'."
+    channel = get_thread_channel(thread_ts)
+    if not channel:
+        return "❌ Export impossible : channel Slack du thread inconnu."
+    if not (bq_client or bq_client_normalized):
+        return "❌ BigQuery non configuré."
+
+    add_query_to_thread(thread_ts, query)
+    name = _filename(filename, fmt)
+    progress = _Progress(app.client, channel, thread_ts)
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=FORMATS[fmt])
+    os.close(fd)
+    started = time.time()
+    try:
+        # Lecture seule (sans LIMIT : export complet), dry run puis job long (au-delà de TOOL_TIMEOUT_S)
+        check_read_only(query)
+        client, query = route_query(query, project)
+        job = ENGINE.start(client, query, EXPORT_TIMEOUT_S, frontend="export")
+        progress.update(f"📦 Export `{name}` : exécution de la requête…", force=True)
+        JOB_MANAGER.wait(job, EXPORT_TIMEOUT_S)
+
+        if bq_arrow.available():
+            total_rows, schema, chunks = read_batches(job, EXPORT_TIMEOUT_S, EXPORT_MAX_ROWS, client)
+            names = [field.name for field in schema]
+            writer = (_ParquetWriter if fmt == "parquet" else _ArrowCsvWriter)(path, names)
+        else:
+            rows_iter = job.result(timeout=EXPORT_TIMEOUT_S, page_size=bq_arrow.BQ_ARROW_PAGE_ROWS)
+            total_rows, names = rows_iter.total_rows, [field.name for field in rows_iter.schema]
+            chunks = _row_pages(rows_iter, EXPORT_MAX_ROWS)
+            writer = _RowCsvWriter(path, names)
+
+        expected = min(total_rows, EXPORT_MAX_ROWS) if total_rows is not None else None
+        count, size, preview, capped_mb = 0, 0, [], False
+        try:
+            for chunk in chunks:
+                JOB_MANAGER.raise_if_cancelled()  # thread arrêté pendant la lecture
+                writer.write(chunk)
+                if len(preview) < PREVIEW_ROWS:
+                    preview += _head(chunk, PREVIEW_ROWS - len(preview))
+                count += len(chunk)
+                size = writer.size()
+                progress.update(f"📦 Export `{name}` : {count:,} / {expected:,} lignes ({size / 2 ** 20:.1f} Mo)…"
+                                if expected is not None else
+                                f"📦 Export `{name}` : {count:,} lignes ({size / 2 ** 20:.1f} Mo)…")
+                if size > EXPORT_MAX_MB * 2 ** 20:
+                    capped_mb = True
+                    break
+        finally:
+            writer.close()
+        size = os.path.getsize(path)
+
+        partial = None
+        if capped_mb:
+            partial = f"plafond de {EXPORT_MAX_MB:g} Mo atteint"
+        elif total_rows is not None and total_rows > count:
+            partial = f"plafond de {EXPORT_MAX_ROWS:,} lignes atteint"
+        summary = f"{count:,} lignes" + (f" sur {total_rows:,}" if partial and total_rows else "") \
+                  + f", {size / 2 ** 20:.1f} Mo"
+
+        comment = f"📎 Export complet : {summary}" if not partial \
+            else f"📎 Export partiel ({partial}) : {summary}"
+        app.client.files_upload_v2(
+            channel=channel,
+            thread_ts=thread_ts,
+            file=path,
+            filename=name,
+            title=name,
+            initial_comment=comment
+        )
+        progress.update(f"✅ Export `{name}` envoyé ({summary}).", force=True)
+        print(f"[Export] ✅ {name} : {summary} en {time.time() - started:.1f}s")
+
+        out = f"✅ Fichier `{name}` envoyé dans le thread ({summary})."
+        if partial:
+            out += f"\n⚠️ Export partiel : {partial}. Propose de filtrer ou d'agréger pour réduire le résultat."
+        out += f"\nColonnes : {', '.join(names)}\nAperçu :\n"
+        out += encode_rows(preview, MAX_TOOL_CHARS // 4, count)
+        out += "\n\nNe recopie pas le listing : indique que le fichier est disponible dans le thread."
+        return out
+    except QueryRefused as e:
+        return str(e)
+    except JobCancelled as e:
+        progress.update(f"🛑 Export `{name}` annulé.", force=True)
+        return str(e)
+    except Exception as e:
+        progress.update(f"❌ Export `{name}` interrompu : {str(e)[:200]}", force=True)
+        return f"❌ Erreur export BigQuery: {str(e)}"
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
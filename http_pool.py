@@ -0,0 +1,169 @@
+# http_pool.py
+"""
+Transport HTTP keep-alive avec contrôle de santé pour le client Anthropic.
+
+- Les connexions sont réutilisées entre les appels d'une même question (jusqu'à 11 appels),
+  ce qui évite un handshake TCP+TLS (via le proxy) à chaque appel.
+- Les connexions inactives sont retirées AVANT les timeouts d'inactivité du proxy / serveur
+  (keepalive_expiry), c'est ce qui provoquait les broken pipe sur des sockets stale.
+- Si une connexion réutilisée s'avère morte malgré tout, la requête est rejouée une fois
+  sur une connexion neuve (transport sans keep-alive, hors du pool) au lieu de remonter un
+  BrokenPipeError.
+- Compteurs : handshakes, temps de handshake, taux de réutilisation, retries stale.
+"""
+
+import threading
+import time
+import urllib.request
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import httpx
+
+# Erreurs typiques d'un socket keep-alive fermé côté proxy/serveur
+STALE_CONNECTION_ERRORS = (httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError)
+
+
+class PoolStats:
+    """Compteurs thread-safe de l'utilisation du pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.handshake_s = 0.0
+        self.reused = 0
+        self.stale_retries = 0
+
+    def record(self, *, new_connection: bool, tls: bool, handshake_s: float):
+        with self._lock:
+            self.requests += 1
+            if new_connection:
+                self.new_connections += 1
+                self.handshake_s += handshake_s
+            else:
+                self.reused += 1
+            if tls:
+                self.tls_handshakes += 1
+
+    def record_stale_retry(self):
+        with self._lock:
+            self.stale_retries += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            reuse_ratio = (self.reused / self.requests) if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "handshake_ms_total": round(self.handshake_s * 1000, 1),
+                "handshake_ms_avg": round(self.handshake_s * 1000 / self.new_connections, 1) if self.new_connections else 0.0,
+                "reused": self.reused,
+                "reuse_ratio": round(reuse_ratio, 3),
+                "stale_retries": self.stale_retries,
+            }
+
+
+def log_pool_stats(stats: PoolStats, *, label: str = "HTTP"):
+    """Log les compteurs du pool (à comparer avec ANTHROPIC_KEEPALIVE=false)."""
+    snap = stats.snapshot()
+    print(f"[{label}] requests={snap['requests']} handshakes={snap['new_connections']} "
+          f"(tls={snap['tls_handshakes']}, avg={snap['handshake_ms_avg']}ms, total={snap['handshake_ms_total']}ms) "
+          f"reuse={snap['reuse_ratio'] * 100:.0f}% stale_retries={snap['stale_retries']}")
+
+
+class _ConnectionTrace:
+    """Callback `trace` httpcore : détecte si la requête a ouvert une nouvelle connexion."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.new_connection = False
+        self.tls = False
+        self._started: Dict[str, float] = {}
+        self.handshake_s = 0.0
+
+    def __call__(self, event_name: str, info: dict):
+        if self.parent:
+            self.parent(event_name, info)
+        # connection.connect_tcp.started / .complete, connection.start_tls.started / .complete
+        step, _, phase = event_name.rpartition(".")
+        if step.endswith("connect_tcp") or step.endswith("start_tls"):
+            if phase == "started":
+                self._started[step] = time.perf_counter()
+            elif phase == "complete":
+                self.handshake_s += time.perf_counter() - self._started.pop(step, time.perf_counter())
+                if step.endswith("connect_tcp"):
+                    self.new_connection = True
+                else:
+                    self.tls = True
+
+
+class HealthCheckedTransport(httpx.HTTPTransport):
+    """HTTPTransport keep-alive qui rejoue une fois les requêtes tombées sur une connexion stale."""
+
+    def __init__(self, *args, stats: Optional[PoolStats] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats or PoolStats()
+        # Retry : même proxy / TLS, mais aucune connexion gardée → jamais une autre connexion stale du pool
+        self._fresh = httpx.HTTPTransport(*args, **{**kwargs, "limits": httpx.Limits(max_keepalive_connections=0)})
+
+    def _send(self, request: httpx.Request, trace: _ConnectionTrace, fresh: bool = False) -> httpx.Response:
+        request.extensions["trace"] = trace
+        try:
+            return self._fresh.handle_request(request) if fresh else super().handle_request(request)
+        finally:
+            if trace.parent is None:
+                request.extensions.pop("trace", None)
+            else:
+                request.extensions["trace"] = trace.parent
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        parent = request.extensions.get("trace")
+        trace = _ConnectionTrace(parent=parent)
+        try:
+            response = self._send(request, trace)
+        except STALE_CONNECTION_ERRORS as e:
+            # On ne rejoue que si l'échec vient d'une connexion réutilisée : sur une connexion
+            # neuve, l'erreur est réelle et doit remonter (le SDK a son propre retry).
+            if trace.new_connection:
+                raise
+            self.stats.record_stale_retry()
+            print(f"[HTTP] ♻️ Connexion keep-alive stale ({type(e).__name__}: {e}), retry sur connexion neuve")
+            trace = _ConnectionTrace(parent=parent)
+            response = self._send(request, trace, fresh=True)
+        self.stats.record(new_connection=trace.new_connection, tls=trace.tls, handshake_s=trace.handshake_s)
+        return response
+
+    def close(self):
+        self._fresh.close()
+        super().close()
+
+
+def proxy_for(url: str) -> Optional[str]:
+    """Proxy à utiliser pour `url` d'après HTTP(S)_PROXY / NO_PROXY (None si bypass)."""
+    host = urlparse(url).hostname or ""
+    if urllib.request.proxy_bypass(host):
+        return None
+    proxies = urllib.request.getproxies()
+    return proxies.get(urlparse(url).scheme) or None
+
+
+def build_keepalive_client(base_url: str, *, timeout: float, max_connections: int,
+                           max_keepalive: int, keepalive_expiry: float,
+                           stats: Optional[PoolStats] = None,
+                           event_hooks: Optional[dict] = None) -> httpx.Client:
+    """Crée un httpx.Client avec transport keep-alive health-checké (proxy résolu depuis l'env)."""
+    transport = HealthCheckedTransport(
+        proxy=proxy_for(base_url),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        stats=stats,
+    )
+    # trust_env=False : le proxy est déjà résolu dans le transport (sinon httpx monterait
+    # un transport proxy standard qui contournerait le health-check)
+    return httpx.Client(transport=transport, timeout=timeout, follow_redirects=True, trust_env=False,
+                        event_hooks=event_hooks)
@@ -0,0 +1,145 @@
+# model_router.py
+"""
+Routage des messages entre le modèle complet et un petit modèle rapide.
+
+Les messages triviaux (salutations, remerciements, acquiescements, micro-blague par défaut)
+n'ont besoin ni des tools, ni du contexte, ni du gros modèle : ils partent sur
+ANTHROPIC_FAST_MODEL avec un prompt minimal. Tout ce qui ressemble à une question data garde
+la configuration complète. En cas de doute, un petit modèle peut trancher
+(MODEL_ROUTER_USE_LLM) ; sinon on reste sur la route complète.
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+ROUTE_FULL = "full"
+ROUTE_FAST = "fast"
+
+_POLITENESS_RE = re.compile(
+    r"^(?:bonjour|bonsoir|salut|hello|hi|hey|coucou|yo|merci|thanks|thx|top|super|parfait|genial|"
+    r"cool|nickel|bravo|excellent|tres bien|bien vu|au top|bonne journee|bonne soiree|a plus|"
+    r"a bientot|bye|lol|haha|ahah)"
+    r"(?:\s+(?:beaucoup|bcp|franck|frida|a toi|encore|merci|bien))*[\s!.,]*$"
+)
+
+# Acquiescements : triviaux en début de conversation, mais dans un thread ils répondent
+# souvent à une proposition du bot (« je creuse ? » → « oui ») → route complète.
+_ACK_RE = re.compile(r"^(?:ok|okay|oui|non|yes|no|d'accord|dac|ca marche|vas-y|go)[\s!.,]*$")
+
+_EMOJI_RE = re.compile(r"[\U0001F300-\U0001FAFF\u2600-\u27BF\uFE0F]+")
+
+_DATA_HINTS = (
+    "churn", "ca ", "chiffre", "abonn", "acquis", "acquiz", "box", "vente", "sales", "shop",
+    "client", "combien", "nombre", "taux", "moyenne", "total", "somme", "evolution", "compar",
+    "mois", "semaine", "annee", "jour", "hier", "trimestre", "yoy", "mom", "qoq", "requete",
+    "query", "sql", "table", "bigquery", "notion", "export", "liste", "detail", "pays", "segment",
+    "review", "avis", "crm", "email", "expedition", "livraison", "shipment", "creuse", "analyse",
+    "pourquoi", "graph", "kpi", "%",
+)
+
+DEFAULT_GREETING_PROMPT = "Dis bonjour (très bref) avec une micro-blague."
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def classify(prompt: str, has_history: bool = False) -> Optional[tuple]:
+    """
+    Classifieur heuristique local : (route, raison), ou None si incertain.
+    """
+    if (prompt or "").strip() == DEFAULT_GREETING_PROMPT:
+        return ROUTE_FAST, "salutation par défaut"
+
+    text = _EMOJI_RE.sub("", _normalize(prompt)).strip()
+    if not text:
+        return ROUTE_FAST, "message vide / emoji"
+    if _POLITENESS_RE.match(text):
+        return ROUTE_FAST, "politesse"
+    if _ACK_RE.match(text):
+        return (ROUTE_FULL, "acquiescement dans un thread") if has_history else (ROUTE_FAST, "acquiescement")
+    if re.search(r"\d", text) or any(hint in f" {text} " for hint in _DATA_HINTS):
+        return ROUTE_FULL, "question data"
+    if has_history:
+        # Un suivi court dans un thread data (« et pour l'Allemagne ? ») reste sur la route complète
+        return ROUTE_FULL, "suivi dans un thread"
+    return None
+
+
+def llm_classify(prompt: str, model: str) -> tuple:
+    """Petit modèle en arbitre : DATA → route complète, CHAT → route rapide."""
+    from config import claude, claude_scheduler
+
+    try:
+        # Admission à la priorité de la requête en cours (l'arbitrage bloque la réponse)
+        with claude_scheduler.admitted(len(prompt[:1000]) // 4 + 60, 3) as ticket:
+            response = claude.messages.create(
+                model=model,
+                max_tokens=3,
+                system=("Classe le message d'un utilisateur d'un assistant data. Réponds uniquement DATA "
+                        "s'il demande des données, une analyse, une requête ou une action (Notion, export), "
+                        "sinon CHAT."),
+                messages=[{"role": "user", "content": prompt[:1000]}]
+            )
+            ticket.usage = response.usage
+        label = "".join(getattr(b, "text", "") for b in response.content).strip().upper()
+        if label.startswith("CHAT"):
+            return ROUTE_FAST, "petit modèle : CHAT"
+        return ROUTE_FULL, f"petit modèle : {label or '?'}"
+    except Exception as e:
+        print(f"[Router] ⚠️ Classification par petit modèle impossible : {e}")
+        return ROUTE_FULL, "incertain (repli)"
+
+
+def route(prompt: str, has_history: bool = False) -> tuple:
+    """Choisit la route d'un message : (ROUTE_FULL | ROUTE_FAST, raison)."""
+    from config import MODEL_ROUTER_ENABLED, MODEL_ROUTER_USE_LLM, ANTHROPIC_FAST_MODEL
+
+    if not MODEL_ROUTER_ENABLED:
+        return ROUTE_FULL, "routeur désactivé"
+    decision = classify(prompt, has_history)
+    if decision is None:
+        decision = llm_classify(prompt, ANTHROPIC_FAST_MODEL) if MODEL_ROUTER_USE_LLM else (ROUTE_FULL, "incertain")
+    print(f"[Router] route={decision[0]} ({decision[1]})")
+    return decision
+
+
+# ---------------------------------------
+# Latence par route
+# ---------------------------------------
+class RouteStats:
+    """Latences récentes par route (médiane / p95 glissantes sur les 200 derniers appels)."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self.window = window
+
+    def record(self, route_name: str, seconds: float):
+        with self._lock:
+            samples = self._samples.setdefault(route_name, deque(maxlen=self.window))
+            samples.append(seconds)
+            ordered = sorted(samples)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"[Router] route={route_name} latence={seconds:.2f}s "
+              f"(p50={p50:.2f}s, p95={p95:.2f}s sur {len(ordered)} appels)")
+
+
+route_stats = RouteStats()
+
+
+@contextmanager
+def timed_route(route_name: str):
+    """Enregistre la latence d'un appel pour sa route."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        route_stats.record(route_name, time.time() - started)
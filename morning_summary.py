@@ -4,6 +4,17 @@
 import os
 from datetime import datetime, timedelta
 from config import bq_client, bq_client_normalized, app
+from google.cloud import bigquery
+from bq_arrow import fetch_rows
+from bq_jobs import JOB_MANAGER
+
+# Budget de lignes des requêtes du bilan (lecture colonnaire, cf. bq_arrow.py)
+SUMMARY_MAX_ROWS = 100_000
+
+
+def _summary_job_config() -> bigquery.QueryJobConfig:
+    """Jobs du bilan étiquetés kind=summary (cf. bq_report.py)."""
+    return bigquery.QueryJobConfig(labels=JOB_MANAGER.job_labels("summary"))
 
 
 def get_yesterday_date():
@@ -74,11 +85,11 @@ def get_acquisitions_by_coupon(date_str: str):
     """
 
     try:
-        job = bq_client.query(query)
-        rows = list(job.result(timeout=30))
+        job = bq_client.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 30, SUMMARY_MAX_ROWS, bq_client)
 
         if rows:
-            row = dict(rows[0])
+            row = rows[0]
             return {
                 'total_acquis': row.get('total_acquis', 0),
                 'acquis_promo': row.get('acquis_promo', 0),
@@ -116,11 +127,11 @@ def get_engagement_metrics(date_str: str):
     """
 
     try:
-        job = bq_client.query(query)
-        rows = list(job.result(timeout=30))
+        job = bq_client.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 30, SUMMARY_MAX_ROWS, bq_client)
 
         if rows:
-            row = dict(rows[0])
+            row = rows[0]
             return {
                 'total_subscribers': row.get('total_subscribers', 0),
                 'committed_subscribers': row.get('committed_subscribers', 0),
@@ -162,11 +173,11 @@ def get_coupon_details(date_str: str):
     """
 
     try:
-        job = bq_client.query(query)
-        rows = list(job.result(timeout=30))
+        job = bq_client.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 30, SUMMARY_MAX_ROWS, bq_client)
 
         if rows:
-            return [dict(row) for row in rows]
+            return rows
         return []
     except Exception as e:
         print(f"❌ Erreur get_coupon_details: {e}")
@@ -200,11 +211,11 @@ def get_country_breakdown(date_str: str):
     """
 
     try:
-        job = bq_client.query(query)
-        rows = list(job.result(timeout=30))
+        job = bq_client.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 30, SUMMARY_MAX_ROWS, bq_client)
 
         if rows:
-            return [dict(row) for row in rows]
+            return rows
         return []
     except Exception as e:
         print(f"❌ Erreur get_country_breakdown: {e}")
@@ -374,8 +385,8 @@ def get_cycle_cumul():
     """
 
     try:
-        job = bq_client.query(query)
-        rows = list(job.result(timeout=60))
+        job = bq_client.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 60, SUMMARY_MAX_ROWS, bq_client)
 
         result = {}
         for row in rows:
@@ -463,8 +474,8 @@ def get_country_acquisitions_with_comparisons():
     """
 
     try:
-        job = bq_client.query(query)
-        raw_data = [dict(row) for row in job.result(timeout=60)]
+        job = bq_client.query(query, job_config=_summary_job_config())
+        raw_data, _ = fetch_rows(job, 60, SUMMARY_MAX_ROWS, bq_client)
 
         from datetime import datetime, timedelta
         yesterday = (datetime.now() - timedelta(days=1)).date()
@@ -872,12 +883,11 @@ def get_crm_yesterday():
     """
 
     try:
-        job = bq_client_normalized.query(query)
-        rows = list(job.result(timeout=30))
+        job = bq_client_normalized.query(query, job_config=_summary_job_config())
+        rows, _ = fetch_rows(job, 30, SUMMARY_MAX_ROWS, bq_client_normalized)
 
         if rows:
-            # Convertir en liste de dicts
-            return [dict(row) for row in rows]
+            return rows
         return []
     except Exception as e:
         print(f"❌ Erreur get_crm_yesterday: {e}")
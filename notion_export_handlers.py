@@ -304,21 +304,22 @@ def register_notion_export_handlers(app: App):
 
             # Importer les modules nécessaires
             from slack_handlers import ACTIVE_THREADS
-            from thread_memory import THREAD_MEMORY, LAST_QUERIES
+            from thread_memory import forget_thread
+            from bq_jobs import JOB_MANAGER
+
+            # Interrompre la requête en cours (jobs BigQuery annulés, boucle de tools abandonnée)
+            cancelled = JOB_MANAGER.cancel_thread(thread_ts, "thread arrêté par l'utilisateur")
+            if cancelled:
+                logger.info(f"🛑 {cancelled} job(s) BigQuery annulé(s) pour le thread {thread_ts[:10]}...")
 
             # Supprimer le thread des threads actifs
             if thread_ts in ACTIVE_THREADS:
                 ACTIVE_THREADS.remove(thread_ts)
                 logger.info(f"🗑️ Thread {thread_ts[:10]}... supprimé des threads actifs")
 
-            # Nettoyer la mémoire du thread
-            if thread_ts in THREAD_MEMORY:
-                del THREAD_MEMORY[thread_ts]
-                logger.info(f"🧹 Mémoire du thread {thread_ts[:10]}... effacée")
-
-            if thread_ts in LAST_QUERIES:
-                del LAST_QUERIES[thread_ts]
-                logger.info(f"🧹 Requêtes du thread {thread_ts[:10]}... effacées")
+            # Nettoyer la mémoire du thread (historique, résumé, requêtes)
+            forget_thread(thread_ts)
+            logger.info(f"🧹 Mémoire du thread {thread_ts[:10]}... effacée")
 
             # Envoyer confirmation éphémère
             client.chat_postEphemeral(
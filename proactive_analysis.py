@@ -6,8 +6,12 @@ Franck creuse automatiquement les dimensions pertinentes selon le contexte.
 
 import re
 import os
+from decimal import Decimal
 from typing import Dict, List, Optional, Tuple
 
+import sql_ast
+from bq_jobs import query_kind
+
 
 # Patterns de colonnes synonymes pour le matching intelligent
 COLUMN_PATTERNS = {
@@ -149,27 +153,15 @@ def extract_available_columns(sql_query: str) -> List[str]:
 
 def extract_table_from_query(sql_query: str) -> Optional[str]:
     """
-    Extrait la table principale d'une requête SQL.
+    Extrait la table principale d'une requête SQL (en traversant CTE et sous-requêtes).
     Retourne au format 'project.dataset.table' ou 'dataset.table'.
     """
-    # Pattern pour capturer : FROM `project.dataset.table` ou FROM dataset.table
-    patterns = [
-        r'FROM\s+`([^`]+)`',  # FROM `project.dataset.table`
-        r'FROM\s+([a-zA-Z0-9_-]+\.[a-zA-Z0-9_-]+\.[a-zA-Z0-9_-]+)',  # FROM project.dataset.table
-        r'FROM\s+([a-zA-Z0-9_-]+\.[a-zA-Z0-9_-]+)',  # FROM dataset.table
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, sql_query, re.IGNORECASE)
-        if match:
-            return match.group(1)
-
-    return None
+    return sql_ast.main_table(sql_query)
 
 
 def extract_main_table_alias(sql_query: str) -> Optional[str]:
     """
-    Extrait l'alias de la table principale si la requête contient des JOINs.
+    Extrait l'alias de la table principale.
     Retourne l'alias ou None.
 
     Exemples:
@@ -177,59 +169,27 @@ def extract_main_table_alias(sql_query: str) -> Optional[str]:
     - "FROM sales.box_sales t1" → "t1"
     - "FROM sales.box_sales" → None
     """
-    # Pattern pour capturer : FROM table AS alias ou FROM table alias
-    patterns = [
-        r'FROM\s+`[^`]+`\s+(?:AS\s+)?([a-zA-Z0-9_]+)',  # FROM `table` AS alias ou FROM `table` alias
-        r'FROM\s+[a-zA-Z0-9_.-]+\s+(?:AS\s+)?([a-zA-Z0-9_]+)',  # FROM table AS alias ou FROM table alias
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, sql_query, re.IGNORECASE)
-        if match:
-            alias = match.group(1)
-            # Vérifier que c'est bien un alias et pas un mot-clé SQL
-            sql_keywords = ['WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'HAVING']
-            if alias.upper() not in sql_keywords:
-                return alias
-
-    return None
+    return sql_ast.main_alias(sql_query)
 
 
 def has_joins(sql_query: str) -> bool:
-    """Détecte si la requête contient des JOINs."""
-    return bool(re.search(r'\b(JOIN|LEFT JOIN|RIGHT JOIN|INNER JOIN|OUTER JOIN)\b', sql_query, re.IGNORECASE))
+    """Détecte si la requête principale contient des JOINs."""
+    return sql_ast.has_joins(sql_query)
 
 
 def get_table_columns(client, table_ref: str) -> List[Tuple[str, str]]:
     """
-    Récupère les colonnes disponibles d'une table via INFORMATION_SCHEMA.
+    Récupère les colonnes disponibles d'une table (catalogue des schémas, sans requête
+    BigQuery si la table y est déjà).
     Retourne une liste de (column_name, data_type).
     """
+    from schema_catalog import SCHEMA_CATALOG
+
     try:
-        # Parser table_ref
-        parts = table_ref.split('.')
-        if len(parts) == 3:
-            project_id, dataset_id, table_id = parts
-        elif len(parts) == 2:
+        if table_ref.count(".") == 1:
             # Utiliser le projet par défaut du client
-            project_id = client.project
-            dataset_id, table_id = parts
-        else:
-            return []
-
-        # Requête INFORMATION_SCHEMA avec types
-        query = f"""
-        SELECT column_name, data_type
-        FROM `{project_id}.{dataset_id}.INFORMATION_SCHEMA.COLUMNS`
-        WHERE table_name = '{table_id}'
-        ORDER BY ordinal_position
-        """
-
-        job = client.query(query)
-        results = list(job.result(timeout=10))
-
-        # Retourner (nom, type)
-        return [(row.column_name, row.data_type) for row in results]
+            table_ref = f"{client.project}.{table_ref}"
+        return SCHEMA_CATALOG.columns(table_ref)
 
     except Exception as e:
         print(f"[Proactive] Erreur récupération colonnes pour {table_ref}: {e}")
@@ -468,92 +428,71 @@ def generate_drill_down_query(original_query: str, dimension: str) -> Optional[s
     Génère une requête de drill-down en ajoutant un GROUP BY sur la dimension.
     Garde la même logique WHERE mais ajoute la dimension dans le SELECT et GROUP BY.
 
-    Gère les JOINs en préfixant les colonnes avec l'alias de table si nécessaire.
+    Gère les JOINs en préfixant la dimension avec l'alias de la table principale.
     """
     try:
-        # 🆕 Détecter si la requête contient des JOINs (colonnes potentiellement ambiguës)
-        dimension_to_use = dimension
-        if has_joins(original_query):
-            alias = extract_main_table_alias(original_query)
-            if alias:
-                # Préfixer la dimension avec l'alias pour éviter l'ambiguïté
-                dimension_to_use = f"{alias}.{dimension}"
-                print(f"[Proactive] JOIN détecté → préfixe : {dimension} → {dimension_to_use}")
-            else:
-                print(f"[Proactive] JOIN détecté mais pas d'alias trouvé → risque d'ambiguïté")
-
-        query_upper = original_query.upper()
-
-        # Vérifier si la requête a déjà un GROUP BY
-        has_group_by = "GROUP BY" in query_upper
-
-        if has_group_by:
-            # Ajouter la dimension au GROUP BY existant
-            pattern = r'(GROUP\s+BY\s+)([^ORDER|HAVING|LIMIT]+)'
-            match = re.search(pattern, original_query, re.IGNORECASE)
-
-            if match:
-                group_by_prefix = match.group(1)
-                existing_cols = match.group(2).strip()
-
-                # Vérifier si la dimension n'est pas déjà dans le GROUP BY
-                if dimension.lower() not in existing_cols.lower():
-                    new_group_by = f"{group_by_prefix}{dimension_to_use}, {existing_cols}"
-                    new_query = re.sub(
-                        pattern,
-                        new_group_by,
-                        original_query,
-                        count=1,
-                        flags=re.IGNORECASE
-                    )
-
-                    # Ajouter la dimension dans le SELECT aussi
-                    new_query = re.sub(
-                        r'(SELECT\s+)',
-                        f'\\1{dimension_to_use}, ',
-                        new_query,
-                        count=1,
-                        flags=re.IGNORECASE
-                    )
-
-                    return new_query
-        else:
-            # Pas de GROUP BY : en créer un
-            # 1. Ajouter dimension dans SELECT
-            new_query = re.sub(
-                r'(SELECT\s+)',
-                f'\\1{dimension_to_use}, ',
-                original_query,
-                count=1,
-                flags=re.IGNORECASE
-            )
-
-            # 2. Supprimer LIMIT existant (sera ajouté par _enforce_limit)
-            new_query = re.sub(r'\s*LIMIT\s+\d+\s*$', '', new_query, flags=re.IGNORECASE)
-
-            # 3. Ajouter ORDER BY si présent, sinon ajouter GROUP BY avant
-            if "ORDER BY" in new_query.upper():
-                # Insérer GROUP BY avant ORDER BY
-                new_query = re.sub(
-                    r'(\s+ORDER\s+BY)',
-                    f'\nGROUP BY {dimension_to_use}\\1',
-                    new_query,
-                    count=1,
-                    flags=re.IGNORECASE
-                )
-            else:
-                # Ajouter GROUP BY à la fin
-                new_query = f"{new_query.rstrip()}\nGROUP BY {dimension_to_use}"
-
-            return new_query
-
+        return sql_ast.add_dimension(original_query, dimension)
     except Exception as e:
         print(f"[Proactive] Erreur génération requête pour {dimension}: {e}")
         return None
 
-    return None
+
+# ---------------------------------------
+# Drill-downs en une requête (GROUPING SETS)
+# ---------------------------------------
+# Toutes les dimensions sont calculées en un seul scan :
+#   SELECT dim1, dim2, <select d'origine>, GROUPING(dim1) AS __g_0, GROUPING(dim2) AS __g_1
+#   FROM … WHERE … GROUP BY GROUPING SETS ((dim1, <group by d'origine>), (dim2, …))
+# puis le résultat est redécoupé par dimension (ligne du set i ⇔ __g_i = 0).
+# Si la réécriture n'est pas sûre, une requête par dimension, en parallèle.
+DRILL_DOWN_MAX_ROWS = 1000   # lignes lues pour l'ensemble des dimensions
+DRILL_DOWN_TOP_N = 10        # valeurs gardées par dimension
+
+
+def build_grouping_sets_query(original_query: str, dimensions: List[Tuple[str, str]]) -> Optional[str]:
+    """Requête GROUPING SETS couvrant toutes les dimensions, ou None si la réécriture n'est pas sûre."""
+    if len(dimensions) < 2:
+        return None
+    return sql_ast.grouping_sets(original_query, [dimension for dimension, _ in dimensions])
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
 
 
+def _rank_metric(row: Dict, dimension: str, measures: List[str]) -> Optional[str]:
+    """Colonne de classement : 1re mesure agrégée par la requête, sinon 1re colonne numérique."""
+    for name in measures:
+        if _is_number(row.get(name)):
+            return name
+    return next((k for k, v in row.items() if k != dimension and _is_number(v)), None)
+
+
+def split_grouping_sets(rows: List[Dict], dimensions: List[Tuple[str, str]], measures: List[str] = ()) -> Dict:
+    """
+    Redécoupe le résultat GROUPING SETS en {dimension: {label, results, metric}} : top N par
+    `measures` (colonnes agrégées, cf. sql_ast.measure_columns), pas par une clé de groupe numérique.
+    """
+    names = [dimension for dimension, _ in dimensions]
+    results = {}
+    for i, (dimension, label) in enumerate(dimensions):
+        dim_rows = []
+        for row in rows:
+            if row.get(f"__g_{i}") != 0:
+                continue
+            data = {dimension: row.get(dimension)}
+            data.update({k: v for k, v in row.items() if k not in names and not k.startswith("__g_")})
+            dim_rows.append(data)
+        if not dim_rows:
+            continue
+        metric = _rank_metric(dim_rows[0], dimension, measures)
+        if metric:
+            dim_rows.sort(key=lambda r: r.get(metric) or 0, reverse=True)
+        results[dimension] = {"label": label, "results": dim_rows[:DRILL_DOWN_TOP_N], "metric": metric}
+    return results
+
+
+@query_kind("drilldown")
 def execute_drill_downs(
     client,
     original_query: str,
@@ -562,12 +501,14 @@ def execute_drill_downs(
     timeout: int
 ) -> Dict:
     """
-    Exécute les requêtes de drill-down pour chaque dimension pertinente.
+    Exécute les drill-downs pour chaque dimension pertinente.
     Retourne un dict {dimension: {label: str, results: list}}
+    Un seul job GROUPING SETS quand c'est possible, sinon un job par dimension en parallèle.
     """
-    from bigquery_tools import _enforce_limit
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    from bigquery_tools import _enforce_limit, run_query
 
-    results = {}
     max_drill_downs = int(os.getenv("MAX_DRILL_DOWNS", "3"))
 
     # 🆕 VALIDATION : Vérifier que les dimensions existent vraiment dans la table
@@ -579,38 +520,57 @@ def execute_drill_downs(
         return {}
 
     print(f"[Proactive] {len(validated_dimensions)} dimension(s) validée(s) sur {len(dimensions)}")
+    selected = validated_dimensions[:max_drill_downs]
 
-    for dimension, label in validated_dimensions[:max_drill_downs]:
+    grouped_query = build_grouping_sets_query(original_query, selected)
+    if grouped_query:
         try:
-            drill_query = generate_drill_down_query(original_query, dimension)
-
-            if not drill_query:
-                print(f"[Proactive] Impossible de générer requête pour {dimension}")
-                continue
-
-            # Exécuter la requête
-            enforced_query = _enforce_limit(drill_query)
-
-            print(f"[Proactive] Exécution drill-down sur {dimension}...")
-            job = client.query(enforced_query)
-            rows = list(job.result(timeout=timeout))
-
-            if rows and len(rows) > 0:
-                # Convertir en liste de dicts (max 10 lignes par dimension)
-                rows_data = [dict(row) for row in rows[:10]]
+            result = run_query(client, grouped_query, timeout, max_rows=DRILL_DOWN_MAX_ROWS)
+            if result.total_rows and result.total_rows > len(result.rows):
+                print(f"[Proactive] ⚠️ GROUPING SETS tronqué ({len(result.rows)}/{result.total_rows} lignes)")
+            results = split_grouping_sets(result.rows, selected, sql_ast.measure_columns(grouped_query))
+            print(f"[Proactive] ✓ {len(selected)} drill-downs en 1 job GROUPING SETS : "
+                  + ", ".join(f"{d}={len(r['results'])}" for d, r in results.items()))
+            return results
+        except Exception as e:
+            print(f"[Proactive] GROUPING SETS en échec, repli sur une requête par dimension : {str(e)[:100]}")
 
-                results[dimension] = {
-                    "label": label,
-                    "results": rows_data
-                }
+    def run_one(dimension):
+        drill_query = generate_drill_down_query(original_query, dimension)
+        if not drill_query:
+            print(f"[Proactive] Impossible de générer requête pour {dimension}")
+            return None
+        print(f"[Proactive] Exécution drill-down sur {dimension}...")
+        return run_query(client, _enforce_limit(drill_query), timeout).rows
 
-                print(f"[Proactive] ✓ Drill-down {dimension}: {len(rows_data)} résultats")
-            else:
-                print(f"[Proactive] ✗ Drill-down {dimension}: aucun résultat")
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(selected), thread_name_prefix="drilldown") as pool:
+        # Copie du contexte : drill-downs rattachés au thread Slack (annulation, cf. bq_jobs)
+        futures = [(dimension, label, pool.submit(contextvars.copy_context().run, run_one, dimension))
+                   for dimension, label in selected]
+        for dimension, label, future in futures:
+            try:
+                rows = future.result()
+                if rows is None:
+                    continue
+
+                if rows and len(rows) > 0:
+                    # Convertir en liste de dicts (max 10 lignes par dimension)
+                    rows_data = [dict(row) for row in rows[:DRILL_DOWN_TOP_N]]
+
+                    results[dimension] = {
+                        "label": label,
+                        "results": rows_data,
+                        "metric": _rank_metric(rows_data[0], dimension, sql_ast.measure_columns(original_query))
+                    }
+
+                    print(f"[Proactive] ✓ Drill-down {dimension}: {len(rows_data)} résultats")
+                else:
+                    print(f"[Proactive] ✗ Drill-down {dimension}: aucun résultat")
 
-        except Exception as e:
-            print(f"[Proactive] ✗ Erreur drill-down {dimension}: {str(e)[:100]}")
-            continue
+            except Exception as e:
+                print(f"[Proactive] ✗ Erreur drill-down {dimension}: {str(e)[:100]}")
+                continue
 
     return results
 
@@ -637,10 +597,13 @@ def format_proactive_analysis(main_result: list, drill_down_results: Dict, conte
 
         output_lines.append(f"### 📊 Breakdown par **{label}**")
 
-        # Détecter les colonnes de métrique (numériques)
+        # Détecter les colonnes de métrique (numériques), mesure de classement en tête
         first_row = results[0]
         metric_cols = [k for k, v in first_row.items()
-                      if isinstance(v, (int, float)) and k != dimension]
+                      if _is_number(v) and k != dimension]
+        if data.get("metric") in metric_cols:
+            metric_cols.remove(data["metric"])
+            metric_cols.insert(0, data["metric"])
 
         if not metric_cols:
             output_lines.append("  _(Aucune métrique numérique trouvée)_\n")
@@ -665,7 +628,7 @@ def format_proactive_analysis(main_result: list, drill_down_results: Dict, conte
             for col in metric_cols:
                 value = row.get(col, 0) or 0
 
-                if isinstance(value, float):
+                if isinstance(value, (float, Decimal)):
                     metrics_parts.append(f"{col}={value:,.2f}")
                 else:
                     metrics_parts.append(f"{col}={value:,}")
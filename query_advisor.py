@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+# query_advisor.py
+"""
+Conseiller partitionnement / clustering pour le SQL écrit par le modèle.
+
+À partir des métadonnées du catalogue (colonne de partition et son type, colonnes de
+clustering, cf. schema_catalog.py) :
+1. Réécrit les filtres de date qui empêchent l'élagage des partitions en une forme élagable,
+   uniquement quand le résultat est strictement identique :
+     DATE(ts) = '2025-01-01'          → ts >= TIMESTAMP('2025-01-01') AND ts < TIMESTAMP('2025-01-02')
+     DATE(ts, 'Europe/Paris') >= x    → ts >= TIMESTAMP(x, 'Europe/Paris')
+     EXTRACT(YEAR FROM ts) = 2025     → ts >= TIMESTAMP('2025-01-01') AND ts < TIMESTAMP('2026-01-01')
+     DATE(d) / CAST(d AS DATE)        → d (colonne déjà DATE)
+2. Sans aucun filtre sur la colonne de partition, ni dans le SELECT ni dans une requête qui le lit
+   (requête englobante, lecteur du CTE) : fenêtre par défaut (QUERY_ADVISOR_WINDOW_DAYS) ajoutée
+   sur la table principale, avec un avertissement renvoyé au modèle.
+3. Signale les filtres restés non élagables (partition ou clustering enveloppés dans une fonction).
+
+Les octets des dry runs avant / après sont journalisés (QUERY_ADVISOR_LOG_PATH, en arrière-plan) ;
+`python query_advisor.py --days 7` rejoue les requêtes réelles du bot (INFORMATION_SCHEMA.JOBS,
+labels kind=main, cf. bq_report.py) pour mesurer la réduction de scan.
+"""
+
+import json
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlglot import exp
+
+import sql_ast
+from bq_config import QUERY_ADVISOR_ENABLED, QUERY_ADVISOR_LOG_PATH, QUERY_ADVISOR_WINDOW_DAYS
+
+_TIME_TYPES = {"DATE", "DATETIME", "TIMESTAMP"}
+_COMPARISONS = (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)
+# a OP b ⇔ b FLIP[OP] a
+_FLIP = {exp.EQ: exp.EQ, exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE}
+
+
+class Advice:
+    """SQL conseillé + réécritures appliquées + avertissements destinés au modèle."""
+
+    def __init__(self, sql: str, rewrites: Optional[List[str]] = None, notices: Optional[List[str]] = None):
+        self.sql = sql
+        self.rewrites = rewrites or []
+        self.notices = notices or []
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.rewrites)
+
+    @property
+    def notice(self) -> str:
+        return "".join(f"ℹ️ {n}\n" for n in self.notices)
+
+
+class _Source:
+    """
+    Table partitionnée lue par un SELECT : nom visible (alias), partition et son type, clustering,
+    colonnes ; `others` : colonnes des autres tables du SELECT (None si inconnues : CTE, sous-requête…).
+    """
+
+    def __init__(self, table: exp.Table, ref: str, partition: Optional[str], kind: Optional[str],
+                 clustering: List[str], joined: bool, columns: set):
+        self.table = table
+        self.ref = ref
+        self.partition = partition
+        self.kind = kind
+        self.clustering = clustering
+        self.joined = joined
+        self.columns = columns
+        self.others: List[Optional[set]] = []
+        self.visible = table.alias_or_name
+
+
+# ---------------------------------------
+# Métadonnées
+# ---------------------------------------
+def _metadata(catalog, ref: str) -> Optional[dict]:
+    """Entrée du catalogue (partition, clustering, colonnes), None si inconnue ou inaccessible."""
+    try:
+        return catalog.get(ref)
+    except Exception as e:
+        print(f"[Advisor] ⚠️ métadonnées indisponibles pour {ref} : {str(e)[:100]}")
+        return None
+
+
+def _sources(select: exp.Select, default_project: str, ctes: set, catalog) -> List[_Source]:
+    items = []
+    from_ = select.args.get("from_")
+    if from_ is not None:
+        items.append((from_.this, False))
+    items += [(join.this, True) for join in select.args.get("joins") or []]
+
+    sources, columns = [], []  # columns : colonnes de chaque élément du FROM (None si inconnues)
+    for table, joined in items:
+        if not isinstance(table, exp.Table) or not table.db or table.name.lower() in ctes \
+                or table.db.lower().startswith("region-"):
+            columns.append(None)
+            continue
+        ref = f"{table.catalog or default_project}.{table.db}.{table.name}"
+        entry = _metadata(catalog, ref)
+        if not entry:
+            columns.append(None)
+            continue
+        columns.append({c["nom"].lower() for c in entry.get("columns", [])})
+        partition = entry.get("partition")
+        kind = next((c["type"].upper() for c in entry.get("columns", []) if c["nom"] == partition), None)
+        if kind not in _TIME_TYPES:
+            partition = kind = None
+        if partition or entry.get("clustering"):
+            sources.append(_Source(table, ref, partition, kind, entry.get("clustering") or [], joined, columns[-1]))
+    for source in sources:
+        source.others = [cols for cols in columns if cols is not source.columns]
+    return sources
+
+
+# ---------------------------------------
+# Analyse d'un SELECT
+# ---------------------------------------
+def _own(node: exp.Expression, select: exp.Select) -> bool:
+    """Le nœud appartient au SELECT lui-même (pas à une sous-requête imbriquée)."""
+    return node.find_ancestor(exp.Select) is select
+
+
+def _matches(column: exp.Column, source: _Source, name: str) -> bool:
+    """
+    La colonne désigne `name` de `source` : qualifiée par son nom visible, ou non qualifiée et
+    `source` est la seule table du SELECT à avoir cette colonne (d'après le catalogue).
+    """
+    if column.name.lower() != name.lower():
+        return False
+    if column.table:
+        return column.table.lower() == source.visible.lower()
+    return name.lower() in source.columns and all(cols is not None and name.lower() not in cols
+                                                  for cols in source.others)
+
+
+def _ambiguous(column: exp.Column, source: _Source, name: str) -> bool:
+    """Colonne non qualifiée `name` qui peut désigner `source` sans qu'on sache l'établir."""
+    return not column.table and column.name.lower() == name.lower() and not _matches(column, source, name)
+
+
+def _is_constant(node: exp.Expression) -> bool:
+    return node.find(exp.Column, exp.Select) is None
+
+
+def _day_of(node: exp.Expression) -> Tuple[Optional[exp.Column], Optional[exp.Expression]]:
+    """(colonne, fuseau) si le nœud est le jour d'une colonne : DATE(c[, tz]), CAST(c AS DATE), EXTRACT(DATE FROM c)."""
+    if isinstance(node, exp.Date) and isinstance(node.this, exp.Column) and not node.expressions:
+        return node.this, node.args.get("zone")
+    if isinstance(node, exp.Cast) and isinstance(node.this, exp.Column) and node.to.this == exp.DataType.Type.DATE:
+        return node.this, None
+    if isinstance(node, exp.Extract) and isinstance(node.expression, exp.Column) \
+            and node.this.name.upper() == "DATE":
+        return node.expression, None
+    return None, None
+
+
+def _year_of(node: exp.Expression) -> Optional[exp.Column]:
+    if isinstance(node, exp.Extract) and isinstance(node.expression, exp.Column) \
+            and node.this.name.upper() == "YEAR":
+        return node.expression
+    return None
+
+
+def _is_day(node: exp.Expression) -> bool:
+    """Constante de type DATE (littéral, CURRENT_DATE, DATE(…), arithmétique de dates) : seule forme réécrite."""
+    if node is None:
+        return False
+    if sql_ast._date_value(node):
+        return True
+    if isinstance(node, exp.Cast):
+        return node.to.this == exp.DataType.Type.DATE and _is_constant(node)
+    if isinstance(node, (exp.CurrentDate, exp.Date)):
+        return _is_constant(node)
+    if isinstance(node, (exp.DateAdd, exp.DateSub, exp.DateTrunc)):
+        return _is_day(node.this) and _is_constant(node)
+    return False
+
+
+def _day_sql(value: exp.Expression, shift: int = 0) -> str:
+    """Jour (DATE) d'une borne : littéral recalculé en Python, sinon expression SQL (+ DATE_ADD)."""
+    literal = sql_ast._date_value(value)
+    if literal:
+        return f"'{(date.fromisoformat(literal) + timedelta(days=shift)).isoformat()}'"
+    value_sql = sql_ast.to_sql(value)
+    return f"DATE_ADD({value_sql}, INTERVAL {shift} DAY)" if shift else value_sql
+
+
+def _start_of(source: _Source, day_sql: str, zone: Optional[exp.Expression] = None) -> str:
+    """Début du jour `day_sql` dans le type de la colonne de partition."""
+    if source.kind == "DATE":
+        return day_sql
+    if source.kind == "DATETIME":
+        return f"DATETIME({day_sql})"
+    return f"TIMESTAMP({day_sql}, {sql_ast.to_sql(zone)})" if zone is not None else f"TIMESTAMP({day_sql})"
+
+
+def _day_range(column_sql: str, source: _Source, op, value: exp.Expression, zone) -> str:
+    """Condition sur la colonne brute équivalente à `jour(colonne) op value`."""
+    if op is exp.EQ:
+        return (f"{column_sql} >= {_start_of(source, _day_sql(value), zone)} "
+                f"AND {column_sql} < {_start_of(source, _day_sql(value, 1), zone)}")
+    if op in (exp.GTE, exp.LT):
+        return f"{column_sql} {'>=' if op is exp.GTE else '<'} {_start_of(source, _day_sql(value), zone)}"
+    return f"{column_sql} {'>=' if op is exp.GT else '<'} {_start_of(source, _day_sql(value, 1), zone)}"
+
+
+def _rewrite_predicate(pred: exp.Expression, source: _Source) -> Optional[str]:
+    """
+    Condition élagable strictement équivalente au prédicat, ou None : jour d'une colonne
+    TIMESTAMP / DATETIME comparé à une constante, année (EXTRACT(YEAR …) = N) de la colonne.
+    """
+    def own(column) -> bool:
+        return column is not None and _matches(column, source, source.partition)
+
+    if isinstance(pred, exp.Between):
+        column, zone = _day_of(pred.this)
+        low, high = pred.args.get("low"), pred.args.get("high")
+        if source.kind != "DATE" and own(column) and _is_day(low) and _is_day(high):
+            column_sql = sql_ast.to_sql(column)
+            return f"{_day_range(column_sql, source, exp.GTE, low, zone)} AND {_day_range(column_sql, source, exp.LTE, high, zone)}"
+        return None
+
+    if not isinstance(pred, _COMPARISONS):
+        return None
+    op, left, right = type(pred), pred.this, pred.expression
+    if _is_constant(left) and not _is_constant(right):
+        op, left, right = _FLIP[op], right, left
+    if not _is_constant(right):
+        return None
+
+    column, zone = _day_of(left)
+    if source.kind != "DATE" and own(column) and _is_day(right):
+        return _day_range(sql_ast.to_sql(column), source, op, right, zone)
+
+    column = _year_of(left)
+    if own(column) and op is exp.EQ and isinstance(right, exp.Literal) and not right.is_string:
+        year, column_sql = int(right.this), sql_ast.to_sql(column)
+        return (f"{column_sql} >= {_start_of(source, repr(f'{year}-01-01'))} "
+                f"AND {column_sql} < {_start_of(source, repr(f'{year + 1}-01-01'))}")
+    return None
+
+
+def _split(condition: exp.Expression, connector) -> list:
+    """Opérandes d'une chaîne AND / OR (parenthèses comprises)."""
+    condition = condition.unnest()
+    if isinstance(condition, connector):
+        return _split(condition.this, connector) + _split(condition.expression, connector)
+    return [condition]
+
+
+def _conjuncts(condition: exp.Expression) -> list:
+    return _split(condition, exp.And)
+
+
+def _is_prunable(pred: exp.Expression, source: _Source) -> bool:
+    """Prédicat qui borne la colonne de partition brute par des constantes (OR : chaque branche)."""
+    pred = pred.unnest()
+    if isinstance(pred, exp.And):
+        return any(_is_prunable(p, source) for p in _conjuncts(pred))
+    if isinstance(pred, exp.Or):
+        return all(_is_prunable(p, source) for p in _split(pred, exp.Or))
+    if isinstance(pred, exp.Between):
+        column, bounds = pred.this, [pred.args.get("low"), pred.args.get("high")]
+    elif isinstance(pred, _COMPARISONS + (exp.In,)):
+        column, bounds = pred.this, [pred.expression] + list(pred.expressions)
+        if _is_constant(pred.this) and pred.expression is not None:
+            column, bounds = pred.expression, [pred.this]
+    else:
+        return False
+    return isinstance(column, exp.Column) and _matches(column, source, source.partition) \
+        and all(_is_constant(b) for b in bounds if b is not None)
+
+
+def _clauses(select: exp.Select) -> list:
+    """Conditions du SELECT : WHERE puis ON des jointures."""
+    where = select.args.get("where")
+    clauses = [where.this] if where is not None else []
+    return clauses + [j.args["on"] for j in select.args.get("joins") or [] if j.args.get("on") is not None]
+
+
+def _own_nodes(select: exp.Select, types: tuple) -> list:
+    return [n for clause in _clauses(select) for n in clause.find_all(*types) if _own(n, select)]
+
+
+def _replace(node: exp.Expression, condition_sql: str):
+    condition = exp.condition(condition_sql, dialect=sql_ast.DIALECT)
+    if isinstance(condition, exp.And) and not isinstance(node.parent, (exp.Where, exp.And, exp.Join)):
+        condition = exp.Paren(this=condition)
+    node.replace(condition)
+
+
+def _rewrite_partition_filters(select: exp.Select, source: _Source, rewrites: List[str]):
+    """Réécrit en place les filtres de la colonne de partition (WHERE et ON) en forme élagable."""
+    if source.kind == "DATE":
+        for wrapper in _own_nodes(select, (exp.Date, exp.Cast)):
+            column, zone = _day_of(wrapper)
+            if zone is None and column is not None and _matches(column, source, source.partition):
+                rewrites.append(f"{sql_ast.to_sql(wrapper)} → {sql_ast.to_sql(column)}")
+                wrapper.replace(column.copy())
+    while True:  # un remplacement à la fois : l'arbre change sous l'itération
+        for node in _own_nodes(select, (exp.Between,) + _COMPARISONS):
+            condition = _rewrite_predicate(node, source)
+            if condition:
+                rewrites.append(f"{sql_ast.to_sql(node)} → {condition}")
+                _replace(node, condition)
+                break
+        else:
+            return
+
+
+def _consumers(select: exp.Select) -> List[exp.Select]:
+    """SELECT qui lisent le résultat de `select` : requêtes englobantes et lecteurs de son CTE (récursivement)."""
+    found: Dict[int, exp.Select] = {}
+    pending = [select]
+    while pending:
+        readers, parent = [], pending.pop().parent
+        while parent is not None:
+            if isinstance(parent, exp.CTE):
+                readers = [t.find_ancestor(exp.Select) for t in parent.root().find_all(exp.Table)
+                           if not t.db and t.name.lower() == parent.alias_or_name.lower()]
+                break
+            if isinstance(parent, exp.Select):
+                readers = [parent]
+                break
+            parent = parent.parent
+        for reader in readers:
+            if reader is not None and id(reader) not in found:
+                found[id(reader)] = reader
+                pending.append(reader)
+    return list(found.values())
+
+
+def _filtered_by_consumer(select: exp.Select, source: _Source) -> bool:
+    """
+    Un SELECT consommateur filtre la partition : colonne du même nom, ou alias d'une expression
+    de `select` qui l'utilise (WHERE, ON, HAVING, QUALIFY).
+    """
+    names = {source.partition.lower()}
+    for projection in select.expressions:
+        if any(_matches(c, source, source.partition) for c in projection.find_all(exp.Column)):
+            names.add(projection.alias_or_name.lower())
+    for consumer in _consumers(select):
+        clauses = _clauses(consumer) + [consumer.args[k].this for k in ("having", "qualify")
+                                        if consumer.args.get(k) is not None]
+        if any(c.name.lower() in names for clause in clauses for c in clause.find_all(exp.Column)):
+            return True
+    return False
+
+
+def _advise_select(select: exp.Select, sources: List[_Source], consumer_filtered: set, window_days: int,
+                   rewrites: List[str], notices: Dict[str, None]):
+    """`consumer_filtered` : id des sources filtrées par un consommateur dans la requête d'origine."""
+    for source in sources:
+        if not source.partition:
+            continue
+        _rewrite_partition_filters(select, source, rewrites)
+        if any(_is_prunable(p, source) for clause in _clauses(select) for p in _conjuncts(clause)):
+            continue
+        columns = _own_nodes(select, (exp.Column,))
+        if any(_ambiguous(c, source, source.partition) for c in columns):
+            continue  # `payment_date` non qualifiée, table non identifiable : ni fenêtre ni avertissement
+        if any(_matches(c, source, source.partition) for c in columns):
+            notices[f"Filtre sur `{source.partition}` non élagable : `{source.ref}` est lue en entier "
+                    f"(comparer la colonne brute à des constantes, ex. `{source.partition} >= …`)."] = None
+        elif id(source) in consumer_filtered:
+            # Borne posée par la requête englobante (ou le lecteur du CTE) : pas de fenêtre qui la contredirait
+            notices[f"Filtre sur `{source.partition}` posé hors du SELECT qui lit `{source.ref}` : "
+                    f"pour garantir l'élagage, filtre `{source.partition}` au plus près de la table."] = None
+        elif window_days > 0 and not source.joined and select.find_ancestor(exp.Where) is None:
+            column_sql = f"{source.visible}.{source.partition}" if source.table.alias or source.others \
+                else source.partition
+            start = _start_of(source, f"DATE_SUB(CURRENT_DATE(), INTERVAL {window_days} DAY)")
+            select.where(f"{column_sql} >= {start}", dialect=sql_ast.DIALECT, copy=False)
+            rewrites.append(f"fenêtre par défaut : {column_sql} >= {start}")
+            notices[f"Aucun filtre sur `{source.partition}` (partition de `{source.ref}`) : seuls les "
+                    f"{window_days} derniers jours ont été lus. Pour une autre période, ajoute un filtre "
+                    f"explicite sur `{source.partition}`."] = None
+        else:
+            notices[f"Aucun filtre sur `{source.partition}` : `{source.ref}` est lue en entier."] = None
+
+    for source in sources:
+        for column in _own_nodes(select, (exp.Column,)):
+            if not any(_matches(column, source, c) for c in source.clustering):
+                continue
+            wrapper = column.parent
+            if isinstance(wrapper, exp.Func) and not isinstance(wrapper, exp.Predicate):
+                notices[f"Colonne clusterisée `{column.name}` filtrée via `{sql_ast.to_sql(wrapper)}` : "
+                        f"comparer la colonne brute permettrait d'élaguer les blocs de `{source.ref}`."] = None
+
+
+# ---------------------------------------
+# Conseiller
+# ---------------------------------------
+class QueryAdvisor:
+    """
+    Réécritures élagables + fenêtre par défaut + mesure des dry runs avant / après.
+    `catalog` : métadonnées des tables (`get(ref)`), SCHEMA_CATALOG par défaut.
+    """
+
+    def __init__(self, enabled: bool, window_days: int, log_path: str, catalog=None):
+        self.enabled = enabled
+        self.window_days = window_days
+        self.log_path = log_path
+        self._catalog = catalog
+        self._lock = threading.Lock()
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            # Import local : le catalogue dépend de la config du bot (Slack), pas le conseiller
+            from schema_catalog import SCHEMA_CATALOG
+            self._catalog = SCHEMA_CATALOG
+        return self._catalog
+
+    def advise(self, sql: str, default_project: str, client=None) -> Advice:
+        """
+        Requête conseillée (inchangée si rien à réécrire). Avec `client`, les octets des dry runs
+        avant / après sont journalisés en arrière-plan.
+        """
+        if not self.enabled:
+            return Advice(sql)
+        tree = sql_ast.parse(sql)
+        if tree is None:
+            return Advice(sql)
+        tree = tree.copy()
+        rewrites: List[str] = []
+        notices: Dict[str, None] = {}
+        try:
+            ctes = sql_ast._cte_names(tree)
+            # Filtres des consommateurs relevés avant toute réécriture : une fenêtre par défaut
+            # ajoutée à la requête englobante n'est pas un filtre de l'utilisateur
+            plans = []
+            for select in list(tree.find_all(exp.Select)):
+                sources = _sources(select, default_project, ctes, self.catalog)
+                if sources:
+                    filtered = {id(s) for s in sources if s.partition and _filtered_by_consumer(select, s)}
+                    plans.append((select, sources, filtered))
+            for select, sources, filtered in plans:
+                _advise_select(select, sources, filtered, self.window_days, rewrites, notices)
+        except Exception as e:
+            print(f"[Advisor] ⚠️ analyse abandonnée : {str(e)[:200]}")
+            return Advice(sql)
+
+        if not rewrites:
+            return Advice(sql, notices=list(notices))
+        advice = Advice(sql_ast.to_sql(tree), rewrites, list(notices))
+        print(f"[Advisor] {len(rewrites)} réécriture(s) : " + " | ".join(r[:120] for r in rewrites))
+        if client is not None and self.log_path:
+            threading.Thread(target=self.measure, args=(client, sql, advice), daemon=True,
+                             name="AdvisorDryRun").start()
+        return advice
+
+    def measure(self, client, before: str, advice: Advice) -> Optional[Tuple[int, int]]:
+        """Dry runs avant / après (octets), journalisés dans QUERY_ADVISOR_LOG_PATH."""
+        from bq_guard import dry_run
+
+        try:
+            scanned = dry_run(client, before).bytes_processed, dry_run(client, advice.sql).bytes_processed
+        except Exception as e:
+            print(f"[Advisor] ⚠️ dry run impossible : {str(e)[:200]}")
+            return None
+        saved = 1 - scanned[1] / scanned[0] if scanned[0] else 0.0
+        print(f"[Advisor] dry run : {scanned[0] / 2 ** 30:.2f} Go → {scanned[1] / 2 ** 30:.2f} Go (-{saved:.0%})")
+        if self.log_path:
+            line = json.dumps({"ts": time.time(), "project": client.project, "before_bytes": scanned[0],
+                               "after_bytes": scanned[1], "rewrites": advice.rewrites, "sql": before[:4000]},
+                              ensure_ascii=False)
+            try:
+                with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except Exception as e:
+                print(f"[Advisor] ⚠️ journal {self.log_path} non écrit : {e}")
+        return scanned
+
+
+QUERY_ADVISOR = QueryAdvisor(QUERY_ADVISOR_ENABLED, QUERY_ADVISOR_WINDOW_DAYS, QUERY_ADVISOR_LOG_PATH)
+
+
+# ---------------------------------------
+# Rejeu du journal réel (CLI)
+# ---------------------------------------
+_REPLAY_SQL = """
+SELECT query, COUNT(*) AS runs
+FROM `{project}`.`{region}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT
+WHERE creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)
+  AND job_type = 'QUERY'
+  AND state = 'DONE'
+  AND EXISTS (SELECT 1 FROM UNNEST(labels) WHERE key = 'app' AND value = '{app}')
+  AND EXISTS (SELECT 1 FROM UNNEST(labels) WHERE key = 'kind' AND value = 'main')
+GROUP BY query
+ORDER BY runs DESC
+LIMIT {limit}
+"""
+
+
+def replay(days: int = 7, limit: int = 200, projects: Optional[List[str]] = None):
+    """Rejoue les requêtes principales du bot (dry runs avant / après conseil) et imprime la réduction de scan."""
+    from bq_config import BQ_REPORT_PROJECTS, BQ_REPORT_REGION
+    from bq_engine import ENGINE
+    from bq_jobs import APP_LABEL
+
+    total_before = total_after = changed = seen = 0
+    for project in projects or BQ_REPORT_PROJECTS:
+        client = ENGINE.client(project)
+        sql = _REPLAY_SQL.format(project=project, region=BQ_REPORT_REGION, days=int(days),
+                                 app=APP_LABEL, limit=int(limit))
+        for row in ENGINE.run(client, sql, limit, frontend="report", gate=False).rows:
+            seen += 1
+            advice = QUERY_ADVISOR.advise(row["query"], project)
+            if not advice.changed:
+                continue
+            scanned = QUERY_ADVISOR.measure(client, row["query"], advice)
+            if not scanned:
+                continue
+            changed += 1
+            total_before += scanned[0] * row["runs"]
+            total_after += scanned[1] * row["runs"]
+            print(f"  {row['runs']:>4}× {scanned[0] / 2 ** 30:8.2f} Go → {scanned[1] / 2 ** 30:8.2f} Go  "
+                  f"{' '.join(row['query'].split())[:100]}")
+
+    saved = 1 - total_after / total_before if total_before else 0.0
+    print(f"\n📉 {changed}/{seen} requêtes réécrites : {total_before / 2 ** 30:.1f} Go → "
+          f"{total_after / 2 ** 30:.1f} Go scannés (-{saved:.0%}, pondéré par le nombre d'exécutions)")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Conseiller partitionnement : rejeu des requêtes réelles du bot")
+    parser.add_argument("--days", type=int, default=7, help="Fenêtre du journal INFORMATION_SCHEMA (défaut: 7)")
+    parser.add_argument("--limit", type=int, default=200, help="Requêtes distinctes par projet (défaut: 200)")
+    parser.add_argument("--project", action="append", help="Projet(s) à rejouer (défaut: BQ_REPORT_PROJECTS)")
+    parser.add_argument("--sql", help="Conseiller une seule requête (sans dry run)")
+    args = parser.parse_args()
+
+    if args.sql:
+        import os
+        advice = QUERY_ADVISOR.advise(args.sql, os.getenv("BIGQUERY_PROJECT_ID"))
+        print(advice.notice + advice.sql)
+        return
+    replay(args.days, args.limit, args.project)
+
+
+if __name__ == "__main__":
+    main()
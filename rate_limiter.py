@@ -0,0 +1,296 @@
+# rate_limiter.py
+"""
+Ordonnanceur des appels Claude (token buckets + admission control).
+
+Un seul ordonnanceur par process suit les budgets de l'API Anthropic :
+- requêtes / minute (RPM)
+- tokens d'entrée / minute (ITPM) et tokens de sortie / minute (OTPM)
+
+Chaque appel réserve une estimation avant de partir (corrigée avec l'usage réel au retour).
+Quand le budget manque, les appels attendent en file :
+- priorité : interactif (mentions, messages de thread) avant arrière-plan (résumés mémoire, …)
+- équité : à priorité égale, l'utilisateur le moins servi sur la dernière minute passe d'abord
+Les 429/529 et leurs en-têtes `retry-after` bloquent toute l'admission (plus de retries en
+cascade), et les en-têtes `anthropic-ratelimit-*-remaining` recalent les buckets.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Utilisateur / priorité de la requête en cours (posés par les handlers Slack)
+current_user: contextvars.ContextVar = contextvars.ContextVar("claude_user", default="anonymous")
+current_priority: contextvars.ContextVar = contextvars.ContextVar("claude_priority", default=PRIORITY_INTERACTIVE)
+
+
+class QueueTimeout(Exception):
+    """Attente en file trop longue ; `estimated_wait` indique l'attente restante estimée."""
+
+    def __init__(self, estimated_wait: float):
+        super().__init__(f"file d'attente Claude : ~{estimated_wait:.0f}s")
+        self.estimated_wait = estimated_wait
+
+
+class TokenBucket:
+    """Bucket rempli en continu à `per_minute / 60` unités par seconde, plafonné à `per_minute`."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Secondes avant que `amount` soit disponible (0 si déjà disponible)."""
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class Ticket:
+    """Demande d'admission (une par appel API)."""
+
+    def __init__(self, seq: int, user: str, priority: int, est_in: int, est_out: int):
+        self.seq = seq
+        self.user = user
+        self.priority = priority
+        self.est_in = est_in
+        self.est_out = est_out
+        self.enqueued = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.usage = None
+
+
+class ClaudeScheduler:
+    """Admission control process-wide pour les appels Claude (sync et asyncio)."""
+
+    def __init__(self, rpm: int, itpm: int, otpm: int, queue_timeout: float = 120.0):
+        self.requests = TokenBucket(rpm)
+        self.input_tokens = TokenBucket(itpm)
+        self.output_tokens = TokenBucket(otpm)
+        self.queue_timeout = queue_timeout
+        self.blocked_until = 0.0
+
+        self._cond = threading.Condition()
+        self._waiting: Dict[int, Ticket] = {}
+        self._served: Dict[str, deque] = {}
+        self._seq = itertools.count()
+
+    # ---------- File d'attente ----------
+    def _refill(self, now: float):
+        for bucket in (self.requests, self.input_tokens, self.output_tokens):
+            bucket.refill(now)
+
+    def _served_last_minute(self, user: str, now: float) -> int:
+        served = self._served.get(user)
+        if not served:
+            return 0
+        while served and now - served[0] > 60:
+            served.popleft()
+        return len(served)
+
+    def _order(self, now: float):
+        """Tickets en attente dans l'ordre d'admission (priorité, équité par user, arrivée)."""
+        return sorted(self._waiting.values(),
+                      key=lambda t: (t.priority, self._served_last_minute(t.user, now), t.seq))
+
+    def _wait_for(self, ticket: Ticket, now: float) -> float:
+        return max(self.blocked_until - now,
+                   self.requests.wait_for(1),
+                   self.input_tokens.wait_for(ticket.est_in),
+                   self.output_tokens.wait_for(ticket.est_out))
+
+    def _missing_budget(self, tickets, now: float) -> float:
+        """Secondes de remplissage nécessaires pour servir tous ces tickets."""
+        need_req = len(tickets)
+        need_in = sum(t.est_in for t in tickets)
+        need_out = sum(t.est_out for t in tickets)
+        return max(self.blocked_until - now, 0.0,
+                   (need_req - self.requests.level) / self.requests.rate,
+                   (need_in - self.input_tokens.level) / self.input_tokens.rate,
+                   (need_out - self.output_tokens.level) / self.output_tokens.rate)
+
+    def estimated_wait(self, ticket: Ticket) -> float:
+        """Attente estimée : budget manquant pour ce ticket et tous ceux placés devant lui."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            ahead = []
+            for t in self._order(now):
+                ahead.append(t)
+                if t is ticket:
+                    break
+            return self._missing_budget(ahead, now)
+
+    def estimate_wait(self, est_in: int = 2000, est_out: int = 1000) -> float:
+        """Attente estimée pour une nouvelle requête interactive arrivant maintenant."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            ahead = [t for t in self._waiting.values() if t.priority == PRIORITY_INTERACTIVE]
+            return self._missing_budget(ahead + [Ticket(-1, "", PRIORITY_INTERACTIVE, est_in, est_out)], now)
+
+    def _try_admit(self, ticket: Ticket) -> float:
+        """Admet le ticket s'il est en tête et que le budget suffit ; sinon renvoie l'attente (s)."""
+        now = time.monotonic()
+        self._refill(now)
+        head = self._order(now)[0]
+        wait = self._wait_for(head, now)
+        if head is not ticket or wait > 0:
+            return max(wait, 0.05)
+
+        self.requests.level -= 1
+        self.input_tokens.level -= min(ticket.est_in, self.input_tokens.capacity)
+        self.output_tokens.level -= min(ticket.est_out, self.output_tokens.capacity)
+        self._served.setdefault(ticket.user, deque()).append(now)
+        del self._waiting[ticket.seq]
+        ticket.admitted_at = now
+        waited = now - ticket.enqueued
+        if waited > 0.5:
+            print(f"[Scheduler] admis après {waited:.1f}s d'attente (user={ticket.user}, "
+                  f"prio={'interactive' if ticket.priority == PRIORITY_INTERACTIVE else 'background'}, "
+                  f"{len(self._waiting)} en file)")
+        self._cond.notify_all()
+        return 0.0
+
+    def _new_ticket(self, est_in: int, est_out: int, user: Optional[str], priority: Optional[int]) -> Ticket:
+        ticket = Ticket(next(self._seq), user or current_user.get(),
+                        current_priority.get() if priority is None else priority, est_in, est_out)
+        with self._cond:
+            self._waiting[ticket.seq] = ticket
+        return ticket
+
+    def _abandon(self, ticket: Ticket):
+        with self._cond:
+            self._waiting.pop(ticket.seq, None)
+            self._cond.notify_all()
+
+    def _pause(self, ticket: Ticket, wait: float) -> float:
+        """Pause avant de retenter l'admission (≤ 1s, sans dépasser le timeout de file)."""
+        remaining = self.queue_timeout - (time.monotonic() - ticket.enqueued)
+        return max(min(wait, 1.0, remaining), 0.01)
+
+    def acquire(self, est_in: int, est_out: int, user: Optional[str] = None,
+                priority: Optional[int] = None, on_wait: Optional[Callable[[float], None]] = None) -> Ticket:
+        """Bloque jusqu'à l'admission (ou QueueTimeout). `on_wait(secondes)` est appelé si on attend."""
+        ticket = self._new_ticket(est_in, est_out, user, priority)
+        notified = False
+        while True:
+            with self._cond:
+                wait = self._try_admit(ticket)
+                if not wait:
+                    return ticket
+            if time.monotonic() - ticket.enqueued > self.queue_timeout:
+                estimate = self.estimated_wait(ticket)
+                self._abandon(ticket)
+                raise QueueTimeout(estimate)
+            if on_wait and not notified and wait > 1:
+                notified = True
+                on_wait(self.estimated_wait(ticket))
+            with self._cond:
+                self._cond.wait(timeout=self._pause(ticket, wait))
+
+    async def acquire_async(self, est_in: int, est_out: int, user: Optional[str] = None,
+                            priority: Optional[int] = None, on_wait=None) -> Ticket:
+        """Variante asyncio : même file, attente coopérative (asyncio.sleep)."""
+        ticket = self._new_ticket(est_in, est_out, user, priority)
+        notified = False
+        while True:
+            with self._cond:
+                wait = self._try_admit(ticket)
+                if not wait:
+                    return ticket
+            if time.monotonic() - ticket.enqueued > self.queue_timeout:
+                estimate = self.estimated_wait(ticket)
+                self._abandon(ticket)
+                raise QueueTimeout(estimate)
+            if on_wait and not notified and wait > 1:
+                notified = True
+                await on_wait(self.estimated_wait(ticket))
+            await asyncio.sleep(self._pause(ticket, wait))
+
+    @contextmanager
+    def admitted(self, est_in: int, est_out: int, priority: Optional[int] = None):
+        """
+        Appel simple sous admission (résumés, classification…) :
+            with scheduler.admitted(500, 200, PRIORITY_BACKGROUND) as ticket:
+                ticket.usage = claude.messages.create(...).usage
+        """
+        ticket = self.acquire(est_in, est_out, priority=priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, ticket.usage)
+
+    # ---------- Retour d'information ----------
+    def release(self, ticket: Ticket, usage=None):
+        """Corrige les buckets avec l'usage réel (les lectures de cache ne comptent pas dans l'ITPM)."""
+        if usage is None:
+            return
+        used_in = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        used_out = getattr(usage, "output_tokens", 0) or 0
+        with self._cond:
+            self.input_tokens.level += ticket.est_in - used_in
+            self.output_tokens.level += ticket.est_out - used_out
+            self._cond.notify_all()
+
+    def penalize(self, retry_after: float):
+        """429/529 : plus aucune admission avant `retry_after` secondes."""
+        with self._cond:
+            until = time.monotonic() + max(retry_after, 0.0)
+            if until > self.blocked_until:
+                self.blocked_until = until
+                print(f"[Scheduler] ⏸️ API limitée : admissions suspendues {retry_after:.1f}s")
+
+    def observe_headers(self, status_code: int, headers):
+        """Lit retry-after / anthropic-ratelimit-*-remaining d'une réponse HTTP."""
+        if status_code in (429, 529):
+            try:
+                retry_after = float(headers.get("retry-after", "") or 5)
+            except ValueError:
+                retry_after = 5.0
+            self.penalize(retry_after)
+        remaining = (
+            (self.requests, headers.get("anthropic-ratelimit-requests-remaining")),
+            (self.input_tokens, headers.get("anthropic-ratelimit-input-tokens-remaining")),
+            (self.output_tokens, headers.get("anthropic-ratelimit-output-tokens-remaining")),
+        )
+        with self._cond:
+            for bucket, value in remaining:
+                if value is None:
+                    continue
+                try:
+                    bucket.level = min(bucket.level, float(value))
+                except ValueError:
+                    pass
+
+    def http_hooks(self) -> dict:
+        """event_hooks httpx (client synchrone)."""
+        return {"response": [lambda response: self.observe_headers(response.status_code, response.headers)]}
+
+    def async_http_hooks(self) -> dict:
+        """event_hooks httpx (client asyncio : les hooks doivent être des coroutines)."""
+        async def hook(response):
+            self.observe_headers(response.status_code, response.headers)
+        return {"response": [hook]}
+
+    def queue_length(self) -> int:
+        return len(self._waiting)
+
+
+def format_wait(seconds: float) -> str:
+    """Attente lisible pour Slack (« ~40s », « ~2 min »)."""
+    if seconds < 90:
+        return f"~{max(int(seconds), 1)}s"
+    return f"~{round(seconds / 60)} min"
@@ -0,0 +1,145 @@
+# result_encoding.py
+"""
+Encodage compact des résultats BigQuery envoyés au modèle.
+
+Au lieu d'un JSON indenté (nom de colonne répété à chaque ligne, ponctuation), on envoie :
+- une ligne d'en-tête (colonnes séparées par des tabulations) puis une ligne TSV par row
+- des nombres formatés courts (entiers sans décimales, flottants arrondis)
+- un dictionnaire par colonne pour les chaînes répétées (ex: pays, type d'acquisition) :
+  `# dict pays: 0="FR" | 1="DE"`, valeurs entre guillemets (échappement JSON)
+- un marqueur explicite si le résultat est tronqué (lignes / colonnes conservées, ligne coupée)
+"""
+
+import datetime
+import decimal
+import json
+from typing import Any, Dict, List, Optional
+
+NULL = ""            # valeur vide = NULL (précisé dans l'en-tête)
+MAX_COLUMNS = 30
+# Place réservée au marqueur de troncature
+_FOOTER_RESERVE = 90
+
+
+def format_value(value: Any) -> str:
+    """Représentation texte courte d'une valeur BigQuery."""
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (float, decimal.Decimal)):
+        return format_number(float(value))
+    if isinstance(value, datetime.datetime):
+        text = value.isoformat(sep=" ")
+        return text[:-6] if text.endswith("+00:00") else text
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return _escape(json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":")))
+    return _escape(str(value))
+
+
+def format_number(value: float) -> str:
+    """Flottant court : entier si possible, 2 décimales au-delà de 1, 4 chiffres significatifs en dessous."""
+    if value != value:  # NaN
+        return "NaN"
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    if abs(value) >= 1:
+        text = f"{value:.2f}"
+    else:
+        text = f"{value:.4g}"
+        if "e" in text:
+            return text
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "")
+
+
+def _quote(text: str) -> str:
+    """Valeur de dictionnaire entre guillemets : ' | ' et '=' restent sans ambiguïté."""
+    return json.dumps(text, ensure_ascii=False)
+
+
+def _dictionaries(columns: List[str], rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+    """Dictionnaires des colonnes texte à forte répétition (uniquement si ça réduit la taille)."""
+    dictionaries = {}
+    if len(rows) < 4:
+        return dictionaries
+    for col in columns:
+        values = [row.get(col) for row in rows]
+        if not all(v is None or isinstance(v, str) for v in values):
+            continue
+        distinct = list(dict.fromkeys(v for v in values if v is not None))
+        if not distinct or len(distinct) > len(rows) // 2:
+            continue
+        codes = {v: str(i) for i, v in enumerate(distinct)}
+        plain = sum(len(v) for v in values if v is not None)
+        encoded = sum(len(codes[v]) for v in values if v is not None) \
+            + sum(len(_quote(v)) + len(c) + 4 for v, c in codes.items()) + len(col) + 8
+        if encoded < plain:
+            dictionaries[col] = codes
+    return dictionaries
+
+
+def encode_rows(rows: List[Dict[str, Any]], max_chars: int, total_rows: Optional[int] = None,
+                max_columns: int = MAX_COLUMNS) -> str:
+    """
+    Encode des lignes BigQuery en TSV compact, dans la limite de `max_chars`.
+    `total_rows` : nombre total de lignes du résultat s'il est connu (sinon len(rows)).
+    """
+    if not rows:
+        return "Aucun résultat (0 ligne)."
+
+    all_columns = list(dict.fromkeys(col for row in rows for col in row.keys()))
+    columns = all_columns[:max_columns]
+    total = max(total_rows or 0, len(rows))
+
+    dictionaries = _dictionaries(columns, rows)
+    lines = []
+    for row in rows:
+        cells = []
+        for col in columns:
+            value = row.get(col)
+            codes = dictionaries.get(col)
+            cells.append(codes[value] if codes is not None and value is not None else format_value(value))
+        lines.append("\t".join(cells))
+
+    header = "\t".join(columns)
+    budget = max_chars - _FOOTER_RESERVE - len(header) - 60
+    budget -= sum(len(col) + 8 + sum(len(_quote(v)) + len(c) + 4 for v, c in codes.items())
+                  for col, codes in dictionaries.items())
+    budget = max(budget, 0)
+
+    kept, used = 0, 0
+    for line in lines:
+        if used + len(line) + 1 > budget:
+            break
+        kept += 1
+        used += len(line) + 1
+    # Première ligne plus longue que le budget (texte géant) : coupée plutôt qu'envoyée entière
+    cut = kept == 0 and budget > 1
+    if cut:
+        lines[0] = lines[0][:budget - 2] + "…"
+        kept = 1
+
+    # Dictionnaires réduits aux codes effectivement présents dans les lignes conservées
+    dict_lines = []
+    for col, codes in dictionaries.items():
+        present = {row.get(col) for row in rows[:kept]}
+        entries = " | ".join(f"{c}={_quote(v)}" for v, c in codes.items() if v in present)
+        dict_lines.append(f"# dict {col}: {entries}")
+
+    out = [f"# {total} ligne(s), {len(all_columns)} colonne(s) — TSV, vide=NULL"
+           + (", colonnes codées via # dict" if dictionaries else "")]
+    out.extend(dict_lines)
+    out.append(header)
+    out.extend(lines[:kept])
+    if kept < total or len(columns) < len(all_columns) or cut:
+        out.append(f"# TRONQUÉ : {kept}/{total} lignes et {len(columns)}/{len(all_columns)} colonnes conservées"
+                   + (", 1re ligne coupée" if cut else ""))
+    return "\n".join(out)
@@ -0,0 +1,252 @@
+# schema_catalog.py
+"""
+Catalogue des schémas BigQuery (colonnes, types, descriptions, partitionnement, clustering).
+
+- Préchargé au démarrage pour les datasets de SCHEMA_CATALOG_DATASETS des deux projets :
+  une requête INFORMATION_SCHEMA par dataset au lieu d'une par describe_table / drill-down.
+- Persisté dans SCHEMA_CATALOG_PATH : un redémarrage repart du fichier, sans attendre BigQuery.
+- Rafraîchi en arrière-plan toutes les SCHEMA_CATALOG_REFRESH_MIN minutes.
+- Une table absente du catalogue (dataset non préchargé, table récente) est lue à la demande
+  puis gardée ; introuvable, elle n'est pas relue avant SCHEMA_CATALOG_MISS_TTL_MIN minutes.
+- Les ajouts à la demande sont écrits dans le fichier au plus une fois par SCHEMA_CATALOG_SAVE_DELAY_S.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from google.cloud import bigquery
+from bq_engine import ENGINE
+from config import (
+    bq_client,
+    bq_client_normalized,
+    BQ_DATASET_PROJECTS,
+    SCHEMA_CATALOG_ENABLED,
+    SCHEMA_CATALOG_DATASETS,
+    SCHEMA_CATALOG_PATH,
+    SCHEMA_CATALOG_REFRESH_MIN,
+    SCHEMA_CATALOG_MISS_TTL_MIN,
+    SCHEMA_CATALOG_SAVE_DELAY_S
+)
+
+_COLUMNS_SQL = """
+SELECT c.table_name, c.column_name, c.data_type, c.is_nullable,
+       c.is_partitioning_column, c.clustering_ordinal_position, p.description
+FROM `{project}.{dataset}.INFORMATION_SCHEMA.COLUMNS` c
+LEFT JOIN `{project}.{dataset}.INFORMATION_SCHEMA.COLUMN_FIELD_PATHS` p
+  ON p.table_name = c.table_name AND p.column_name = c.column_name AND p.field_path = c.column_name
+{where}
+ORDER BY c.table_name, c.ordinal_position
+"""
+
+
+def client_for_project(project_id: str):
+    """Client BigQuery du projet (pool partagé, cf. bq_engine.py), None si BigQuery n'est pas configuré."""
+    if not (bq_client or bq_client_normalized):
+        return None
+    try:
+        return ENGINE.client(project_id)
+    except Exception as e:
+        print(f"[Schema] ⚠️ client BigQuery indisponible pour {project_id} : {e}")
+        return None
+
+
+def resolve(table_name: str) -> Tuple[str, str, str]:
+    """'dataset.table' ou 'project.dataset.table' → (project, dataset, table)."""
+    parts = table_name.strip().strip("`").split(".")
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    if len(parts) == 2:
+        # Dataset sans projet : projet propriétaire (BQ_DATASET_PROJECTS), sinon projet principal
+        return BQ_DATASET_PROJECTS.get(parts[0]) or os.getenv("BIGQUERY_PROJECT_ID"), parts[0], parts[1]
+    raise ValueError("Format invalide. Utilise 'dataset.table' ou 'project.dataset.table'")
+
+
+def _tables_from_rows(project: str, dataset: str, rows) -> Dict[str, dict]:
+    """Lignes INFORMATION_SCHEMA → {project.dataset.table: entrée du catalogue}."""
+    tables: Dict[str, dict] = {}
+    clustering: Dict[str, list] = {}
+    for r in rows:
+        ref = f"{project}.{dataset}.{r.table_name}"
+        entry = tables.setdefault(ref, {"columns": [], "partition": None, "clustering": []})
+        entry["columns"].append({
+            "nom": r.column_name,
+            "type": r.data_type,
+            "nullable": (str(getattr(r, "is_nullable", "YES")).upper() == "YES"),
+            **({"description": r.description} if getattr(r, "description", None) else {})
+        })
+        if str(getattr(r, "is_partitioning_column", "NO")).upper() == "YES":
+            entry["partition"] = r.column_name
+        if getattr(r, "clustering_ordinal_position", None):
+            clustering.setdefault(ref, []).append((r.clustering_ordinal_position, r.column_name))
+    for ref, fields in clustering.items():
+        tables[ref]["clustering"] = [name for _, name in sorted(fields)]
+    return tables
+
+
+class SchemaCatalog:
+    """Schémas des tables, en mémoire + fichier JSON, rafraîchis en arrière-plan."""
+
+    def __init__(self, path: str, refresh_s: float, miss_ttl_s: float = 600, save_delay_s: float = 30):
+        self.path = path
+        self.refresh_s = refresh_s
+        self.miss_ttl_s = miss_ttl_s
+        self.save_delay_s = save_delay_s
+        self.refreshed_at = 0.0
+        self._tables: Dict[str, dict] = {}
+        self._misses: Dict[str, float] = {}  # ref → échéance (monotonic) des tables introuvables
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._save_timer: Optional[threading.Timer] = None
+
+    # ---------- Persistance ----------
+    def load(self) -> bool:
+        """Recharge le catalogue persisté (False si absent ou illisible)."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"[Schema] ⚠️ catalogue {self.path} illisible : {e}")
+            return False
+        with self._lock:
+            self._tables = data.get("tables", {})
+            self.refreshed_at = data.get("refreshed_at", 0.0)
+        print(f"[Schema] {len(self._tables)} tables rechargées depuis {self.path} "
+              f"(rafraîchi il y a {(time.time() - self.refreshed_at) / 60:.0f} min)")
+        return True
+
+    def save(self):
+        with self._lock:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+            data = {"refreshed_at": self.refreshed_at, "tables": dict(self._tables)}
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[Schema] ⚠️ écriture du catalogue impossible : {e}")
+
+    def _save_later(self):
+        """Écriture différée : les lectures à la demande d'une rafale partagent un seul save()."""
+        with self._lock:
+            if self._save_timer:
+                return
+            self._save_timer = threading.Timer(self.save_delay_s, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    # ---------- Lecture BigQuery ----------
+    def _datasets(self) -> List[Tuple[object, str, str]]:
+        """(client, project, dataset) à précharger."""
+        targets = []
+        for client in (bq_client, bq_client_normalized):
+            if not client:
+                continue
+            try:
+                available = [d.dataset_id for d in client.list_datasets()]
+            except Exception as e:
+                print(f"[Schema] ⚠️ datasets de {client.project} non listés : {e}")
+                continue
+            for dataset in available:
+                if not SCHEMA_CATALOG_DATASETS or dataset in SCHEMA_CATALOG_DATASETS \
+                        or f"{client.project}.{dataset}" in SCHEMA_CATALOG_DATASETS:
+                    targets.append((client, client.project, dataset))
+        return targets
+
+    def _fetch(self, client, project: str, dataset: str, table: Optional[str] = None) -> Dict[str, dict]:
+        from bq_guard import job_config
+
+        where = "WHERE c.table_name = @table" if table else ""
+        params = [bigquery.ScalarQueryParameter("table", "STRING", table)] if table else []
+        sql = _COLUMNS_SQL.format(project=project, dataset=dataset, where=where)
+        config = job_config(query_parameters=params, labels={"kind": "describe" if table else "catalog"})
+        rows = client.query(sql, job_config=config).result(timeout=60)
+        return _tables_from_rows(project, dataset, rows)
+
+    def refresh(self):
+        """Relit tous les datasets ciblés (une requête par dataset) puis persiste."""
+        started = time.time()
+        count = 0
+        for client, project, dataset in self._datasets():
+            try:
+                tables = self._fetch(client, project, dataset)
+            except Exception as e:
+                print(f"[Schema] ⚠️ {project}.{dataset} non rafraîchi : {str(e)[:150]}")
+                continue
+            prefix = f"{project}.{dataset}."
+            with self._lock:
+                # Remplacement par dataset : les tables supprimées disparaissent du catalogue
+                for ref in [r for r in self._tables if r.startswith(prefix)]:
+                    del self._tables[ref]
+                self._tables.update(tables)
+            count += len(tables)
+        with self._lock:
+            self.refreshed_at = time.time()
+            self._misses.clear()
+        self.save()
+        print(f"[Schema] ✅ catalogue rafraîchi : {count} tables en {time.time() - started:.1f}s")
+
+    def _refresh_loop(self):
+        # Fichier récent : premier rafraîchissement à l'échéance, sinon tout de suite
+        delay = max(self.refresh_s - (time.time() - self.refreshed_at), 0) if self._tables else 0
+        while True:
+            time.sleep(delay)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[Schema] ⚠️ rafraîchissement en échec : {e}")
+            delay = self.refresh_s
+
+    def start(self):
+        """Au démarrage : rechargement du fichier, puis préchargement / rafraîchissement en arrière-plan."""
+        if not SCHEMA_CATALOG_ENABLED or self._thread:
+            return
+        self.load()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True, name="SchemaCatalog")
+        self._thread.start()
+
+    # ---------- Consultation ----------
+    def get(self, table_name: str) -> Optional[dict]:
+        """Entrée {columns, partition, clustering} d'une table (lue à la demande si absente)."""
+        project, dataset, table = resolve(table_name)
+        ref = f"{project}.{dataset}.{table}"
+        with self._lock:
+            entry = self._tables.get(ref)
+            missed = self._misses.get(ref, 0) > time.monotonic()
+        if entry is not None or missed:
+            return entry
+
+        client = client_for_project(project)
+        if not client:
+            return None
+        entry = self._fetch(client, project, dataset, table).get(ref)
+        if not SCHEMA_CATALOG_ENABLED:
+            return entry
+        with self._lock:
+            if entry is None:
+                self._misses[ref] = time.monotonic() + self.miss_ttl_s
+            else:
+                self._tables[ref] = entry
+                self._misses.pop(ref, None)
+        if entry is not None:
+            self._save_later()
+        return entry
+
+    def columns(self, table_name: str) -> List[Tuple[str, str]]:
+        """[(nom, type)] des colonnes d'une table ([] si introuvable)."""
+        entry = self.get(table_name)
+        return [(c["nom"], c["type"]) for c in entry["columns"]] if entry else []
+
+    def __len__(self):
+        return len(self._tables)
+
+
+SCHEMA_CATALOG = SchemaCatalog(SCHEMA_CATALOG_PATH, SCHEMA_CATALOG_REFRESH_MIN * 60,
+                               miss_ttl_s=SCHEMA_CATALOG_MISS_TTL_MIN * 60,
+                               save_delay_s=SCHEMA_CATALOG_SAVE_DELAY_S)
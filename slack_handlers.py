@@ -4,10 +4,12 @@
 import re
 from collections import OrderedDict
 from typing import Optional
-from config import app
+from config import app, STREAMING_ENABLED
 from claude_client import ask_claude, format_sql_queries
-from thread_memory import get_last_queries
+from bq_report import build_report, parse_command as parse_report_command
+from thread_memory import get_last_queries, set_thread_channel
 from notion_export_handlers import create_message_blocks_with_notion_button
+from slack_streaming import StreamingMessage
 
 
 # ---------------------------------------
@@ -77,92 +79,133 @@ def strip_own_mention(text: str, bot_user_id: Optional[str]) -> str:
     return re.sub(rf"<@{bot_user_id}>\s*", "", text or "").strip()
 
 
+def start_stream(client, channel: str, thread_ts: str, prefix: str) -> Optional[StreamingMessage]:
+    """Poste le placeholder de streaming (None si le streaming est désactivé ou indisponible)."""
+    if not STREAMING_ENABLED:
+        return None
+    stream = StreamingMessage(client, channel, thread_ts, prefix=prefix)
+    return stream if stream.start() else None
+
+
+def send_answer(client, channel: str, thread_ts: str, text: str, logger,
+                stream: Optional[StreamingMessage] = None):
+    """
+    Envoie la réponse finale avec les boutons Notion/Stop.
+    Si un placeholder de streaming existe, il est remplacé (chat_update) au lieu de poster un nouveau message.
+    """
+    # Créer les blocks avec les boutons Notion et Stop
+    blocks = create_message_blocks_with_notion_button(text, thread_ts, channel)
+
+    # Si le texte est trop long pour les blocks, envoyer sans blocks
+    if blocks is None:
+        logger.warning(f"⚠️ Message trop long ({len(text)} chars), envoi sans boutons")
+
+    if stream and stream.finish(text, blocks):
+        return
+
+    if blocks is None:
+        client.chat_postMessage(
+            channel=channel,
+            thread_ts=thread_ts,
+            text=text
+        )
+    else:
+        client.chat_postMessage(
+            channel=channel,
+            thread_ts=thread_ts,
+            text=text,  # Fallback text
+            blocks=blocks
+        )
+
+
 # ---------------------------------------
-# Handlers Slack (enregistrés par setup_handlers)
+# Réactions (partagé avec async_app.py)
 # ---------------------------------------
-def setup_handlers(context: str):
-    """Configure les handlers Slack avec le contexte chargé."""
-    global CURRENT_CONTEXT
-    CURRENT_CONTEXT = context  # Initialiser le contexte
+def handle_reaction_added(body, event, client, logger):
+    """Gère les réactions ajoutées aux messages (❌ sur un message du bot → oubli du thread)."""
+    try:
+        # LOG DEBUG : voir tous les events qui arrivent
+        logger.info(f"🔔 EVENT reaction_added reçu : {event}")
 
-    @app.event("reaction_added")
-    def on_reaction_added(body, event, client, logger):
-        """Gère les réactions ajoutées aux messages."""
-        try:
-            # LOG DEBUG : voir tous les events qui arrivent
-            logger.info(f"🔔 EVENT reaction_added reçu : {event}")
+        reaction = event.get("reaction", "")
+        user = event.get("user", "")
+        item = event.get("item", {})
+        channel = item.get("channel", "")
+        message_ts = item.get("ts", "")
 
-            reaction = event.get("reaction", "")
-            user = event.get("user", "")
-            item = event.get("item", {})
-            channel = item.get("channel", "")
-            message_ts = item.get("ts", "")
+        logger.info(f"🔍 Réaction détectée : '{reaction}' par user {user} sur message {message_ts[:10] if message_ts else 'NO_TS'}...")
 
-            logger.info(f"🔍 Réaction détectée : '{reaction}' par user {user} sur message {message_ts[:10] if message_ts else 'NO_TS'}...")
+        # Vérifier si c'est une croix rouge (❌)
+        if reaction not in ["x", "X", "❌"]:
+            logger.info(f"⏭️ Réaction '{reaction}' ignorée (pas une croix rouge)")
+            return
 
-            # Vérifier si c'est une croix rouge (❌)
-            if reaction not in ["x", "X", "❌"]:
-                logger.info(f"⏭️ Réaction '{reaction}' ignorée (pas une croix rouge)")
-                return
+        logger.info(f"❌ Réaction croix rouge détectée sur message {message_ts[:10]}...")
 
-            logger.info(f"❌ Réaction croix rouge détectée sur message {message_ts[:10]}...")
+        # Récupérer le message pour vérifier si c'est un message de Franck
+        try:
+            result = client.conversations_history(
+                channel=channel,
+                latest=message_ts,
+                inclusive=True,
+                limit=1
+            )
+
+            if not result.get("messages"):
+                return
 
-            # Récupérer le message pour vérifier si c'est un message de Franck
-            try:
-                result = client.conversations_history(
-                    channel=channel,
-                    latest=message_ts,
-                    inclusive=True,
-                    limit=1
-                )
+            message = result["messages"][0]
+            message_user = message.get("user", "")
+            bot_user_id = get_bot_user_id()
 
-                if not result.get("messages"):
-                    return
+            # Vérifier que c'est bien un message de Franck
+            if message_user != bot_user_id:
+                logger.info(f"⏭️ Message pas de Franck, ignoré")
+                return
 
-                message = result["messages"][0]
-                message_user = message.get("user", "")
-                bot_user_id = get_bot_user_id()
+            # Récupérer le thread_ts
+            thread_ts = message.get("thread_ts", message_ts)
 
-                # Vérifier que c'est bien un message de Franck
-                if message_user != bot_user_id:
-                    logger.info(f"⏭️ Message pas de Franck, ignoré")
-                    return
+            # Supprimer le thread des threads actifs
+            if thread_ts in ACTIVE_THREADS:
+                ACTIVE_THREADS.remove(thread_ts)
+                logger.info(f"🗑️ Thread {thread_ts[:10]}... supprimé des threads actifs")
 
-                # Récupérer le thread_ts
-                thread_ts = message.get("thread_ts", message_ts)
+            # Interrompre la requête en cours puis nettoyer la mémoire du thread (historique, résumé, requêtes)
+            from bq_jobs import JOB_MANAGER
+            from thread_memory import forget_thread
+            JOB_MANAGER.cancel_thread(thread_ts, "thread oublié par l'utilisateur")
+            forget_thread(thread_ts)
+            logger.info(f"🧹 Mémoire du thread {thread_ts[:10]}... effacée")
 
-                # Supprimer le thread des threads actifs
-                if thread_ts in ACTIVE_THREADS:
-                    ACTIVE_THREADS.remove(thread_ts)
-                    logger.info(f"🗑️ Thread {thread_ts[:10]}... supprimé des threads actifs")
+            # Ajouter une réaction de confirmation (poubelle)
+            try:
+                client.reactions_add(
+                    channel=channel,
+                    timestamp=message_ts,
+                    name="wastebasket"
+                )
+                logger.info(f"✅ Thread oublié avec succès")
+            except Exception as reaction_error:
+                logger.warning(f"⚠️ Impossible d'ajouter la réaction de confirmation : {reaction_error}")
 
-                # Nettoyer la mémoire du thread
-                from thread_memory import THREAD_MEMORY, LAST_QUERIES
-                if thread_ts in THREAD_MEMORY:
-                    del THREAD_MEMORY[thread_ts]
-                    logger.info(f"🧹 Mémoire du thread {thread_ts[:10]}... effacée")
+        except Exception as e:
+            logger.warning(f"⚠️ Erreur lors de la récupération du message : {e}")
+            return
 
-                if thread_ts in LAST_QUERIES:
-                    del LAST_QUERIES[thread_ts]
-                    logger.info(f"🧹 Requêtes du thread {thread_ts[:10]}... effacées")
+    except Exception as e:
+        logger.exception(f"❌ Erreur on_reaction_added: {e}")
 
-                # Ajouter une réaction de confirmation (poubelle)
-                try:
-                    client.reactions_add(
-                        channel=channel,
-                        timestamp=message_ts,
-                        name="wastebasket"
-                    )
-                    logger.info(f"✅ Thread oublié avec succès")
-                except Exception as reaction_error:
-                    logger.warning(f"⚠️ Impossible d'ajouter la réaction de confirmation : {reaction_error}")
 
-            except Exception as e:
-                logger.warning(f"⚠️ Erreur lors de la récupération du message : {e}")
-                return
+# ---------------------------------------
+# Handlers Slack (enregistrés par setup_handlers)
+# ---------------------------------------
+def setup_handlers(context: str):
+    """Configure les handlers Slack avec le contexte chargé."""
+    global CURRENT_CONTEXT
+    CURRENT_CONTEXT = context  # Initialiser le contexte
 
-        except Exception as e:
-            logger.exception(f"❌ Erreur on_reaction_added: {e}")
+    app.event("reaction_added")(handle_reaction_added)
 
     @app.event("app_mention")
     def on_app_mention(body, event, client, logger):
@@ -173,6 +216,7 @@ def setup_handlers(context: str):
             logger.info(f"⏭️ Événement {event_id[:12] if event_id else 'NO_ID'}… déjà traité, ignoré")
             return
 
+        stream = None
         try:
             if event.get("subtype"):
                 seen_events.mark_seen(event_id)  # Marquer quand même pour éviter les retries
@@ -241,7 +285,18 @@ def setup_handlers(context: str):
                 seen_events.mark_seen(event_id)  # Marquer comme traité
                 return
 
-            answer = ask_claude(prompt, thread_ts, CURRENT_CONTEXT)
+            # Commande rapport BigQuery : "bq report [jours]"
+            report_days = parse_report_command(prompt)
+            if report_days is not None:
+                logger.info(f"📊 Commande bq report ({report_days} j) reçue dans #{channel}")
+                client.chat_postMessage(channel=channel, thread_ts=thread_ts, text=build_report(report_days))
+                seen_events.mark_seen(event_id)
+                return
+
+            # Placeholder immédiat, mis à jour au fil du streaming
+            stream = start_stream(client, channel, thread_ts, "🤖")
+            set_thread_channel(thread_ts, channel)
+            answer = ask_claude(prompt, thread_ts, CURRENT_CONTEXT, stream=stream, user=event.get("user"))
 
             # Ajouter les requêtes SQL seulement si demandé
             if any(k in prompt.lower() for k in ["sql", "requête", "requete", "query", "liste", "export", "j'aimerais avoir", "notion", "détail", "detail"]):
@@ -249,24 +304,7 @@ def setup_handlers(context: str):
                 if queries:
                     answer += format_sql_queries(queries)
 
-            # Créer les blocks avec les boutons Notion et Stop
-            blocks = create_message_blocks_with_notion_button(f"🤖 {answer}", thread_ts, channel)
-
-            # Si le texte est trop long pour les blocks, envoyer sans blocks
-            if blocks is None:
-                logger.warning(f"⚠️ Message trop long ({len(answer)} chars), envoi sans boutons")
-                client.chat_postMessage(
-                    channel=channel,
-                    thread_ts=thread_ts,
-                    text=f"🤖 {answer}"
-                )
-            else:
-                client.chat_postMessage(
-                    channel=channel,
-                    thread_ts=thread_ts,
-                    text=f"🤖 {answer}",  # Fallback text
-                    blocks=blocks
-                )
+            send_answer(client, channel, thread_ts, f"🤖 {answer}", logger, stream)
             ACTIVE_THREADS.add(thread_ts)
             logger.info("✅ Réponse envoyée (thread ajouté aux actifs)")
 
@@ -277,6 +315,8 @@ def setup_handlers(context: str):
             logger.exception(f"❌ Erreur on_app_mention (event={event_id[:12] if event_id else 'NO_ID'}): {e}")
             # NE PAS marquer comme vu en cas d'erreur, pour permettre retry
             try:
+                if stream and stream.finish(f"⚠️ Oups, j'ai eu un souci : `{str(e)[:200]}`"):
+                    return
                 client.chat_postMessage(
                     channel=event["channel"],
                     thread_ts=event.get("thread_ts", event["ts"]),
@@ -287,6 +327,7 @@ def setup_handlers(context: str):
 
     @app.event("message")
     def on_message(event, client, logger):
+        stream = None
         try:
             logger.info(f"📨 Message reçu : '{event.get('text', '')[:120]}…' channel={event.get('channel')} thread={event.get('thread_ts', 'NO_THREAD')}")
             if event.get("subtype"):
@@ -322,35 +363,22 @@ def setup_handlers(context: str):
             except Exception as reaction_error:
                 logger.warning(f"⚠️ Impossible d'ajouter la réaction : {reaction_error}")
 
-            answer = ask_claude(text, thread_ts, CURRENT_CONTEXT)
+            stream = start_stream(client, channel, thread_ts, "💬")
+            set_thread_channel(thread_ts, channel)
+            answer = ask_claude(text, thread_ts, CURRENT_CONTEXT, stream=stream, user=user)
 
             if any(k in text.lower() for k in ["sql", "requête", "requete", "query"]):
                 queries = get_last_queries(thread_ts)
                 if queries:
                     answer += format_sql_queries(queries)
 
-            # Créer les blocks avec les boutons Notion et Stop
-            blocks = create_message_blocks_with_notion_button(f"💬 {answer}", thread_ts, channel)
-
-            # Si le texte est trop long pour les blocks, envoyer sans blocks
-            if blocks is None:
-                logger.warning(f"⚠️ Message trop long ({len(answer)} chars), envoi sans boutons")
-                client.chat_postMessage(
-                    channel=channel,
-                    thread_ts=thread_ts,
-                    text=f"💬 {answer}"
-                )
-            else:
-                client.chat_postMessage(
-                    channel=channel,
-                    thread_ts=thread_ts,
-                    text=f"💬 {answer}",  # Fallback text
-                    blocks=blocks
-                )
+            send_answer(client, channel, thread_ts, f"💬 {answer}", logger, stream)
             logger.info("✅ Réponse envoyée dans le thread")
         except Exception as e:
             logger.exception(f"❌ Erreur on_message: {e}")
             try:
+                if stream and stream.finish(f"⚠️ Erreur : `{str(e)[:200]}`"):
+                    return
                 client.chat_postMessage(
                     channel=event.get("channel"),
                     thread_ts=event.get("thread_ts"),
@@ -0,0 +1,258 @@
+# slack_streaming.py
+"""Affichage progressif des réponses de Claude dans Slack (placeholder + chat_update throttlé)."""
+
+import re
+import time
+import threading
+from typing import Any, Dict, List, Optional
+from config import STREAM_UPDATE_INTERVAL_S
+from rate_limiter import format_wait
+
+# Slack accepte ~40k caractères dans `text`, mais au-delà de ~4k le message est replié.
+# Pendant le streaming on n'affiche que la fin du texte pour garder un aperçu lisible.
+MAX_STREAM_DISPLAY_CHARS = 3500
+
+PLACEHOLDER_TEXT = "_Je réfléchis…_"
+
+
+def _short_table_name(query: str) -> Optional[str]:
+    """Retourne le nom court de la table principale d'une requête (ex: 'box_sales')."""
+    match = re.search(r"\bFROM\s+`?([a-zA-Z0-9_.\-]+)`?", query or "", re.IGNORECASE)
+    if not match:
+        return None
+    return match.group(1).split(".")[-1]
+
+
+def describe_tool_stage(tool_name: str, tool_input: Optional[Dict[str, Any]] = None) -> str:
+    """Génère le marqueur d'étape affiché pendant l'exécution d'un tool."""
+    tool_input = tool_input or {}
+
+    if tool_name in ("query_bigquery", "query_ops", "query_crm", "query_reviews"):
+        table = _short_table_name(tool_input.get("query", ""))
+        return f"🔎 Requête sur `{table}`…" if table else "🔎 Requête BigQuery…"
+    if tool_name == "export_bigquery":
+        return "📦 Export du résultat complet en fichier…"
+    if tool_name == "describe_table":
+        tables = tool_input.get("table_names") or [tool_input.get("table_name") or ""]
+        table = ", ".join(t.split(".")[-1] for t in tables if t)
+        return f"📋 Lecture du schéma `{table}`…" if table else "📋 Lecture du schéma…"
+    if tool_name in ("search_notion", "read_notion_page"):
+        return "📖 Lecture de Notion…"
+    if tool_name in ("save_analysis_to_notion", "append_table_to_notion_page", "append_to_notion_context"):
+        return "📝 Écriture dans Notion…"
+    return f"🔧 {tool_name}…"
+
+
+class StreamingMessage:
+    """
+    Message Slack mis à jour au fil de l'eau pendant qu'on attend Claude.
+
+    - `start()` poste immédiatement un placeholder dans le thread
+    - `on_text()` / `on_tool()` accumulent le texte streamé et les étapes (tools)
+    - `on_queue()` affiche l'attente estimée quand l'appel Claude est en file (rate limits)
+    - `on_progress()` affiche l'avancement du job BigQuery en cours (cf. bq_jobs)
+    - les `chat_update` sont throttlés (au plus un toutes les STREAM_UPDATE_INTERVAL_S secondes)
+    - `finish()` remplace le placeholder par la réponse finale (avec les blocks/boutons)
+    """
+
+    def __init__(self, client, channel: str, thread_ts: str, prefix: str = "🤖",
+                 min_interval: float = STREAM_UPDATE_INTERVAL_S):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.ts: Optional[str] = None
+
+        self._text = ""
+        self._stages: List[str] = []
+        self._queue_note: Optional[str] = None
+        self._progress_note: Optional[str] = None
+        self._last_rendered = ""
+        self._last_update = 0.0
+        self._started_at = 0.0
+        self._first_token_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    # ---------- Cycle de vie ----------
+    def start(self) -> bool:
+        """Poste le placeholder. Retourne False si Slack refuse (on retombera sur un post classique)."""
+        self._started_at = time.time()
+        try:
+            resp = self.client.chat_postMessage(
+                channel=self.channel,
+                thread_ts=self.thread_ts,
+                text=f"{self.prefix} {PLACEHOLDER_TEXT}"
+            )
+            self.ts = resp.get("ts")
+            self._last_update = time.time()
+        except Exception as e:
+            print(f"[Stream] ⚠️ Impossible de poster le placeholder : {e}")
+            self.ts = None
+        return self.ts is not None
+
+    def on_turn_start(self):
+        """Nouveau tour du modèle : on repart d'un texte vide (les étapes restent affichées)."""
+        with self._lock:
+            self._text = ""
+            self._queue_note = None
+            self._progress_note = None
+
+    def on_queue(self, wait_s: float):
+        """L'appel attend son tour (budget API épuisé) : on affiche l'attente estimée."""
+        with self._lock:
+            self._queue_note = f"⏳ En file d'attente ({format_wait(wait_s)})…"
+        self._flush(force=True)
+
+    def on_progress(self, note: str):
+        """Avancement d'un job BigQuery (état, étapes, octets traités) : mise à jour throttlée."""
+        with self._lock:
+            self._progress_note = note
+        self._flush()
+
+    def on_text(self, delta: str):
+        """Ajoute un morceau de texte streamé."""
+        if not delta:
+            return
+        with self._lock:
+            self._mark_first_token()
+            self._text += delta
+        self._flush()
+
+    def on_tool(self, tool_name: str, tool_input: Optional[Dict[str, Any]] = None):
+        """Affiche un marqueur d'étape pour un tool (mise à jour forcée)."""
+        with self._lock:
+            self._stages.append(describe_tool_stage(tool_name, tool_input))
+            self._text = ""
+            self._progress_note = None
+        self._flush(force=True)
+
+    def finish(self, text: str, blocks: Optional[List[Dict[str, Any]]] = None) -> bool:
+        """Remplace le placeholder par la réponse finale. Retourne False si l'update a échoué."""
+        if not self.ts:
+            return False
+        try:
+            kwargs = {"channel": self.channel, "ts": self.ts, "text": text}
+            if blocks is not None:
+                kwargs["blocks"] = blocks
+            self.client.chat_update(**kwargs)
+            print(f"[Stream] réponse finale après {time.time() - self._started_at:.2f}s")
+            return True
+        except Exception as e:
+            print(f"[Stream] ⚠️ chat_update final échoué : {e}")
+            return False
+
+    # ---------- Rendu ----------
+    def _render(self) -> str:
+        lines = []
+        if self._stages:
+            lines.append("\n".join(f"_{stage}_" for stage in self._stages[-5:]))
+        body = self._text.strip()
+        if len(body) > MAX_STREAM_DISPLAY_CHARS:
+            body = "…" + body[-MAX_STREAM_DISPLAY_CHARS:]
+        if body:
+            lines.append(body + " ▍")
+        elif self._progress_note:
+            lines.append(self._progress_note)
+        elif self._queue_note:
+            lines.append(self._queue_note)
+        elif not self._stages:
+            lines.append(PLACEHOLDER_TEXT)
+        return f"{self.prefix} " + "\n\n".join(lines)
+
+    def _next_render(self, force: bool = False) -> Optional[str]:
+        """Texte à pousser maintenant (None si throttlé ou inchangé)."""
+        if not self.ts:
+            return None
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_update < self.min_interval:
+                return None
+            rendered = self._render()
+            if rendered == self._last_rendered:
+                return None
+            self._last_update = now
+            self._last_rendered = rendered
+        return rendered
+
+    def _mark_first_token(self):
+        if self._first_token_at is None:
+            self._first_token_at = time.time()
+            print(f"[Stream] premier token après {self._first_token_at - self._started_at:.2f}s")
+
+    def _flush(self, force: bool = False):
+        rendered = self._next_render(force)
+        if rendered is None:
+            return
+        try:
+            self.client.chat_update(channel=self.channel, ts=self.ts, text=rendered)
+        except Exception as e:
+            # Rate limit Slack ou message supprimé : on ne casse pas la génération
+            print(f"[Stream] ⚠️ chat_update ignoré : {e}")
+
+
+class AsyncStreamingMessage(StreamingMessage):
+    """Variante asyncio de StreamingMessage (AsyncWebClient), mêmes règles de rendu et de throttle."""
+
+    async def start(self) -> bool:
+        self._started_at = time.time()
+        try:
+            resp = await self.client.chat_postMessage(
+                channel=self.channel,
+                thread_ts=self.thread_ts,
+                text=f"{self.prefix} {PLACEHOLDER_TEXT}"
+            )
+            self.ts = resp.get("ts")
+            self._last_update = time.time()
+        except Exception as e:
+            print(f"[Stream] ⚠️ Impossible de poster le placeholder : {e}")
+            self.ts = None
+        return self.ts is not None
+
+    async def on_text(self, delta: str):
+        if not delta:
+            return
+        with self._lock:
+            self._mark_first_token()
+            self._text += delta
+        await self._flush()
+
+    async def on_queue(self, wait_s: float):
+        with self._lock:
+            self._queue_note = f"⏳ En file d'attente ({format_wait(wait_s)})…"
+        await self._flush(force=True)
+
+    async def on_progress(self, note: str):
+        with self._lock:
+            self._progress_note = note
+        await self._flush()
+
+    async def on_tool(self, tool_name: str, tool_input: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            self._stages.append(describe_tool_stage(tool_name, tool_input))
+            self._text = ""
+            self._progress_note = None
+        await self._flush(force=True)
+
+    async def finish(self, text: str, blocks: Optional[List[Dict[str, Any]]] = None) -> bool:
+        if not self.ts:
+            return False
+        try:
+            kwargs = {"channel": self.channel, "ts": self.ts, "text": text}
+            if blocks is not None:
+                kwargs["blocks"] = blocks
+            await self.client.chat_update(**kwargs)
+            print(f"[Stream] réponse finale après {time.time() - self._started_at:.2f}s")
+            return True
+        except Exception as e:
+            print(f"[Stream] ⚠️ chat_update final échoué : {e}")
+            return False
+
+    async def _flush(self, force: bool = False):
+        rendered = self._next_render(force)
+        if rendered is None:
+            return
+        try:
+            await self.client.chat_update(channel=self.channel, ts=self.ts, text=rendered)
+        except Exception as e:
+            print(f"[Stream] ⚠️ chat_update ignoré : {e}")
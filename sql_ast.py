@@ -0,0 +1,465 @@
+# sql_ast.py
+"""
+Réécritures SQL sur l'arbre syntaxique (sqlglot, dialecte BigQuery).
+
+Chaque requête est analysée une seule fois (cache LRU par texte SQL) ; toutes les
+réécritures du bot partent de cet arbre au lieu de regex sur la chaîne :
+- LIMIT automatique (seulement sur la requête externe, UNION et WITH compris)
+- période de date : détection et substitution (comparaisons MoM / YoY / QoQ), y compris
+  dans les CTE
+- dimension ajoutée au SELECT / GROUP BY (drill-downs), qualifiée par l'alias de la table
+  principale en cas de JOIN
+- repli des comparaisons en une requête, GROUPING SETS des drill-downs
+- tables qualifiées par leur projet (routage multi-projets, cf. bq_engine.route)
+
+L'arbre en cache est partagé : une réécriture travaille toujours sur une copie.
+Une requête que sqlglot ne sait pas lire n'est pas réécrite (None) plutôt que devinée.
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+DIALECT = "bigquery"
+NO_LIMIT_HINT = "/* no_limit */"
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+# ---------------------------------------
+# Analyse
+# ---------------------------------------
+@lru_cache(maxsize=256)
+def _parse(sql: str) -> Optional[exp.Expression]:
+    try:
+        return sqlglot.parse_one(sql, dialect=DIALECT)
+    except (SqlglotError, ValueError) as e:
+        print(f"[SQL-AST] ⚠️ requête non analysable : {str(e).splitlines()[0][:120]}")
+        return None
+
+
+def parse(sql: str) -> Optional[exp.Expression]:
+    """Arbre de la requête (partagé : ne pas le modifier), ou None si le SQL n'est pas analysable."""
+    return _parse((sql or "").strip().rstrip(";").strip())
+
+
+def to_sql(tree: exp.Expression) -> str:
+    return tree.sql(dialect=DIALECT)
+
+
+def _outer_select(tree: Optional[exp.Expression]) -> Optional[exp.Select]:
+    return tree if isinstance(tree, exp.Select) else None
+
+
+def _table_ref(table: exp.Table) -> str:
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+
+def _cte_names(tree: exp.Expression) -> set:
+    return {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+
+
+def table_refs(sql: str) -> Optional[List[str]]:
+    """Tables physiques lues par la requête (CTE exclues), telles qu'écrites ; None si non analysable."""
+    tree = parse(sql)
+    if tree is None:
+        return None
+    ctes = _cte_names(tree)
+    refs = []
+    for table in tree.find_all(exp.Table):
+        if not table.db and table.name.lower() in ctes:
+            continue
+        ref = _table_ref(table)
+        if ref and ref not in refs:
+            refs.append(ref)
+    return refs
+
+
+def table_parts(sql: str) -> Optional[List[Tuple[str, str, str]]]:
+    """(projet, dataset, table) des tables physiques lues, projet '' si non qualifié ; None si non analysable."""
+    tree = parse(sql)
+    if tree is None:
+        return None
+    parts = []
+    for table in tree.find_all(exp.Table):
+        if not table.db:
+            continue  # CTE ou table sans dataset
+        part = (table.catalog, table.db, table.name)
+        if part not in parts:
+            parts.append(part)
+    return parts
+
+
+def qualify_tables(sql: str, project_of) -> Optional[str]:
+    """
+    Tables 'dataset.table' préfixées du projet `project_of(dataset)` (inchangées si None).
+    Retourne le SQL d'origine si rien ne change, None si la requête n'est pas analysable.
+    """
+    tree = parse(sql)
+    if tree is None:
+        return None
+    tree = tree.copy()
+    changed = False
+    for table in tree.find_all(exp.Table):
+        if table.db and not table.catalog and not table.db.lower().startswith("region-"):
+            project = project_of(table.db)
+            if project:
+                table.set("catalog", exp.to_identifier(project))
+                changed = True
+    return to_sql(tree) if changed else sql
+
+
+def has_aggregation(sql: str) -> Optional[bool]:
+    """La requête agrège-t-elle (COUNT, SUM, COUNTIF…) ? None si non analysable."""
+    tree = parse(sql)
+    return None if tree is None else tree.find(exp.AggFunc) is not None
+
+
+def _source_select(select: exp.Select, ctes: dict, depth: int = 0) -> Tuple[Optional[exp.Select], Optional[exp.Table]]:
+    """Descend FROM → CTE / sous-requête jusqu'à la table physique principale."""
+    source = select.args.get("from_")
+    source = source.this if source else None
+    if depth > 10 or source is None:
+        return None, None
+    if isinstance(source, exp.Subquery) and isinstance(source.this, exp.Select):
+        return _source_select(source.this, ctes, depth + 1)
+    if isinstance(source, exp.Table):
+        cte = ctes.get(source.name.lower()) if not source.db else None
+        if isinstance(cte, exp.Select):
+            return _source_select(cte, ctes, depth + 1)
+        return select, source
+    return None, None
+
+
+def main_table(sql: str) -> Optional[str]:
+    """Table principale ('project.dataset.table' ou 'dataset.table'), en traversant CTE et sous-requêtes."""
+    select = _outer_select(parse(sql))
+    if select is None:
+        return None
+    ctes = {cte.alias_or_name.lower(): cte.this for cte in select.find_all(exp.CTE)}
+    _, table = _source_select(select, ctes)
+    return _table_ref(table) if table is not None and table.db else None
+
+
+def main_alias(sql: str) -> Optional[str]:
+    """Alias de la source du FROM externe (None sans alias explicite)."""
+    select = _outer_select(parse(sql))
+    source = select.args.get("from_") if select else None
+    return (source.this.alias or None) if source else None
+
+
+def has_joins(sql: str) -> bool:
+    select = _outer_select(parse(sql))
+    return bool(select and select.args.get("joins"))
+
+
+def _dimension_column(select: exp.Select, dimension: str) -> exp.Column:
+    """Colonne de dimension, qualifiée par la source principale quand des JOINs la rendraient ambiguë."""
+    source = select.args.get("from_")
+    if select.args.get("joins") and source:
+        return exp.column(dimension, table=source.this.alias_or_name)
+    return exp.column(dimension)
+
+
+# ---------------------------------------
+# LIMIT
+# ---------------------------------------
+def enforce_limit(sql: str, limit: int) -> str:
+    """Ajoute `LIMIT n` à la requête externe si elle n'en a pas (le texte d'origine est conservé)."""
+    if NO_LIMIT_HINT in sql.lower():
+        return sql
+    tree = parse(sql)
+    if tree is None:
+        q_low = sql.strip().lower()
+        needs_limit = q_low.startswith(("select", "with")) and " limit " not in q_low
+    else:
+        needs_limit = isinstance(tree, exp.Query) and tree.args.get("limit") is None
+    if needs_limit:
+        return sql.rstrip().rstrip(";") + f"\nLIMIT {limit}"
+    return sql
+
+
+# ---------------------------------------
+# Période de date
+# ---------------------------------------
+def _date_value(node) -> Optional[str]:
+    """'YYYY-MM-DD' si le nœud est un littéral de date ('2025-01-01' ou DATE '2025-01-01')."""
+    if isinstance(node, exp.Cast) and isinstance(node.this, exp.Literal):
+        node = node.this
+    if isinstance(node, exp.Literal) and node.is_string and _DATE_RE.match(node.this):
+        return node.this
+    return None
+
+
+def _set_date(node, value: str):
+    """Remplace la valeur d'un littéral de date en gardant sa forme (chaîne ou DATE '…')."""
+    literal = node.this if isinstance(node, exp.Cast) else node
+    literal.replace(exp.Literal.string(value))
+
+
+def _conjuncts(where: exp.Where) -> list:
+    return list(where.this.flatten()) if isinstance(where.this, exp.And) else [where.this]
+
+
+def _is_column_expr(node) -> bool:
+    return isinstance(node, (exp.Column, exp.Func)) and node.find(exp.Column) is not None
+
+
+def _period_in(where: exp.Where):
+    """(colonne, début, fin, prédicats) du filtre de période d'un WHERE, ou None."""
+    preds = _conjuncts(where)
+    for pred in preds:
+        if isinstance(pred, exp.Between) and _is_column_expr(pred.this):
+            start, end = _date_value(pred.args.get("low")), _date_value(pred.args.get("high"))
+            if start and end:
+                return to_sql(pred.this), start, end, [pred]
+
+    bounds = {}
+    for pred in preds:
+        if isinstance(pred, (exp.GTE, exp.LTE)) and _is_column_expr(pred.this) and _date_value(pred.expression):
+            bounds.setdefault((to_sql(pred.this), type(pred)), pred)
+    for (column, kind), gte in bounds.items():
+        lte = bounds.get((column, exp.LTE))
+        if kind is exp.GTE and lte is not None:
+            return column, _date_value(gte.expression), _date_value(lte.expression), [gte, lte]
+
+    for pred in preds:
+        if isinstance(pred, exp.EQ) and _is_column_expr(pred.this) and _date_value(pred.expression):
+            day = _date_value(pred.expression)
+            return to_sql(pred.this), day, day, [pred]
+    return None
+
+
+def _find_period(tree: exp.Expression):
+    """Filtre de période : WHERE externe d'abord, puis CTE / sous-requêtes."""
+    wheres = list(tree.find_all(exp.Where))
+    outer = tree.args.get("where")
+    if outer is not None:
+        wheres.sort(key=lambda w: w is not outer)
+    for where in wheres:
+        period = _period_in(where)
+        if period:
+            return period
+    return None
+
+
+def date_range(sql: str):
+    """(colonne, début, fin) du filtre de période, ou (None, None, None)."""
+    tree = parse(sql)
+    period = _find_period(tree) if tree is not None else None
+    return period[:3] if period else (None, None, None)
+
+
+def with_date_range(sql: str, new_start: str, new_end: str) -> Optional[str]:
+    """
+    Même requête sur une autre période : chaque occurrence du filtre de période (requête externe
+    et CTE) reçoit les nouvelles bornes. None si aucun filtre de période n'est reconnu.
+    """
+    tree = parse(sql)
+    if tree is None:
+        return None
+    tree = tree.copy()
+    period = _find_period(tree)
+    if period is None:
+        return None
+    column, start, end, _ = period
+
+    for where in list(tree.find_all(exp.Where)):
+        for pred in _conjuncts(where):
+            if not _is_column_expr(pred.this) or to_sql(pred.this) != column:
+                continue
+            if isinstance(pred, exp.Between) and (_date_value(pred.args.get("low")), _date_value(pred.args.get("high"))) == (start, end):
+                _set_date(pred.args["low"], new_start)
+                _set_date(pred.args["high"], new_end)
+            elif isinstance(pred, exp.GTE) and _date_value(pred.expression) == start:
+                _set_date(pred.expression, new_start)
+            elif isinstance(pred, exp.LTE) and _date_value(pred.expression) == end:
+                _set_date(pred.expression, new_end)
+            elif isinstance(pred, exp.EQ) and start == end and _date_value(pred.expression) == start:
+                if new_start == new_end:
+                    _set_date(pred.expression, new_start)
+                else:
+                    pred.replace(exp.Between(this=pred.this.copy(), low=exp.Literal.string(new_start),
+                                             high=exp.Literal.string(new_end)))
+    return to_sql(tree)
+
+
+# ---------------------------------------
+# Comparaisons repliées / drill-downs
+# ---------------------------------------
+def _is_simple_select(select: Optional[exp.Select], allow_ctes: bool = False) -> bool:
+    """SELECT unique sans DISTINCT, sous-requête, fenêtre ni QUALIFY (réécriture du GROUP BY sûre)."""
+    if select is None or (select.args.get("with_") and not allow_ctes):
+        return False
+    body = select.copy()
+    body.set("with_", None)
+    if body.args.get("distinct") or body.args.get("qualify") or body.find(exp.Window):
+        return False
+    return not any(node is not body for node in body.find_all(exp.Select))
+
+
+def _source_has_column(select: exp.Select, dimension: str) -> bool:
+    """
+    La source du FROM expose-t-elle la dimension ? Une table physique oui (colonnes validées en
+    amont) ; une CTE / sous-requête seulement si elle la projette (nommément ou via *).
+    """
+    ctes = {cte.alias_or_name.lower(): cte.this for cte in select.find_all(exp.CTE)}
+    current = select
+    for _ in range(10):
+        source = current.args.get("from_")
+        source = source.this if source else None
+        if isinstance(source, exp.Subquery):
+            inner = source.this
+        elif isinstance(source, exp.Table):
+            inner = ctes.get(source.name.lower()) if not source.db else None
+            if inner is None:
+                return True
+        else:
+            return False
+        if not isinstance(inner, exp.Select):
+            return False
+        if dimension.lower() in _output_names(inner):
+            return True
+        if not any(isinstance(e, exp.Star) or (isinstance(e, exp.Column) and isinstance(e.this, exp.Star))
+                   for e in inner.expressions):
+            return False
+        current = inner
+    return False
+
+
+def _shift_ordinals(nodes, offset: int) -> bool:
+    """GROUP BY / ORDER BY 1, 2… décalés de `offset` colonnes ajoutées en tête du SELECT."""
+    shifted = False
+    for node in nodes:
+        target = node.this if isinstance(node, exp.Ordered) else node
+        if isinstance(target, exp.Literal) and target.is_int:
+            target.replace(exp.Literal.number(int(target.this) + offset))
+            shifted = True
+    return shifted
+
+
+def _ordinal_target(select: exp.Select, node: exp.Expression) -> exp.Expression:
+    """Expression du SELECT désignée par un ordinal de GROUP BY (le nœud lui-même sinon)."""
+    if isinstance(node, exp.Literal) and node.is_int and 1 <= int(node.this) <= len(select.expressions):
+        return select.expressions[int(node.this) - 1].unalias().copy()
+    return node
+
+
+def _output_names(select: exp.Select) -> set:
+    return {e.alias_or_name.lower() for e in select.expressions if e.alias_or_name}
+
+
+def measure_columns(sql: str) -> List[str]:
+    """
+    Noms de sortie des mesures (agrégats hors fenêtre) du SELECT externe, dans l'ordre ;
+    sans alias, nommées comme BigQuery (f0_, f1_, …). GROUPING(…) n'est pas une mesure.
+    """
+    select = _outer_select(parse(sql))
+    if select is None:
+        return []
+    names, anonymous = [], 0
+    for expression in select.expressions:
+        if expression.alias:
+            name = expression.alias
+        elif isinstance(expression, exp.Column):
+            name = expression.name
+        else:
+            name, anonymous = f"f{anonymous}_", anonymous + 1
+        if any(not isinstance(agg, exp.Grouping) and not isinstance(agg.parent, exp.Window)
+               for agg in expression.find_all(exp.AggFunc)):
+            names.append(name)
+    return names
+
+
+def fold_periods(sql: str, periods: dict, period_column: str) -> Optional[str]:
+    """
+    Une seule requête pour plusieurs périodes ({tag: {start, end}}) : un CASE étiquette chaque ligne
+    avec sa période, le filtre de date devient un OR des périodes, GROUP BY sur l'étiquette.
+    None si la requête n'est pas un agrégat scalaire simple filtré par période dans son WHERE.
+    """
+    select = _outer_select(parse(sql))
+    if not _is_simple_select(select) or select.args.get("group") or select.args.get("having") \
+            or select.args.get("where") is None:
+        return None
+    select = select.copy()
+    period = _period_in(select.args["where"])
+    if period is None:
+        return None
+    _, _, _, preds = period
+    column = preds[0].this
+
+    ranges = {tag: exp.Between(this=column.copy(), low=exp.Literal.string(p["start"]),
+                               high=exp.Literal.string(p["end"]))
+              for tag, p in periods.items()}
+    period_case = exp.Case(ifs=[exp.If(this=pred.copy(), true=exp.Literal.string(tag)) for tag, pred in ranges.items()])
+    first, *others = preds
+    for pred in others:
+        pred.replace(exp.true())
+    first.replace(exp.Paren(this=exp.or_(*ranges.values())))
+
+    select.set("expressions", [exp.alias_(period_case, period_column)] + select.expressions)
+    select.set("group", exp.Group(expressions=[exp.column(period_column)]))
+    select.set("order", None)
+    select.set("limit", None)
+    return to_sql(select)
+
+
+def add_dimension(sql: str, dimension: str) -> Optional[str]:
+    """
+    Drill-down : la dimension en tête du SELECT et du GROUP BY (créé si absent), LIMIT retiré
+    (remis par enforce_limit). None si la dimension est déjà groupée, absente de la source (CTE)
+    ou si la requête n'est pas analysable.
+    """
+    select = _outer_select(parse(sql))
+    if select is None or not select.args.get("from_") or not _source_has_column(select, dimension):
+        return None
+    select = select.copy()
+    column = _dimension_column(select, dimension)
+    group = select.args.get("group")
+    if group and any(isinstance(e, exp.Column) and e.name.lower() == dimension.lower() for e in group.expressions):
+        return None
+
+    _shift_ordinals(group.expressions if group else [], 1)
+    _shift_ordinals(select.args["order"].expressions if select.args.get("order") else [], 1)
+    select.set("expressions", [column] + select.expressions)
+    select.set("group", exp.Group(expressions=[column.copy()] + (group.expressions if group else [])))
+    select.set("limit", None)
+    return to_sql(select)
+
+
+def grouping_sets(sql: str, dimensions: List[str]) -> Optional[str]:
+    """
+    Toutes les dimensions en un seul scan :
+        SELECT dim1, dim2, <select d'origine>, GROUPING(dim1) AS __g_0, GROUPING(dim2) AS __g_1
+        FROM … WHERE … GROUP BY GROUPING SETS ((dim1, <group by d'origine>), (dim2, …))
+    None si la réécriture n'est pas sûre (dimension déjà présente ou absente de la source, fenêtre, ROLLUP…).
+    """
+    select = _outer_select(parse(sql))
+    if not _is_simple_select(select, allow_ctes=True) or not select.args.get("from_") \
+            or not all(_source_has_column(select, d) for d in dimensions):
+        return None
+    group = select.args.get("group")
+    if group and (group.args.get("grouping_sets") or group.args.get("rollup") or group.args.get("cube")
+                  or any(isinstance(e, (exp.GroupingSets, exp.Rollup, exp.Cube)) for e in group.expressions)):
+        return None
+    outputs = _output_names(select)
+    grouped = {e.name.lower() for e in (group.expressions if group else []) if isinstance(e, exp.Column)}
+    if any(d.lower() in outputs or d.lower() in grouped for d in dimensions):
+        return None  # nom de colonne ambigu en sortie
+
+    select = select.copy()
+    # GROUP BY 1, 2… : l'expression désignée, un ordinal n'a pas de sens dans GROUPING SETS
+    existing = [_ordinal_target(select, e) for e in (select.args["group"].expressions if select.args.get("group") else [])]
+    columns = [_dimension_column(select, d) for d in dimensions]
+    select.set("expressions",
+               [exp.alias_(c, d) for c, d in zip(columns, dimensions)] + select.expressions
+               + [exp.alias_(exp.Grouping(expressions=[c.copy()]), f"__g_{i}") for i, c in enumerate(columns)])
+    sets = [exp.Tuple(expressions=[c.copy()] + [e.copy() for e in existing]) for c in columns]
+    select.set("group", exp.Group(expressions=[exp.GroupingSets(expressions=sets)]))
+    select.set("order", None)
+    select.set("limit", None)
+    return f"{NO_LIMIT_HINT}\n{to_sql(select)}"
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests de la traduction BigQuery → snapshot SQLite (analytics_snapshot.translate).
+
+Les requêtes traduites sont rejouées sur un snapshot en mémoire construit à partir de lignes
+brutes : les résultats attendus sont ceux que BigQuery renverrait sur ces lignes.
+
+Usage:
+    python -m pytest -q test_analytics_snapshot.py
+"""
+
+import sqlite3
+import pytest
+from analytics_snapshot import DATE_COLUMN, DIMENSIONS, SOURCE_TABLE, WEIGHT, translate
+
+# (payment_date, dw_country_code, day_in_cycle, coupon) × nombre de lignes BigQuery
+RAW = (
+    [("2024-12-31", "FR", 9, "A")] * 1
+    + [("2025-01-01", "FR", 1, "A")] * 10
+    + [("2025-01-02", "FR", 3, None)] * 5
+    + [("2025-01-02", "DE", 2, "B")] * 3
+)
+FILTER = "WHERE DATE(payment_date) BETWEEN '2025-01-01' AND '2025-01-31'"
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    con = sqlite3.connect(":memory:")
+    con.execute(f"CREATE TABLE raw ({DATE_COLUMN} TEXT, {', '.join(DIMENSIONS)})")
+    con.executemany(f"INSERT INTO raw ({DATE_COLUMN}, dw_country_code, day_in_cycle, coupon) VALUES (?, ?, ?, ?)", RAW)
+    # Même agrégation que _LOAD_SQL : une ligne par (jour × dimensions), pondérée
+    columns = ", ".join((DATE_COLUMN,) + DIMENSIONS)
+    con.execute(f"CREATE TABLE {SOURCE_TABLE} AS SELECT {columns}, COUNT(*) AS {WEIGHT} FROM raw GROUP BY {columns}")
+    yield con
+    con.close()
+
+
+def _run(snapshot, sql):
+    translated = translate(sql, "p")
+    assert translated is not None, sql
+    return snapshot.execute(translated[0]).fetchall()
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # Agrégats pondérés
+    (f"SELECT COUNT(*) AS orders FROM sales.box_sales {FILTER}", [(18,)]),
+    (f"SELECT dw_country_code, COUNTIF(coupon IS NOT NULL) AS with_coupon, COUNT(coupon) AS c "
+     f"FROM sales.box_sales {FILTER} GROUP BY dw_country_code ORDER BY 1", [("DE", 3, 3), ("FR", 10, 10)]),
+    (f"SELECT AVG(day_in_cycle) AS avg_day FROM sales.box_sales {FILTER}", [(31 / 18,)]),
+    (f"SELECT SUM(day_in_cycle) AS s, MAX(day_in_cycle) AS m, COUNT(DISTINCT coupon) AS coupons "
+     f"FROM `p.sales.box_sales` {FILTER}", [(31, 3, 2)]),
+    # Alias usuel `n` : HAVING porte sur l'agrégat, pas sur le poids du snapshot
+    (f"SELECT dw_country_code, COUNT(*) AS n FROM sales.box_sales {FILTER} GROUP BY 1 HAVING n > 13",
+     [("FR", 15)]),
+    # GROUP BY ALL, colonne anonyme, alias identique à la colonne
+    (f"SELECT DATE(payment_date) AS payment_date, COUNT(*) FROM sales.box_sales {FILTER} GROUP BY ALL ORDER BY 1",
+     [("2025-01-01", 10), ("2025-01-02", 8)]),
+    (f"SELECT dw_country_code AS dw_country_code, COUNT(*) AS n FROM sales.box_sales {FILTER} "
+     "GROUP BY ALL ORDER BY n DESC", [("FR", 15), ("DE", 3)]),
+    # Dates constantes repliées en littéraux
+    ("SELECT COUNT(*) AS n FROM sales.box_sales "
+     "WHERE DATE(payment_date) >= DATE_SUB(DATE '2025-01-03', INTERVAL 2 DAY)", [(18,)]),
+])
+def test_translate_matches_bigquery(snapshot, sql, expected):
+    assert _run(snapshot, sql) == pytest.approx(expected)
+
+
+def test_lower_bound_after_date_folding():
+    sql = ("SELECT COUNT(*) FROM sales.box_sales "
+           "WHERE DATE(payment_date) BETWEEN DATE_SUB(DATE '2025-03-01', INTERVAL 1 MONTH) AND '2025-03-01'")
+    assert translate(sql, "p")[1] == "2025-02-01"
+
+
+@pytest.mark.parametrize("sql", [
+    # Alias qui masquerait une colonne du snapshot
+    f"SELECT COUNT(*) AS dw_country_code FROM sales.box_sales {FILTER}",
+    f"SELECT COUNT(*) AS __n FROM sales.box_sales {FILTER}",
+    f"SELECT coupon AS payment_date, COUNT(*) FROM sales.box_sales {FILTER} GROUP BY 1",
+    f"SELECT SUM(box_id) AS day_in_cycle FROM sales.box_sales {FILTER}",
+    # Hors du périmètre du snapshot
+    "SELECT COUNT(*) FROM sales.box_sales",
+    f"SELECT APPROX_COUNT_DISTINCT(coupon) FROM sales.box_sales {FILTER}",
+    f"SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date, 'Europe/Paris') >= '2025-01-01'",
+    f"SELECT order_id FROM sales.box_sales {FILTER}",
+    f"SELECT COUNT(*) FROM other.box_sales {FILTER}",
+])
+def test_translate_refuses(sql):
+    assert translate(sql, "p") is None
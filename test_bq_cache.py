@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests du cache BigQuery : clé des requêtes et single-flight (bq_cache.SingleFlight).
+
+Usage:
+    python -m pytest -q test_bq_cache.py
+"""
+
+import asyncio
+import threading
+import pytest
+from bq_cache import SingleFlight, query_key
+from bq_jobs import JobCancelled
+
+
+# ---------------------------------------
+# Clé de cache
+# ---------------------------------------
+@pytest.mark.parametrize("a, b", [
+    ("SELECT COUNT(*) AS total FROM sales.t", "select  count(*) as total\nfrom sales.t -- total ;"),
+    ("SELECT a FROM sales.t WHERE b = 1", "/* relance */ SELECT a FROM sales.t WHERE b=1;"),
+])
+def test_same_key(a, b):
+    assert query_key("p", a) == query_key("p", b)
+
+
+@pytest.mark.parametrize("a, b", [
+    # Alias : les lignes renvoyées sont indexées par ce nom
+    ("SELECT COUNT(*) AS Total FROM sales.t", "SELECT COUNT(*) AS total FROM sales.t"),
+    # Tables : sensibles à la casse dans BigQuery
+    ("SELECT a FROM sales.Orders", "SELECT a FROM sales.orders"),
+    ("SELECT a FROM sales.t WHERE b = 'FR'", "SELECT a FROM sales.t WHERE b = 'fr'"),
+    # Non analysable : seule la mise en forme est normalisée
+    ("SELECT A FROM sales.t WHERE ((", "SELECT a FROM sales.t WHERE (("),
+])
+def test_distinct_keys(a, b):
+    assert query_key("p", a) != query_key("p", b)
+
+
+# ---------------------------------------
+# Single-flight
+# ---------------------------------------
+def _run_pair(flight, leader_fn, follower_fn):
+    """Lance un leader puis, pendant son exécution, un appelant identique ; renvoie leurs issues."""
+    outcomes = {}
+
+    def call(name, fn):
+        try:
+            outcomes[name] = ("ok", flight.do("k", fn, timeout=5))
+        except BaseException as e:
+            outcomes[name] = ("error", e)
+
+    leader = threading.Thread(target=call, args=("leader", leader_fn))
+    leader.start()
+    while not flight._calls:
+        pass
+    follower = threading.Thread(target=call, args=("follower", follower_fn))
+    follower.start()
+    while flight._calls["k"].waiters == 0:
+        pass
+    return leader, follower, outcomes
+
+
+def test_followers_share_the_leader_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def leader_fn():
+        runs.append("leader")
+        release.wait(5)
+        return 42
+
+    leader, follower, outcomes = _run_pair(flight, leader_fn, lambda: runs.append("follower"))
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert outcomes == {"leader": ("ok", 42), "follower": ("ok", 42)}
+    assert runs == ["leader"]
+
+
+def test_follower_shares_a_query_error():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def leader_fn():
+        release.wait(5)
+        raise ValueError("syntax error")
+
+    leader, follower, outcomes = _run_pair(flight, leader_fn, lambda: 0)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert outcomes["follower"][0] == "error"
+    assert isinstance(outcomes["follower"][1], ValueError)
+
+
+@pytest.mark.parametrize("cancellation", [JobCancelled("🛑 Requête interrompue"), asyncio.CancelledError()])
+def test_cancelled_leader_hands_over_to_a_follower(cancellation):
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def leader_fn():
+        release.wait(5)
+        raise cancellation
+
+    leader, follower, outcomes = _run_pair(flight, leader_fn, lambda: "relancée")
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert outcomes["leader"] == ("error", cancellation)
+    assert outcomes["follower"] == ("ok", "relancée")
+    assert not flight._calls
+
+
+def test_cancelled_async_leader_hands_over_to_a_follower():
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def leader_fn():
+            await release.wait()
+            raise asyncio.CancelledError()
+
+        async def follower_fn():
+            return "relancée"
+
+        leader = asyncio.create_task(flight.do_async("k", leader_fn, timeout=5))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("k", follower_fn, timeout=5))
+        while flight._calls["k"].waiters == 0:
+            await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "relancée"
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests du garde-fou lecture seule (bq_engine.check_read_only) partagé par bq_utils, le serveur MCP et le bot.
+
+Usage:
+    python -m pytest -q test_bq_engine.py
+"""
+
+import pytest
+from bq_engine import QueryRefused, check_read_only
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM sales.t WHERE x = 1",
+    "EXPORT DATA OPTIONS(uri='gs://bucket/*.csv', format='CSV') AS SELECT * FROM sales.t",
+    "SELECT 1; DROP TABLE x",
+    "CREATE TEMP FUNCTION f(x INT64) AS (x + 1); SELECT f(1)",
+    # Non analysable par sqlglot : repli sur les mots-clés et le ';'
+    "DELETE FROM sales.t WHERE ((",
+    "SELECT a FROM sales.t WHERE ((; SELECT 1",
+])
+def test_refused(sql):
+    with pytest.raises(QueryRefused, match="DDL/DML"):
+        check_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH c AS (SELECT a FROM sales.t) SELECT a FROM c",
+    "SELECT * FROM sales.t WHERE note = 'a; b';",
+    # Non analysable mais sans écriture : BigQuery tranchera
+    "SELECT a FROM sales.t PIVOT PIVOT",
+])
+def test_accepted(sql):
+    check_read_only(sql)
+
+
+def test_allowed_datasets():
+    check_read_only("SELECT * FROM `p.sales.t` JOIN ops.u USING (id)", allowed=["sales", "ops"])
+    with pytest.raises(QueryRefused, match="Dataset non autorisé : crm"):
+        check_read_only("SELECT * FROM sales.t JOIN crm.u USING (id)", allowed=["sales"])
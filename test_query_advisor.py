@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests du conseiller partitionnement / clustering (query_advisor.py), catalogue factice.
+
+Usage:
+    python -m pytest -q test_query_advisor.py
+"""
+
+import pytest
+from query_advisor import QueryAdvisor
+
+
+def _columns(**types):
+    return [{"nom": name, "type": kind} for name, kind in types.items()]
+
+
+class StubCatalog:
+    """Catalogue en mémoire : mêmes entrées que SCHEMA_CATALOG.get (partition, clustering, colonnes)."""
+
+    TABLES = {
+        "p.sales.box_sales": {"partition": "payment_date", "clustering": ["country_code"],
+                              "columns": _columns(payment_date="TIMESTAMP", order_id="STRING", customer_id="STRING",
+                                                  country_code="STRING", amount="NUMERIC")},
+        "p.sales.orders": {"partition": None, "clustering": [],
+                           "columns": _columns(order_id="STRING", status="STRING")},
+        "p.ops.daily": {"partition": "day", "clustering": [], "columns": _columns(day="DATE", x="INT64")},
+    }
+
+    def get(self, ref):
+        return self.TABLES.get(ref)
+
+
+WINDOW = "TIMESTAMP(DATE_SUB(CURRENT_DATE, INTERVAL '90' DAY))"
+NO_FILTER = "Aucun filtre sur `payment_date` (partition"
+FULL_SCAN = "Aucun filtre sur `payment_date` : `p.sales.box_sales` est lue en entier"
+OUTER_FILTER = "Filtre sur `payment_date` posé hors du SELECT"
+NOT_PRUNABLE = "Filtre sur `payment_date` non élagable"
+CLUSTERING = "Colonne clusterisée `country_code`"
+
+# (SQL du modèle, SQL conseillée — None : inchangée, début de l'avertissement attendu — None : aucun)
+CASES = [
+    # DATE / CAST / EXTRACT sur une colonne TIMESTAMP, avec et sans fuseau
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date) = '2025-01-01'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01') "
+     "AND payment_date < TIMESTAMP('2025-01-02')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date, 'Europe/Paris') >= '2025-01-01'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01', 'Europe/Paris')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE CAST(payment_date AS DATE) < '2025-02-01'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date < TIMESTAMP('2025-02-01')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE EXTRACT(DATE FROM payment_date) > '2025-01-31'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-02-01')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE EXTRACT(YEAR FROM payment_date) = 2025",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01') "
+     "AND payment_date < TIMESTAMP('2026-01-01')", None),
+    # Colonne de partition DATE : l'enveloppe est simplement retirée
+    ("SELECT SUM(x) FROM ops.daily WHERE DATE(day) = '2025-01-01'",
+     "SELECT SUM(x) FROM ops.daily WHERE day = '2025-01-01'", None),
+    # BETWEEN, opérandes inversés, OR
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date) BETWEEN '2025-01-01' AND '2025-01-31'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01') "
+     "AND payment_date < TIMESTAMP('2025-02-01')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE '2025-01-01' <= DATE(payment_date)",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date) = '2025-01-01' OR DATE(payment_date) = '2025-02-01'",
+     "SELECT COUNT(*) FROM sales.box_sales WHERE (payment_date >= TIMESTAMP('2025-01-01') "
+     "AND payment_date < TIMESTAMP('2025-01-02')) OR (payment_date >= TIMESTAMP('2025-02-01') "
+     "AND payment_date < TIMESTAMP('2025-02-02'))", None),
+    # Déjà élagable : rien à faire
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= '2025-01-01'", None, None),
+    # Non élagable, non réécrit (pas de forme strictement équivalente)
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE FORMAT_TIMESTAMP('%Y-%m', payment_date) = '2025-01'",
+     None, NOT_PRUNABLE),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date) = CURRENT_DATETIME()", None, NOT_PRUNABLE),
+    ("SELECT COUNT(*) FROM sales.box_sales WHERE payment_date >= '2025-01-01' AND LOWER(country_code) = 'fr'",
+     None, CLUSTERING),
+    # Sans filtre : fenêtre par défaut
+    ("SELECT country_code, COUNT(*) FROM sales.box_sales GROUP BY 1",
+     f"SELECT country_code, COUNT(*) FROM sales.box_sales WHERE payment_date >= {WINDOW} GROUP BY 1", NO_FILTER),
+    # SELECT imbriqués et CTE : la borne de la requête englobante compte
+    ("SELECT COUNT(*) FROM (SELECT * FROM sales.box_sales) t WHERE t.payment_date >= '2020-01-01'",
+     None, OUTER_FILTER),
+    ("WITH s AS (SELECT * FROM sales.box_sales) SELECT COUNT(*) FROM s WHERE payment_date >= '2020-01-01'",
+     None, OUTER_FILTER),
+    ("WITH s AS (SELECT DATE(payment_date) AS d FROM sales.box_sales), u AS (SELECT * FROM s) "
+     "SELECT COUNT(*) FROM u WHERE d >= '2020-01-01'", None, OUTER_FILTER),
+    ("WITH s AS (SELECT * FROM sales.box_sales) SELECT COUNT(*) FROM s",
+     f"WITH s AS (SELECT * FROM sales.box_sales WHERE payment_date >= {WINDOW}) SELECT COUNT(*) FROM s", NO_FILTER),
+    # La fenêtre ajoutée à la requête englobante ne compte pas comme un filtre de la sous-requête
+    ("SELECT * FROM sales.box_sales s WHERE s.customer_id IN (SELECT customer_id FROM sales.box_sales)",
+     "SELECT * FROM sales.box_sales AS s WHERE s.customer_id IN (SELECT customer_id FROM sales.box_sales) "
+     f"AND s.payment_date >= {WINDOW}", FULL_SCAN),
+    # Jointures : colonne non qualifiée attribuée par le catalogue
+    ("SELECT COUNT(*) FROM sales.box_sales b JOIN sales.orders o ON b.order_id = o.order_id "
+     "WHERE payment_date >= '2020-01-01'", None, None),
+    ("SELECT COUNT(*) FROM sales.box_sales b JOIN sales.orders o ON b.order_id = o.order_id "
+     "WHERE DATE(payment_date) = '2020-01-01'",
+     "SELECT COUNT(*) FROM sales.box_sales AS b JOIN sales.orders AS o ON b.order_id = o.order_id "
+     "WHERE payment_date >= TIMESTAMP('2020-01-01') AND payment_date < TIMESTAMP('2020-01-02')", None),
+    ("SELECT COUNT(*) FROM sales.box_sales b JOIN (SELECT 'x' AS order_id) o ON b.order_id = o.order_id "
+     "WHERE payment_date >= '2020-01-01'", None, None),
+    ("SELECT COUNT(*) FROM sales.box_sales b JOIN sales.orders o ON b.order_id = o.order_id",
+     "SELECT COUNT(*) FROM sales.box_sales AS b JOIN sales.orders AS o ON b.order_id = o.order_id "
+     f"WHERE b.payment_date >= {WINDOW}", NO_FILTER),
+    # UNION : chaque branche est conseillée séparément
+    ("SELECT order_id FROM sales.box_sales WHERE DATE(payment_date) = '2025-01-01' "
+     "UNION ALL SELECT order_id FROM sales.box_sales",
+     "SELECT order_id FROM sales.box_sales WHERE payment_date >= TIMESTAMP('2025-01-01') "
+     "AND payment_date < TIMESTAMP('2025-01-02') UNION ALL "
+     f"SELECT order_id FROM sales.box_sales WHERE payment_date >= {WINDOW}", NO_FILTER),
+]
+
+
+@pytest.fixture
+def advisor():
+    return QueryAdvisor(True, 90, "", StubCatalog())
+
+
+@pytest.mark.parametrize("sql, expected, notice", CASES)
+def test_advise(advisor, sql, expected, notice):
+    advice = advisor.advise(sql, "p")
+    assert advice.sql == (expected or sql)
+    assert advice.changed == (expected is not None)
+    if notice is None:
+        assert advice.notices == []
+    else:
+        assert any(n.startswith(notice) for n in advice.notices), advice.notices
+
+
+def test_window_disabled():
+    advice = QueryAdvisor(True, 0, "", StubCatalog()).advise("SELECT COUNT(*) FROM sales.box_sales", "p")
+    assert not advice.changed
+    assert advice.notices == ["Aucun filtre sur `payment_date` : `p.sales.box_sales` est lue en entier."]
+
+
+def test_advisor_disabled():
+    sql = "SELECT COUNT(*) FROM sales.box_sales WHERE DATE(payment_date) = '2025-01-01'"
+    assert QueryAdvisor(False, 90, "", StubCatalog()).advise(sql, "p").sql == sql
+
+
+def test_unknown_table_is_left_alone(advisor):
+    sql = "SELECT COUNT(*) FROM other.events WHERE DATE(ts) = '2025-01-01'"
+    advice = advisor.advise(sql, "p")
+    assert (advice.sql, advice.notices) == (sql, [])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests des réécritures SQL par AST (sql_ast.py).
+
+Usage:
+    python -m pytest -q test_sql_ast.py
+"""
+
+import pytest
+import sql_ast
+from sql_ast import NO_LIMIT_HINT
+
+# ---------------------------------------
+# enforce_limit
+# ---------------------------------------
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT a FROM t", "SELECT a FROM t\nLIMIT 101"),
+    ("SELECT a FROM t;", "SELECT a FROM t\nLIMIT 101"),
+    ("SELECT a FROM t LIMIT 5", "SELECT a FROM t LIMIT 5"),
+    # UNION : le LIMIT porte sur l'ensemble, pas sur la dernière branche
+    ("SELECT a FROM t UNION ALL SELECT a FROM u", "SELECT a FROM t UNION ALL SELECT a FROM u\nLIMIT 101"),
+    ("SELECT a FROM t UNION ALL SELECT a FROM u LIMIT 10", "SELECT a FROM t UNION ALL SELECT a FROM u LIMIT 10"),
+    ("(SELECT a FROM t LIMIT 5) UNION ALL (SELECT a FROM u)",
+     "(SELECT a FROM t LIMIT 5) UNION ALL (SELECT a FROM u)\nLIMIT 101"),
+    # LIMIT d'un CTE, d'une sous-requête ou dans une chaîne : la requête externe n'en a pas
+    ("WITH x AS (SELECT a FROM t LIMIT 3) SELECT a FROM x", "WITH x AS (SELECT a FROM t LIMIT 3) SELECT a FROM x\nLIMIT 101"),
+    ("SELECT a FROM (SELECT a FROM t LIMIT 2)", "SELECT a FROM (SELECT a FROM t LIMIT 2)\nLIMIT 101"),
+    ("SELECT a FROM t WHERE b = ' limit '", "SELECT a FROM t WHERE b = ' limit '\nLIMIT 101"),
+    (f"{NO_LIMIT_HINT}\nSELECT a FROM t", f"{NO_LIMIT_HINT}\nSELECT a FROM t"),
+])
+def test_enforce_limit(sql, expected):
+    assert sql_ast.enforce_limit(sql, 101) == expected
+
+
+# ---------------------------------------
+# date_range / with_date_range
+# ---------------------------------------
+@pytest.mark.parametrize("sql, period, shifted", [
+    ("SELECT COUNT(*) FROM t WHERE d BETWEEN '2025-01-01' AND '2025-01-31'",
+     ("d", "2025-01-01", "2025-01-31"),
+     "SELECT COUNT(*) FROM t WHERE d BETWEEN '2024-01-01' AND '2024-01-31'"),
+    ("SELECT COUNT(*) FROM t WHERE DATE(ts) >= '2025-01-01' AND DATE(ts) <= '2025-01-31' AND x = 1",
+     ("DATE(ts)", "2025-01-01", "2025-01-31"),
+     "SELECT COUNT(*) FROM t WHERE DATE(ts) >= '2024-01-01' AND DATE(ts) <= '2024-01-31' AND x = 1"),
+    ("SELECT COUNT(*) FROM t WHERE CAST(ts AS DATE) BETWEEN DATE '2025-01-01' AND DATE '2025-01-31'",
+     ("CAST(ts AS DATE)", "2025-01-01", "2025-01-31"),
+     "SELECT COUNT(*) FROM t WHERE CAST(ts AS DATE) BETWEEN CAST('2024-01-01' AS DATE) AND CAST('2024-01-31' AS DATE)"),
+    # Jour unique → période : BETWEEN
+    ("SELECT COUNT(*) FROM t WHERE d = DATE '2025-03-01'",
+     ("d", "2025-03-01", "2025-03-01"),
+     "SELECT COUNT(*) FROM t WHERE d BETWEEN '2024-01-01' AND '2024-01-31'"),
+    # Filtre de période dans un CTE
+    ("WITH c AS (SELECT * FROM t WHERE d BETWEEN '2025-01-01' AND '2025-01-31') SELECT COUNT(*) FROM c",
+     ("d", "2025-01-01", "2025-01-31"),
+     "WITH c AS (SELECT * FROM t WHERE d BETWEEN '2024-01-01' AND '2024-01-31') SELECT COUNT(*) FROM c"),
+    # Borne unique ou pas de filtre : pas de période
+    ("SELECT COUNT(*) FROM t WHERE d >= '2025-01-01'", (None, None, None), None),
+    ("SELECT COUNT(*) FROM t", (None, None, None), None),
+])
+def test_date_range(sql, period, shifted):
+    assert sql_ast.date_range(sql) == period
+    assert sql_ast.with_date_range(sql, "2024-01-01", "2024-01-31") == shifted
+
+
+# ---------------------------------------
+# qualify_tables
+# ---------------------------------------
+def _second_project(dataset):
+    return {"ops": "p2"}.get(dataset)
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM ops.x", "SELECT * FROM p2.ops.x"),
+    ("SELECT * FROM sales.y", "SELECT * FROM sales.y"),  # rien à qualifier : texte d'origine
+    ("SELECT * FROM ops.x a JOIN sales.y b ON a.id=b.id",
+     "SELECT * FROM p2.ops.x AS a JOIN sales.y AS b ON a.id = b.id"),
+    ("SELECT * FROM `p1.ops.x` JOIN ops.y AS y USING(id) LEFT JOIN ops.z z ON z.id = y.id",
+     "SELECT * FROM `p1.ops.x` JOIN p2.ops.y AS y USING (id) LEFT JOIN p2.ops.z AS z ON z.id = y.id"),
+    ("SELECT * FROM `region-eu`.INFORMATION_SCHEMA.JOBS", "SELECT * FROM `region-eu`.INFORMATION_SCHEMA.JOBS"),
+    ("SELECT FROM", None),
+])
+def test_qualify_tables(sql, expected):
+    assert sql_ast.qualify_tables(sql, _second_project) == expected
+
+
+# ---------------------------------------
+# fold_periods
+# ---------------------------------------
+PERIODS = {"current": {"start": "2025-02-01", "end": "2025-02-28"},
+           "previous": {"start": "2025-01-01", "end": "2025-01-31"}}
+PERIOD_CASE = ("CASE WHEN d BETWEEN '2025-02-01' AND '2025-02-28' THEN 'current' "
+               "WHEN d BETWEEN '2025-01-01' AND '2025-01-31' THEN 'previous' END AS __period")
+PERIOD_FILTER = "(d BETWEEN '2025-02-01' AND '2025-02-28' OR d BETWEEN '2025-01-01' AND '2025-01-31')"
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT COUNT(*) AS n, SUM(amount) AS ca FROM t WHERE d BETWEEN '2025-02-01' AND '2025-02-28' AND country = 'FR'",
+     f"SELECT {PERIOD_CASE}, COUNT(*) AS n, SUM(amount) AS ca FROM t WHERE {PERIOD_FILTER} AND country = 'FR' "
+     "GROUP BY __period"),
+    ("SELECT COUNT(*) FROM t WHERE d >= '2025-02-01' AND d <= '2025-02-28' LIMIT 101",
+     f"SELECT {PERIOD_CASE}, COUNT(*) FROM t WHERE {PERIOD_FILTER} AND TRUE GROUP BY __period"),
+    # Déjà groupée, ou sans filtre de période : pas de repli
+    ("SELECT country, COUNT(*) FROM t WHERE d BETWEEN '2025-02-01' AND '2025-02-28' GROUP BY 1", None),
+    ("SELECT COUNT(*) FROM t", None),
+])
+def test_fold_periods(sql, expected):
+    assert sql_ast.fold_periods(sql, PERIODS, "__period") == expected
+
+
+# ---------------------------------------
+# grouping_sets
+# ---------------------------------------
+@pytest.mark.parametrize("sql, dimensions, expected", [
+    ("SELECT COUNT(*) AS n FROM sales.t WHERE d >= '2025-01-01'", ["country", "coupon"],
+     "SELECT country AS country, coupon AS coupon, COUNT(*) AS n, GROUPING(country) AS __g_0, "
+     "GROUPING(coupon) AS __g_1 FROM sales.t WHERE d >= '2025-01-01' GROUP BY GROUPING SETS ((country), (coupon))"),
+    # GROUP BY ordinal : l'expression désignée est reprise dans chaque ensemble
+    ("SELECT UPPER(status) AS st, COUNT(*) AS n FROM sales.t GROUP BY 1 ORDER BY 2 DESC LIMIT 10", ["country"],
+     "SELECT country AS country, UPPER(status) AS st, COUNT(*) AS n, GROUPING(country) AS __g_0 "
+     "FROM sales.t GROUP BY GROUPING SETS ((country, UPPER(status)))"),
+    ("WITH c AS (SELECT country, amount FROM sales.t) SELECT SUM(amount) FROM c", ["country"],
+     "WITH c AS (SELECT country, amount FROM sales.t) SELECT country AS country, SUM(amount), "
+     "GROUPING(country) AS __g_0 FROM c GROUP BY GROUPING SETS ((country))"),
+    # Réécriture non sûre : dimension déjà groupée, ROLLUP, fenêtre, colonne absente du CTE
+    ("SELECT country, COUNT(*) FROM sales.t GROUP BY country", ["country"], None),
+    ("SELECT COUNT(*) FROM sales.t GROUP BY ROLLUP(a)", ["country"], None),
+    ("SELECT COUNT(*) OVER () FROM sales.t", ["country"], None),
+    ("WITH c AS (SELECT amount FROM sales.t) SELECT SUM(amount) FROM c", ["country"], None),
+])
+def test_grouping_sets(sql, dimensions, expected):
+    result = sql_ast.grouping_sets(sql, dimensions)
+    assert result == (f"{NO_LIMIT_HINT}\n{expected}" if expected else None)
+
+
+# ---------------------------------------
+# measure_columns
+# ---------------------------------------
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT box_id, SUM(amount) AS ca FROM t GROUP BY box_id", ["ca"]),
+    ("SELECT a, COUNT(*), SUM(x) OVER (), MAX(y) m FROM t GROUP BY a", ["f0_", "m"]),
+    (f"{NO_LIMIT_HINT}\nSELECT country AS country, COUNT(*) AS n, GROUPING(country) AS __g_0 "
+     "FROM t GROUP BY GROUPING SETS ((country))", ["n"]),
+    ("SELECT a FROM t", []),
+])
+def test_measure_columns(sql, expected):
+    assert sql_ast.measure_columns(sql) == expected
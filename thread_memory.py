@@ -1,28 +1,327 @@
 # thread_memory.py
-"""Gestion de la mémoire des conversations par thread Slack."""
+"""
+Gestion de la mémoire des conversations par thread Slack.
 
-from typing import Dict, List, Any
-from config import HISTORY_LIMIT
+Chaque thread a un budget de tokens (THREAD_TOKEN_BUDGET) : quand l'historique le dépasse,
+les tours les plus anciens sont retirés et compactés dans un résumé glissant, produit en
+arrière-plan (hors du chemin de la requête, retenté en cas d'échec) ; un dernier tour qui dépasse
+à lui seul le budget est tronqué. Les réponses gardent un digest compact des tools
+utilisés (SQL + aperçu du résultat) pour que les questions de suivi aient encore les données.
+"""
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+from config import (
+    HISTORY_LIMIT,
+    THREAD_TOKEN_BUDGET,
+    MEMORY_SUMMARY_MODEL,
+    MEMORY_SUMMARY_MAX_TOKENS,
+    MEMORY_DIGEST_MAX_CHARS
+)
 
 # Mémoire par thread
 THREAD_MEMORY: Dict[str, List[Dict[str, Any]]] = {}
 LAST_QUERIES: Dict[str, List[str]] = {}
+THREAD_SUMMARIES: Dict[str, str] = {}   # résumé injecté dans le prompt
+THREAD_CHANNELS: Dict[str, str] = {}    # channel Slack du thread (uploads de fichiers)
+
+# Résumés produits par le modèle / tours compactés en attente de résumé
+_MODEL_SUMMARIES: Dict[str, str] = {}
+_PENDING: Dict[str, List[Dict[str, Any]]] = {}
+_SCHEDULED = set()
+
+# Après compaction on redescend sous ce ratio du budget : le résumé (et donc le préfixe
+# caché du prompt) ne change pas à chaque tour.
+COMPACTION_TARGET_RATIO = 0.6
+# Résumé en échec (API indisponible, quota) : nouvelles tentatives après ces délais
+SUMMARY_RETRY_DELAYS_S = (30, 120, 600)
+_FAILURES: Dict[str, int] = {}
+
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory")
+_memory_lock = threading.Lock()
+
+QUERY_TOOLS = ("query_bigquery", "query_ops", "query_crm", "query_reviews")
+
+
+# ---------------------------------------
+# Comptage de tokens
+# ---------------------------------------
+def estimate_tokens(content: Any) -> int:
+    """Estimation rapide du nombre de tokens (≈ 4 caractères / token + overhead par bloc)."""
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return len(content) // 4 + 1
+    if isinstance(content, list):
+        total = 0
+        for block in content:
+            if isinstance(block, dict):
+                text = block.get("text") or block.get("content") or block.get("input") or ""
+            else:
+                text = getattr(block, "text", None) or getattr(block, "input", None) or ""
+            total += estimate_tokens(text if isinstance(text, str) else str(text)) + 4
+        return total
+    return estimate_tokens(str(content))
 
 
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_tokens(message.get("content")) + 4
+
+
+def thread_tokens(thread_ts: str) -> int:
+    """Tokens de l'historique envoyé au modèle (résumé compris)."""
+    total = sum(message_tokens(m) for m in THREAD_MEMORY.get(thread_ts, []))
+    if THREAD_SUMMARIES.get(thread_ts):
+        total += estimate_tokens(THREAD_SUMMARIES[thread_ts]) + 8
+    return total
+
+
+# ---------------------------------------
+# Historique
+# ---------------------------------------
 def get_thread_history(thread_ts: str) -> List[Dict]:
     """Récupère l'historique de conversation d'un thread."""
     return THREAD_MEMORY.get(thread_ts, [])
 
 
+def get_prompt_history(thread_ts: str) -> List[Dict]:
+    """Historique à envoyer au modèle : résumé des tours compactés (s'il existe) + tours récents."""
+    history = list(get_thread_history(thread_ts))
+    summary = THREAD_SUMMARIES.get(thread_ts)
+    if not summary:
+        return history
+    return [
+        {"role": "user", "content": f"[Résumé de la conversation précédente dans ce thread]\n{summary}"},
+        {"role": "assistant", "content": "Compris, je tiens compte de ce résumé."},
+    ] + history
+
+
 def add_to_thread_history(thread_ts: str, role: str, content: Any):
-    """Ajoute un message à l'historique d'un thread."""
-    if thread_ts not in THREAD_MEMORY:
-        THREAD_MEMORY[thread_ts] = []
-    THREAD_MEMORY[thread_ts].append({"role": role, "content": content})
-    if len(THREAD_MEMORY[thread_ts]) > HISTORY_LIMIT:
-        THREAD_MEMORY[thread_ts] = THREAD_MEMORY[thread_ts][-HISTORY_LIMIT:]
+    """Ajoute un message à l'historique d'un thread (puis applique le budget de tokens)."""
+    with _memory_lock:
+        THREAD_MEMORY.setdefault(thread_ts, []).append({"role": role, "content": content})
+    if role == "assistant":
+        _enforce_budget(thread_ts)
+
+
+def add_turn(thread_ts: str, prompt: str, answer: str, digests: Optional[List[str]] = None):
+    """Enregistre un tour complet (question + réponse + digests des tools utilisés)."""
+    add_to_thread_history(thread_ts, "user", prompt)
+    digest = format_digests(digests or [])
+    if digest:
+        content = [{"type": "text", "text": answer}, {"type": "text", "text": digest}]
+    else:
+        content = answer
+    add_to_thread_history(thread_ts, "assistant", content)
+
+
+def forget_thread(thread_ts: str):
+    """Efface toute la mémoire d'un thread (historique, résumé, requêtes)."""
+    with _memory_lock:
+        THREAD_MEMORY.pop(thread_ts, None)
+        THREAD_SUMMARIES.pop(thread_ts, None)
+        _MODEL_SUMMARIES.pop(thread_ts, None)
+        _PENDING.pop(thread_ts, None)
+        _FAILURES.pop(thread_ts, None)
+        LAST_QUERIES.pop(thread_ts, None)
+        THREAD_CHANNELS.pop(thread_ts, None)
+
+
+# ---------------------------------------
+# Digests des tools
+# ---------------------------------------
+def _one_line(text: str, limit: int) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def tool_digest(tool_name: str, tool_input: Dict[str, Any], result: Any) -> str:
+    """Digest compact d'un appel de tool : SQL (ou input) + aperçu du résultat."""
+    result_text = result if isinstance(result, str) else str(result)
+    if tool_name in QUERY_TOOLS:
+        sql = _one_line(tool_input.get("query", ""), 500)
+        return f"- {tool_name}: `{sql}`\n  → {_one_line(result_text, 350)}"
+    args = ", ".join(f"{k}={_one_line(str(v), 60)}" for k, v in (tool_input or {}).items())
+    return f"- {tool_name}({args}) → {_one_line(result_text, 150)}"
+
+
+def format_digests(digests: List[str]) -> str:
+    """Bloc 'données consultées' ajouté à la réponse stockée (plafonné à MEMORY_DIGEST_MAX_CHARS)."""
+    if not digests:
+        return ""
+    text = "📎 Données consultées pour cette réponse :\n" + "\n".join(digests)
+    if len(text) > MEMORY_DIGEST_MAX_CHARS:
+        text = text[:MEMORY_DIGEST_MAX_CHARS] + " …"
+    return text
+
+
+# ---------------------------------------
+# Budget & résumé glissant
+# ---------------------------------------
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content or []:
+        if isinstance(block, dict) and block.get("type") == "text":
+            parts.append(block.get("text", ""))
+    return "\n".join(parts)
 
 
+def _transcript(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for m in messages:
+        who = "Utilisateur" if m.get("role") == "user" else "Assistant"
+        lines.append(f"{who}: {_message_text(m)}")
+    return "\n\n".join(lines)
+
+
+def _summary_cap_chars() -> int:
+    """Taille max du résumé affiché (jamais plus d'un quart du budget du thread)."""
+    return min(MEMORY_SUMMARY_MAX_TOKENS, THREAD_TOKEN_BUDGET // 4) * 4
+
+
+def _compose_summary(thread_ts: str) -> str:
+    """Résumé du modèle + repli extractif des tours compactés pas encore résumés."""
+    cap = _summary_cap_chars()
+    summary = _MODEL_SUMMARIES.get(thread_ts, "")[:cap]
+    pending = _PENDING.get(thread_ts)
+    if pending:
+        room = max(cap - len(summary) - 1, 0)
+        extract = _one_line(_transcript(pending), 10 ** 9)
+        if room:
+            summary = (summary + "\n" if summary else "") + extract[-room:]
+    return summary
+
+
+def _truncate(message: Dict[str, Any], max_tokens: int) -> bool:
+    """Tronque en place le texte d'un message au-delà de `max_tokens` (dernier tour énorme)."""
+    if message_tokens(message) <= max_tokens:
+        return False
+    room = max_tokens * 4
+    content = message.get("content")
+    blocks = [{"type": "text", "text": content}] if isinstance(content, str) else content or []
+    kept = []
+    for block in blocks:
+        if not isinstance(block, dict) or block.get("type") != "text":
+            continue  # tool_use / tool_result : déjà résumés dans le digest
+        text = block.get("text", "")
+        if len(text) > room:
+            text = text[:room] + f" …[tronqué : {len(text) - room:,} caractères]"
+        kept.append({"type": "text", "text": text})
+        room = max(room - len(text), 0)
+        if not room:
+            break
+    if not kept:
+        return False
+    message["content"] = kept[0]["text"] if isinstance(content, str) else kept
+    return True
+
+
+def _enforce_budget(thread_ts: str):
+    """Retire les tours les plus anciens au-delà du budget et planifie leur résumé."""
+    with _memory_lock:
+        history = THREAD_MEMORY.get(thread_ts, [])
+        if thread_tokens(thread_ts) <= THREAD_TOKEN_BUDGET and len(history) <= HISTORY_LIMIT:
+            return
+
+        target = int(THREAD_TOKEN_BUDGET * COMPACTION_TARGET_RATIO)
+        evicted = []
+        # On garde toujours le dernier tour ; on retire par paires pour commencer sur un message user
+        while len(history) > 2 and (thread_tokens(thread_ts) > target or len(history) > HISTORY_LIMIT):
+            evicted.extend(history[:2])
+            del history[:2]
+        # Le dernier tour seul dépasse encore le budget (réponse ou collage géant) : on le tronque
+        if thread_tokens(thread_ts) > THREAD_TOKEN_BUDGET:
+            truncated = sum(_truncate(m, target // max(len(history), 1)) for m in history)
+            if truncated:
+                print(f"[Memory] thread {thread_ts[:10]}… : {truncated} message(s) tronqué(s) au budget")
+        if not evicted:
+            return
+
+        # Repli immédiat (extractif) : rien n'est perdu en attendant le résumé du modèle
+        _PENDING.setdefault(thread_ts, []).extend(evicted)
+        THREAD_SUMMARIES[thread_ts] = _compose_summary(thread_ts)
+        schedule = thread_ts not in _SCHEDULED
+        _SCHEDULED.add(thread_ts)
+
+    print(f"[Memory] thread {thread_ts[:10]}… : {len(evicted)} messages compactés "
+          f"(budget {THREAD_TOKEN_BUDGET} tok, reste {thread_tokens(thread_ts)} tok)")
+    if schedule:
+        _summary_executor.submit(_summarize, thread_ts)
+
+
+def _summarize(thread_ts: str):
+    """Résumé glissant par un petit modèle (thread d'arrière-plan, un seul job par thread)."""
+    from config import claude, claude_scheduler
+    from rate_limiter import PRIORITY_BACKGROUND
+
+    with _memory_lock:
+        _SCHEDULED.discard(thread_ts)
+        pending = _PENDING.pop(thread_ts, [])
+        previous = _MODEL_SUMMARIES.get(thread_ts, "")
+    if not pending:
+        return
+
+    transcript = _transcript(pending)
+    try:
+        # Priorité arrière-plan : passe après les questions en attente
+        with claude_scheduler.admitted(estimate_tokens(previous + transcript) + 100,
+                                       MEMORY_SUMMARY_MAX_TOKENS, PRIORITY_BACKGROUND) as ticket:
+            response = claude.messages.create(
+                model=MEMORY_SUMMARY_MODEL,
+                max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+                system=(
+                    "Tu résumes une conversation entre un analyste et un assistant data. "
+                    "Garde les questions posées, les chiffres clés obtenus, les filtres/périodes utilisés, "
+                    "les tables et requêtes SQL importantes et les décisions. Réponds en français, "
+                    "en puces concises, sans introduction."
+                ),
+                messages=[{
+                    "role": "user",
+                    "content": (f"Résumé existant :\n{previous or '(aucun)'}\n\n"
+                                f"Nouveaux échanges à intégrer :\n{transcript}")
+                }]
+            )
+            ticket.usage = response.usage
+        summary = "".join(getattr(b, "text", "") for b in response.content).strip()
+    except Exception as e:
+        print(f"[Memory] ⚠️ Résumé impossible pour {thread_ts[:10]}… (repli extractif conservé) : {e}")
+        _retry_summary(thread_ts, pending)
+        return
+
+    with _memory_lock:
+        _FAILURES.pop(thread_ts, None)
+        if thread_ts not in THREAD_MEMORY:
+            return  # thread oublié entre-temps
+        _MODEL_SUMMARIES[thread_ts] = summary
+        THREAD_SUMMARIES[thread_ts] = _compose_summary(thread_ts)
+    print(f"[Memory] résumé mis à jour pour {thread_ts[:10]}… ({estimate_tokens(summary)} tok)")
+
+
+def _retry_summary(thread_ts: str, pending: List[Dict[str, Any]]):
+    """Remet les tours en attente et replanifie le résumé (délais croissants, puis prochaine compaction)."""
+    with _memory_lock:
+        if thread_ts not in THREAD_MEMORY:
+            return
+        _PENDING[thread_ts] = pending + _PENDING.get(thread_ts, [])
+        failures = _FAILURES[thread_ts] = _FAILURES.get(thread_ts, 0) + 1
+        if failures > len(SUMMARY_RETRY_DELAYS_S) or thread_ts in _SCHEDULED:
+            return
+        _SCHEDULED.add(thread_ts)
+    delay = SUMMARY_RETRY_DELAYS_S[failures - 1]
+    print(f"[Memory] nouvelle tentative de résumé pour {thread_ts[:10]}… dans {delay}s")
+    timer = threading.Timer(delay, _summary_executor.submit, args=(_summarize, thread_ts))
+    timer.daemon = True
+    timer.start()
+
+
+# ---------------------------------------
+# Requêtes SQL
+# ---------------------------------------
 def add_query_to_thread(thread_ts: str, query: str):
     """Ajoute une requête SQL à l'historique d'un thread."""
     LAST_QUERIES.setdefault(thread_ts, []).append(query)
@@ -33,6 +332,17 @@ def get_last_queries(thread_ts: str) -> List[str]:
     return LAST_QUERIES.get(thread_ts, [])
 
 
+def set_thread_channel(thread_ts: str, channel: str):
+    """Mémorise le channel d'un thread (les tools ne reçoivent que thread_ts)."""
+    if channel:
+        THREAD_CHANNELS[thread_ts] = channel
+
+
+def get_thread_channel(thread_ts: str) -> Optional[str]:
+    """Channel Slack d'un thread, ou None s'il n'a jamais été vu."""
+    return THREAD_CHANNELS.get(thread_ts)
+
+
 def clear_last_queries(thread_ts: str):
     """Efface les requêtes SQL d'un thread."""
     if thread_ts in LAST_QUERIES:
@@ -0,0 +1,207 @@
+# tool_executor.py
+"""Exécution concurrente des tool_use d'un même tour de Claude."""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from config import MAX_TOOL_CHARS
+from tools_definitions import execute_tool
+from bigquery_tools import execute_bigquery_async, detect_project_from_sql
+from bq_jobs import JOB_MANAGER, current_thread, current_tool
+
+# ---------------------------------------
+# Plafonds de concurrence
+# ---------------------------------------
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "6"))
+
+# Chaque tool appartient à un groupe ; la concurrence est plafonnée par groupe.
+TOOL_GROUPS = {
+    "describe_table": "bigquery",
+    "query_bigquery": "bigquery",
+    "query_ops": "bigquery",
+    "query_crm": "bigquery",
+    "query_reviews": "bigquery",
+    "export_bigquery": "export",
+    "search_notion": "notion_read",
+    "read_notion_page": "notion_read",
+    "save_analysis_to_notion": "notion_write",
+    "append_table_to_notion_page": "notion_write",
+    "append_to_notion_context": "notion_write",
+}
+
+
+def _parse_group_limits(raw: str) -> Dict[str, int]:
+    """Parse TOOL_CONCURRENCY (ex: 'bigquery=4,notion_read=2,notion_write=1')."""
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            print(f"[Tools] ⚠️ TOOL_CONCURRENCY ignoré pour '{item}'")
+    return limits
+
+
+GROUP_LIMITS = {"bigquery": 4, "export": 2, "notion_read": 2, "notion_write": 1, "other": 2}
+GROUP_LIMITS.update(_parse_group_limits(os.getenv("TOOL_CONCURRENCY", "")))
+
+# Sémaphores process-wide : les plafonds valent pour toutes les conversations en cours
+_GROUP_SEMAPHORES = {name: threading.BoundedSemaphore(limit) for name, limit in GROUP_LIMITS.items()}
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+
+def _group_of(tool_name: str) -> str:
+    return TOOL_GROUPS.get(tool_name, "other")
+
+
+def _truncate(result: Any) -> Any:
+    """Tronquage défensif pour éviter d'inonder le modèle."""
+    if isinstance(result, str) and len(result) > MAX_TOOL_CHARS:
+        return result[:MAX_TOOL_CHARS] + " …\n(Contenu tronqué)"
+    return result
+
+
+def _interrupted(block, thread_ts: str) -> Optional[Dict[str, Any]]:
+    """Rattache le tool au thread Slack (jobs BigQuery annulables, étiquetés) ; tool_result d'arrêt si la requête est interrompue."""
+    current_thread.set(thread_ts)
+    current_tool.set(block.name)
+    stop = JOB_MANAGER.interrupted(JOB_MANAGER.current())
+    return {"type": "tool_result", "tool_use_id": block.id, "content": stop} if stop else None
+
+
+def _run_one(block, thread_ts: str) -> Dict[str, Any]:
+    """Exécute un tool_use (sous le sémaphore de son groupe) et construit le tool_result."""
+    stopped = _interrupted(block, thread_ts)
+    if stopped:
+        return stopped
+    group = _group_of(block.name)
+    with _GROUP_SEMAPHORES[group]:
+        started = time.time()
+        try:
+            result = execute_tool(block.name, block.input, thread_ts)
+        except Exception as e:
+            result = f"❌ Erreur {block.name}: {str(e)[:300]}"
+        print(f"[🔧] {block.name} terminé en {time.time() - started:.2f}s")
+    return {"type": "tool_result", "tool_use_id": block.id, "content": _truncate(result)}
+
+
+def _run_sequence(blocks: List, thread_ts: str) -> List[Dict[str, Any]]:
+    """Exécute une suite de tool_use dans l'ordre (groupes sérialisés, ex: écritures Notion)."""
+    return [_run_one(block, thread_ts) for block in blocks]
+
+
+def run_tool_calls(content: List, thread_ts: str,
+                   on_tool: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Exécute tous les tool_use d'un tour de Claude et retourne les tool_result dans l'ordre d'origine.
+
+    Les tools indépendants tournent en parallèle (la latence du tour = le tool le plus lent) ;
+    les groupes plafonnés à 1 (écritures Notion) sont exécutés séquentiellement, dans l'ordre
+    demandé par le modèle.
+    """
+    tool_blocks = [block for block in content if block.type == "tool_use"]
+    for block in tool_blocks:
+        print(f"[🔧] {block.name}")
+        if on_tool:
+            on_tool(block.name, block.input)
+
+    if len(tool_blocks) <= 1:
+        return [_run_one(block, thread_ts) for block in tool_blocks]
+
+    started = time.time()
+
+    # Regroupement : les groupes sérialisés forment une seule tâche ordonnée
+    results: Dict[str, Dict[str, Any]] = {}
+    futures = []
+    serialized: Dict[str, List] = {}
+    for block in tool_blocks:
+        group = _group_of(block.name)
+        if GROUP_LIMITS.get(group, 1) <= 1:
+            serialized.setdefault(group, []).append(block)
+        else:
+            futures.append(_executor.submit(lambda b=block: [_run_one(b, thread_ts)]))
+    for blocks in serialized.values():
+        futures.append(_executor.submit(_run_sequence, blocks, thread_ts))
+
+    for future in futures:
+        for tool_result in future.result():
+            results[tool_result["tool_use_id"]] = tool_result
+
+    print(f"[🔧] {len(tool_blocks)} tools exécutés en {time.time() - started:.2f}s (parallèle)")
+    return [results[block.id] for block in tool_blocks]
+
+
+# ---------------------------------------
+# Variante asyncio (cf. async_app.py)
+# ---------------------------------------
+_ASYNC_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+
+
+def _async_semaphore(group: str) -> asyncio.Semaphore:
+    """Sémaphores asyncio par groupe (créés dans la boucle qui les utilise)."""
+    if group not in _ASYNC_SEMAPHORES:
+        _ASYNC_SEMAPHORES[group] = asyncio.Semaphore(GROUP_LIMITS.get(group, 1))
+    return _ASYNC_SEMAPHORES[group]
+
+
+async def execute_tool_async(tool_name: str, tool_input: Dict[str, Any], thread_ts: str) -> str:
+    """
+    Exécute un tool sans bloquer la boucle asyncio.
+    Les requêtes BigQuery sont soumises puis sondées de façon coopérative ; les autres tools
+    (Notion, describe_table) passent par un thread le temps de l'appel.
+    """
+    if tool_name in ("query_bigquery", "query_ops", "query_crm", "query_reviews"):
+        query = tool_input.get("query")
+        if not query:
+            return f"❌ Erreur : query manquante dans l'input du tool {tool_name}. Veuillez fournir une requête SQL valide."
+        project = "default" if tool_name == "query_bigquery" else detect_project_from_sql(query)
+        return await execute_bigquery_async(query, thread_ts, project)
+    return await asyncio.to_thread(execute_tool, tool_name, tool_input, thread_ts)
+
+
+async def _run_one_async(block, thread_ts: str) -> Dict[str, Any]:
+    stopped = _interrupted(block, thread_ts)
+    if stopped:
+        return stopped
+    async with _async_semaphore(_group_of(block.name)):
+        started = time.time()
+        try:
+            result = await execute_tool_async(block.name, block.input, thread_ts)
+        except Exception as e:
+            result = f"❌ Erreur {block.name}: {str(e)[:300]}"
+        print(f"[🔧] {block.name} terminé en {time.time() - started:.2f}s")
+    return {"type": "tool_result", "tool_use_id": block.id, "content": _truncate(result)}
+
+
+async def run_tool_calls_async(content: List, thread_ts: str, on_tool=None) -> List[Dict[str, Any]]:
+    """Équivalent asyncio de run_tool_calls (mêmes plafonds par groupe, même ordre de sortie)."""
+    tool_blocks = [block for block in content if block.type == "tool_use"]
+    for block in tool_blocks:
+        print(f"[🔧] {block.name}")
+        if on_tool:
+            await on_tool(block.name, block.input)
+
+    async def _sequence(blocks):
+        return [await _run_one_async(block, thread_ts) for block in blocks]
+
+    tasks = []
+    serialized: Dict[str, List] = {}
+    for block in tool_blocks:
+        group = _group_of(block.name)
+        if GROUP_LIMITS.get(group, 1) <= 1:
+            serialized.setdefault(group, []).append(block)
+        else:
+            tasks.append(_sequence([block]))
+    tasks.extend(_sequence(blocks) for blocks in serialized.values())
+
+    results = {}
+    for batch in await asyncio.gather(*tasks):
+        for tool_result in batch:
+            results[tool_result["tool_use_id"]] = tool_result
+    return [results[block.id] for block in tool_blocks]
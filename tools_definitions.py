@@ -3,6 +3,7 @@
 
 from typing import Dict, Any
 from bigquery_tools import describe_table, execute_bigquery, detect_project_from_sql
+from export_tools import export_query
 from notion_tools import (
     search_notion,
     read_notion_page,
@@ -20,8 +21,9 @@ TOOLS = [
     {
         "name": "describe_table",
         "description": (
-            "Récupère la structure d'une table BigQuery (colonnes, types, descriptions). "
-            "Utilise cet outil quand tu dois savoir quelles colonnes existent."
+            "Récupère la structure d'une ou plusieurs tables BigQuery (colonnes, types, descriptions, "
+            "partitionnement). Utilise cet outil quand tu dois savoir quelles colonnes existent ; "
+            "passe toutes les tables utiles en un seul appel via table_names."
         ),
         "input_schema": {
             "type": "object",
@@ -30,16 +32,22 @@ TOOLS = [
                     "type": "string",
                     "description": "Nom complet de la table. Format accepté : "
                                    "'dataset.table' ou 'project.dataset.table'."
+                },
+                "table_names": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Plusieurs tables d'un coup (même format que table_name)."
                 }
-            },
-            "required": ["table_name"]
+            }
         }
     },
     {
         "name": "query_bigquery",
         "description": (
             "Exécute une requête SQL sur BigQuery dans le projet teamdata-291012. "
-            "À utiliser pour toutes les questions ventes, clients, box, user.*, sales.*, inter.*"
+            "À utiliser pour toutes les questions ventes, clients, box, user.*, sales.*, inter.*. "
+            "Les requêtes trop coûteuses sont refusées avant exécution (dry run) : "
+            "réécris-les en suivant les indications retournées."
         ),
         "input_schema": {
             "type": "object",
@@ -53,6 +61,34 @@ TOOLS = [
             "required": ["query"]
         }
     },
+    {
+        "name": "export_bigquery",
+        "description": (
+            "Exporte le résultat COMPLET d'une requête SQL en fichier (CSV gzip ou Parquet) envoyé "
+            "directement dans le thread Slack. À utiliser quand l'utilisateur veut une liste / un export "
+            "(plus de quelques dizaines de lignes) : pas de LIMIT, le fichier contient toutes les lignes. "
+            "Tous les projets (teamdata-291012, normalised-417010) sont acceptés."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "La requête SQL dont le résultat complet est à exporter (sans LIMIT)."
+                },
+                "format": {
+                    "type": "string",
+                    "enum": ["csv", "parquet"],
+                    "description": "Format du fichier (défaut: csv, compressé en gzip)."
+                },
+                "filename": {
+                    "type": "string",
+                    "description": "Nom du fichier sans extension (ex: 'churners_septembre')."
+                }
+            },
+            "required": ["query"]
+        }
+    },
     {
         "name": "query_reviews",
         "description": (
@@ -274,7 +310,7 @@ TOOLS = [
 def execute_tool(tool_name: str, tool_input: Dict[str, Any], thread_ts: str) -> str:
     """Routeur d'exécution des outils."""
     if tool_name == "describe_table":
-        table_name = tool_input.get("table_name")
+        table_name = tool_input.get("table_names") or tool_input.get("table_name")
         if not table_name:
             return "❌ Erreur : table_name manquant dans l'input du tool"
         return describe_table(table_name)
@@ -293,6 +329,18 @@ def execute_tool(tool_name: str, tool_input: Dict[str, Any], thread_ts: str) ->
         project = detect_project_from_sql(query)
         return execute_bigquery(query, thread_ts, project)
 
+    elif tool_name == "export_bigquery":
+        query = tool_input.get("query")
+        if not query:
+            return "❌ Erreur : query manquante dans l'input du tool export_bigquery."
+        return export_query(
+            query,
+            thread_ts,
+            detect_project_from_sql(query),
+            tool_input.get("format", "csv"),
+            tool_input.get("filename")
+        )
+
     elif tool_name == "search_notion":
         return search_notion(
             tool_input["query"],